@@ -4,7 +4,11 @@ from transformers import AutoTokenizer, AutoModel
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
-import subprocess
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent/"src"))
+from llm_backend import default_backend
 
 
 DB_dir = "FoodData_DB"
@@ -75,16 +79,11 @@ for nutrient, total in sorted(nutrient_totals.items()):
 prompt = "Why is the sky blue"
 
 
-result = subprocess.run(
-                ["ollama", "run", "gemma3:4b", prompt],
-                capture_output=True,
-                text=True,
-                encoding='utf-8'
-            )
+result = default_backend().generate(prompt, timeout=120)
 
-print(result.stdout.strip())
+print(result)
 
-query_embedding = result.stdout.strip()
+query_embedding = result
 
  # Load model
 model = SentenceTransformer('all-MiniLM-L6-v2')
@@ -107,7 +106,7 @@ collection.add(
 
 query = "Which foods are high in calcium?"
 
-# TODO replace get embedding with call to ollama using subprocess with above query
+# TODO replace get embedding with call to the LLM backend with above query
 #query_embedding = get_embedding(query)
 
 results = collection.query(
@@ -0,0 +1,286 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from collections import deque
+from typing import Dict, Iterator, List, Set
+
+from deepseek_model_inference import DeepSeekModelInference
+from generation_server import ContinuousBatchingServer, GenerationRequest
+from prefix_cache import PrefixKVCache
+from benchmark import load_inference
+
+logging.basicConfig(
+    level=logging.INFO,
+    handlers=[logging.StreamHandler()]
+)
+
+logger = logging.getLogger(__name__)
+
+# The instruction comes first so every meal prompt shares a token prefix the prefix cache can reuse
+DEFAULT_MEAL_TEMPLATE = ("Estimate the ingredient breakdown of this meal. List each ingredient with its "
+                         "approximate weight in grams and its percentage of the dish.\n"
+                         "Meal: {meal_name}\nDescription: {caption}\nPrevious analysis: {nutrition}")
+
+def read_prompts(path: Path) -> List[dict]:
+    """
+    Reads prompt records from a JSONL file.
+
+    Every line is an object with a "prompt" and optionally "id" (defaults to the line number),
+    "persona" and "max_tokens".
+    """
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record.setdefault("id", line_number)
+            records.append(record)
+    return records
+
+def meal_prompts(db_path: Path, template: str=DEFAULT_MEAL_TEMPLATE) -> List[dict]:
+    """
+    Builds one prompt per stored meal from the `meals` table of the web app database.
+
+    Args:
+        db_path (Path): SQLite database, e.g. "meals.db".
+        template (str): Format string receiving meal_name, caption, nutrition, username and timestamp.
+
+    Returns:
+        List[dict]: Records keyed by the meal's row id.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT id, username, meal_name, caption, timestamp, nutrition FROM meals").fetchall()
+    finally:
+        conn.close()
+
+    return [{"id": meal_id,
+             "prompt": template.format(meal_name=meal_name, caption=caption or "", nutrition=nutrition or "",
+                                       username=username, timestamp=timestamp)}
+            for meal_id, username, meal_name, caption, timestamp, nutrition in rows]
+
+def completed_ids(output_path: Path) -> Set[str]:
+    """
+    Returns the ids with a successful result in an output file; the output doubles as the checkpoint.
+
+    Records whose rows are all `{"id", "error"}` are not counted, so a rerun retries them; their
+    new result is appended after the error row (readers should keep the last row per id). A partially
+    written last line (interrupted run) is ignored, so that record is generated again.
+    """
+    done = set()
+    if not Path(output_path).exists():
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+                if "error" not in result:
+                    done.add(str(result["id"]))
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+    return done
+
+def _ends_with_newline(path: Path) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def prompt_length(inference, record: dict) -> int:
+    if isinstance(inference, DeepSeekModelInference):
+        return inference.tokenize(inference.query(record["prompt"], record.get("persona"))).shape[-1]
+    return inference.query(query=record["prompt"]).shape[-1]
+
+def _generate_batched(inference: DeepSeekModelInference, records: List[dict], batch_size: int,
+                      max_tokens: int, top_k: int, temperature: float) -> Iterator[dict]:
+    """
+    Runs DeepSeek records through the continuous batching scheduler, yielding results as they finish.
+    Records are admitted in the given order, so similarly long prompts decode side by side.
+    """
+    server = ContinuousBatchingServer(inference=inference, max_batch_size=batch_size)
+    finished = deque()
+    for record in records:
+        request = GenerationRequest(query=record["prompt"],
+                                    persona=record.get("persona"),
+                                    max_tokens=record.get("max_tokens", max_tokens),
+                                    top_k=top_k,
+                                    temperature=temperature)
+        server.enqueue(request).add_done_callback(lambda future, record=record, request=request:
+                                                  finished.append((record, request)))
+
+    remaining = len(records)
+    try:
+        while remaining:
+            server.step()
+            while finished:
+                record, request = finished.popleft()
+                remaining -= 1
+                error = request.future.exception()
+                if error is not None:
+                    logger.error(f".....Generation failed for {record['id']}: {error}")
+                    yield {"id": record["id"], "error": str(error)}
+                    continue
+                yield {"id": record["id"], "response": request.future.result(),
+                       "generated_tokens": len(request.generated_ids)}
+    finally:
+        # Resolves the requests still in flight if the run stops early
+        server.stop()
+
+def _generate_sequential(inference, records: List[dict], max_tokens: int, top_k: int,
+                         temperature: float) -> Iterator[dict]:
+    for record in records:
+        try:
+            events = list(inference.generate(query=record["prompt"], top_k=top_k, temperature=temperature,
+                                             max_tokens=record.get("max_tokens", max_tokens)))
+        except Exception as e:
+            logger.error(f".....Generation failed for {record['id']}: {e}")
+            yield {"id": record["id"], "error": str(e)}
+            continue
+        yield {"id": record["id"], "response": "".join(event.text for event in events).strip(),
+               "generated_tokens": len(events)}
+
+def run_batch(inference, records: List[dict], output_path: Path,
+              batch_size: int=4,
+              max_tokens: int=256,
+              top_k: int=10,
+              temperature: float=0.6) -> Dict[str, float]:
+    """
+    Generates a response for every record not yet in `output_path` and appends the results as JSONL.
+
+    Records are sorted by prompt length before scheduling, so sequences decoded together have similar
+    lengths (less padding in the batched attention, fewer slots idling behind one long prompt). Every
+    result is flushed to disk as soon as it completes; rerunning the same command resumes after the
+    last completed record.
+
+    DeepSeek models decode up to `batch_size` sequences at once through `ContinuousBatchingServer`.
+    The Gemma graph has no batch dimension, so Gemma records run one after another.
+
+    Args:
+        inference: Loaded `DeepSeekModelInference` or `GemmaModelInference`.
+        records (List[dict]): Prompt records as returned by `read_prompts` or `meal_prompts`.
+        output_path (Path): JSONL file receiving {"id", "response", "generated_tokens"} or {"id", "error"}.
+            Failed records are retried by the next run.
+        batch_size (int): Sequences decoded concurrently (DeepSeek only).
+        max_tokens (int): Default token budget per record.
+        top_k (int): Limits token sampling to top-k most probable choices.
+        temperature (float): Sampling temperature.
+
+    Returns:
+        Dict[str, float]: Records processed, skipped and failed, generated tokens and elapsed seconds.
+    """
+    done = completed_ids(output_path)
+    remaining = [record for record in records if str(record["id"]) not in done]
+    if len(remaining) < len(records):
+        logger.info(f"Resuming: {len(records) - len(remaining)} of {len(records)} records already completed")
+
+    remaining.sort(key=lambda record: prompt_length(inference, record))
+
+    if isinstance(inference, DeepSeekModelInference):
+        results = _generate_batched(inference, remaining, batch_size=batch_size, max_tokens=max_tokens,
+                                    top_k=top_k, temperature=temperature)
+    else:
+        results = _generate_sequential(inference, remaining, max_tokens=max_tokens, top_k=top_k,
+                                       temperature=temperature)
+
+    stats = {"processed": 0, "skipped": len(records) - len(remaining), "failed": 0, "generated_tokens": 0}
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as f:
+        if f.tell() and not _ends_with_newline(output_path):
+            # Terminate the line cut off by an interrupted run
+            f.write("\n")
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+            stats["processed"] += 1
+            stats["failed"] += "error" in result
+            stats["generated_tokens"] += result.get("generated_tokens", 0)
+            if stats["processed"] % 10 == 0:
+                logger.info(f"{stats['processed']}/{len(remaining)} records completed")
+
+    stats["elapsed_s"] = time.perf_counter() - start
+    return stats
+
+def batch_generate():
+
+    parser = argparse.ArgumentParser(description="Offline batch generation over a JSONL file or the meals database")
+
+    parser.add_argument("--input",
+                        type=str,
+                        default="",
+                        help="JSONL file with one {\"id\", \"prompt\"} object per line")
+    parser.add_argument("--meals_db",
+                        type=str,
+                        default="",
+                        help="Re-analyze every meal stored in this SQLite database (e.g. meals.db) instead of --input")
+    parser.add_argument("--template",
+                        type=str,
+                        default="",
+                        help="Optional text file with the meal prompt template ({meal_name}, {caption}, {nutrition})")
+    parser.add_argument("--output",
+                        type=str,
+                        default="batch_results.jsonl",
+                        help="JSONL file receiving the results; also the checkpoint used to resume")
+    parser.add_argument("--model",
+                        type=str,
+                        default="deepseek_7b",
+                        help="Models Available: deepseek_7b, deepseek_1.5b, gemma-3_1b")
+    parser.add_argument("--processor",
+                        type=str,
+                        default="npu",
+                        help="Processors Available: Hexagon(NPU), CPU")
+    parser.add_argument("--batch_size",
+                        type=int,
+                        default=4,
+                        help="Sequences decoded concurrently")
+    parser.add_argument("--max_tokens",
+                        type=int,
+                        default=256,
+                        help="Max Tokens to Generate per record")
+    parser.add_argument("--temperature",
+                        type=float,
+                        default=0.6,
+                        help="Temperature")
+    parser.add_argument("--top_k",
+                        type=int,
+                        default=10,
+                        help="Top K Sampling")
+    parser.add_argument("--prefix_cache_mb",
+                        type=int,
+                        default=256,
+                        help="Prefix KV cache size reusing the shared prompt prefix (0 disables it)")
+
+    args = parser.parse_args()
+
+    if args.meals_db:
+        template = DEFAULT_MEAL_TEMPLATE
+        if args.template:
+            with open(args.template, "r", encoding="utf-8") as f:
+                template = f.read()
+        records = meal_prompts(Path(args.meals_db), template=template)
+    elif args.input:
+        records = read_prompts(Path(args.input))
+    else:
+        parser.error("Provide --input or --meals_db")
+
+    inference, load_time = load_inference(model=args.model, processor=args.processor)
+    logger.info(f"Loaded {args.model} in {load_time:.1f} s")
+    if args.prefix_cache_mb:
+        inference.prefix_cache = PrefixKVCache(max_bytes=args.prefix_cache_mb * 1024**2)
+
+    stats = run_batch(inference, records, output_path=Path(args.output), batch_size=args.batch_size,
+                      max_tokens=args.max_tokens, top_k=args.top_k, temperature=args.temperature)
+    print(f"Processed {stats['processed']} records ({stats['failed']} failed, {stats['skipped']} already done) "
+          f"in {stats['elapsed_s']:.1f} s, {stats['generated_tokens']} tokens generated")
+
+if __name__=="__main__":
+    batch_generate()
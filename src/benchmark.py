@@ -0,0 +1,273 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import json
+import logging
+import multiprocessing
+import platform
+import time
+import numpy as np
+import onnxruntime as ort
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from model_loader import ModelLoader
+from deepseek_model_inference import DeepSeekModelInference
+from gemma_model_inference import GemmaModelInference
+from streaming import TokenEvent
+from instrumentation import NULL_TRACER, Tracer
+from profiling_report import collect_profiles
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROMPTS = [
+    "Give me a high protein breakfast idea.",
+    "How many calories are in an avocado?",
+    "Provide me a step by step recipe for chicken, be sure to include cook times, ingredients, and preparation.",
+    "Why are dogs so content with just being with their person?",
+]
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Returns the peak resident set size of this process in MB, or None if it cannot be measured.
+
+    Uses `resource` on Linux/macOS and `psutil` (if installed) on Windows. The value is a process-wide
+    high-water mark, so it never decreases; `benchmark` therefore runs every configuration in its own
+    process.
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+        memory = psutil.Process().memory_info()
+        return getattr(memory, "peak_wset", memory.rss) / 1024**2
+    except ImportError:
+        return None
+
+def summarize_generation(events: List[TokenEvent], prompt_length: int) -> Dict[str, float]:
+    """
+    Computes latency and throughput figures for a single streamed generation.
+
+    The first token is produced by prefill, so time-to-first-token measures prompt processing and every
+    later token measures one decode step. Decode throughput counts the tokens actually generated, which
+    is fewer than `max_tokens` when generation stops at an end-of-sequence token.
+
+    Args:
+        events (List[TokenEvent]): Events yielded by `generate`, in order.
+        prompt_length (int): Number of prompt tokens.
+
+    Returns:
+        Dict[str, float]: ttft_s, prefill_tokens_per_s, decode_tokens_per_s, generated_tokens and
+            decode_latencies_ms (the per-token decode latencies).
+    """
+    ttft = events[0].elapsed
+    decode_latencies = np.diff([event.timestamp for event in events])
+    decode_time = float(decode_latencies.sum())
+    return {"ttft_s": ttft,
+            "prefill_tokens_per_s": prompt_length / ttft if ttft > 0 else float("nan"),
+            "decode_tokens_per_s": len(decode_latencies) / decode_time if decode_time > 0 else float("nan"),
+            "generated_tokens": len(events),
+            "decode_latencies_ms": (decode_latencies * 1000).tolist()}
+
+def stream(inference, prompt: str, max_tokens: int, io_binding: bool, top_k: int=10, temperature: float=0.6):
+    """
+    Starts a streamed generation and returns (events iterator, prompt length) for either inference class.
+    """
+    if isinstance(inference, DeepSeekModelInference):
+        prompt_length = inference.tokenize(inference.query(prompt)).shape[-1]
+        events = inference.generate(query=prompt, top_k=top_k, temperature=temperature,
+                                    max_tokens=max_tokens, io_binding=io_binding)
+    else:
+        prompt_length = inference.query(query=prompt).shape[-1]
+        events = inference.generate(query=prompt, top_k=top_k, temperature=temperature, max_tokens=max_tokens)
+    return events, prompt_length
+
+def load_inference(model: str, processor: str, seed: int=0, tracer=NULL_TRACER, enable_profiling: bool=False):
+    """
+    Loads every graph of `model` and builds the matching inference object.
+
+    Returns:
+        Tuple[object, float]: The inference object and the time in seconds until all graphs were loaded.
+    """
+    start = time.perf_counter()
+    iLoad = ModelLoader(model=model, processor=processor, model_type="default")
+    graphs = iLoad.graphs
+    model_sessions = iLoad.load_graphs(htp_performance_mode="sustained_high_performance",
+                                       enable_profiling=enable_profiling)
+    for session in model_sessions.values():
+        session.wait()
+    load_time = time.perf_counter() - start
+
+    inference_class = DeepSeekModelInference if "deepseek" in model.lower() else GemmaModelInference
+    inference = inference_class(model_sessions=model_sessions,
+                                tokenizer=graphs["TOKENIZER"],
+                                model_subdirectory=iLoad.model_subdirectory_path,
+                                model_meta=graphs["META_DATA"],
+                                seed=seed,
+                                tracer=tracer)
+    return inference, load_time
+
+def run_benchmark(inference, prompts: List[str], max_tokens: int, io_binding: bool,
+                  runs: int=1, warmup: int=1) -> Dict[str, float]:
+    """
+    Runs every prompt `runs` times (after `warmup` untimed generations) and aggregates the results.
+
+    Returns:
+        Dict[str, float]: Mean/percentile TTFT, decode latency percentiles (ms), mean prefill and
+            decode throughput, total generated tokens and peak RSS.
+    """
+    for _ in range(warmup):
+        events, _ = stream(inference, prompts[0], max_tokens=max_tokens, io_binding=io_binding)
+        for _ in events:
+            pass
+
+    results = []
+    for _ in range(runs):
+        for prompt in prompts:
+            events, prompt_length = stream(inference, prompt, max_tokens=max_tokens, io_binding=io_binding)
+            results.append(summarize_generation(list(events), prompt_length))
+
+    ttfts = np.array([result["ttft_s"] for result in results])
+    latencies = np.concatenate([result["decode_latencies_ms"] for result in results]) if results else np.array([])
+    return {"generations": len(results),
+            "generated_tokens": int(sum(result["generated_tokens"] for result in results)),
+            "ttft_mean_s": float(ttfts.mean()),
+            "ttft_p50_s": float(np.percentile(ttfts, 50)),
+            "ttft_p90_s": float(np.percentile(ttfts, 90)),
+            "prefill_tokens_per_s": float(np.nanmean([result["prefill_tokens_per_s"] for result in results])),
+            "decode_tokens_per_s": float(np.nanmean([result["decode_tokens_per_s"] for result in results])),
+            "decode_latency_p50_ms": float(np.percentile(latencies, 50)) if latencies.size else None,
+            "decode_latency_p90_ms": float(np.percentile(latencies, 90)) if latencies.size else None,
+            "decode_latency_p99_ms": float(np.percentile(latencies, 99)) if latencies.size else None,
+            "peak_rss_mb": peak_rss_mb()}
+
+def _format_ms(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.1f} ms"
+
+def _format_mb(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.0f} MB"
+
+def benchmark_configuration(model: str, processor: str, io_binding: bool, prompts: List[str],
+                            max_tokens: int, runs: int, warmup: int,
+                            trace: str="", profile: bool=False) -> Dict[str, object]:
+    """
+    Loads `model` and benchmarks one configuration, see `run_benchmark`.
+
+    `benchmark` calls this in a fresh process per configuration, so peak RSS and load time are not
+    inherited from previously benchmarked models.
+
+    Returns:
+        Dict[str, object]: The `run_benchmark` figures plus model, io_binding, load_time_s and, when
+            requested, stage histograms and per-graph profiles.
+    """
+    tracer = Tracer() if trace else NULL_TRACER
+    inference, load_time = load_inference(model=model, processor=processor, tracer=tracer,
+                                          enable_profiling=profile)
+    logger.info(f"Benchmarking {model} (io_binding={io_binding})")
+    result = run_benchmark(inference, prompts, max_tokens=max_tokens, io_binding=io_binding,
+                           runs=runs, warmup=warmup)
+    result.update({"model": model, "io_binding": io_binding, "load_time_s": load_time})
+    if trace:
+        trace_dir = Path(trace)
+        trace_dir.mkdir(parents=True, exist_ok=True)
+        tracer.export_chrome_trace(trace_dir/f"{model}_io{int(io_binding)}.trace.json")
+        result["stages"] = tracer.histograms()
+        print(tracer.summary())
+    if profile:
+        profiles = collect_profiles(inference.session_mapper)
+        for graph_profile in profiles.values():
+            print(graph_profile.format())
+        result["profiles"] = {graph: graph_profile.to_dict() for graph, graph_profile in profiles.items()}
+    return result
+
+def benchmark():
+
+    parser = argparse.ArgumentParser(description="Token throughput benchmark for the LLM inference stack")
+
+    parser.add_argument("--models",
+                        type=str,
+                        nargs="+",
+                        default=["deepseek_1.5b", "deepseek_7b", "gemma-3_1b"],
+                        help="Models to benchmark")
+    parser.add_argument("--processor",
+                        type=str,
+                        default="npu",
+                        help="Processors Available: Hexagon(NPU), CPU")
+    parser.add_argument("--prompts",
+                        type=str,
+                        default="",
+                        help="Optional JSON file containing a list of prompts")
+    parser.add_argument("--max_tokens",
+                        type=int,
+                        default=100,
+                        help="Max Tokens to Generate")
+    parser.add_argument("--runs",
+                        type=int,
+                        default=3,
+                        help="Timed passes over the prompt set")
+    parser.add_argument("--warmup",
+                        type=int,
+                        default=1,
+                        help="Untimed generations before measuring")
+    parser.add_argument("--trace",
+                        type=str,
+                        default="",
+                        help="Optional directory receiving a Chrome trace and stage histograms per configuration")
+    parser.add_argument("--profile",
+                        action="store_true",
+                        help="Enable ONNX Runtime profiling and report hottest ops and CPU fallback per graph")
+    parser.add_argument("--output",
+                        type=str,
+                        default="benchmark_results.json",
+                        help="JSON file receiving the results")
+
+    args = parser.parse_args()
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts, "r") as f:
+            prompts = json.load(f)
+
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "platform": platform.platform(),
+              "machine": platform.machine(),
+              "onnxruntime": ort.__version__,
+              "max_tokens": args.max_tokens,
+              "runs": args.runs,
+              "prompts": prompts,
+              "results": []}
+
+    # Spawned rather than forked, so no loaded sessions or allocations carry over between configurations
+    context = multiprocessing.get_context("spawn")
+    for model in args.models:
+        # IO binding only applies to the DeepSeek decode loop
+        io_binding_modes = [True, False] if "deepseek" in model.lower() else [False]
+        for io_binding in io_binding_modes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(benchmark_configuration, model=model, processor=args.processor,
+                                         io_binding=io_binding, prompts=prompts, max_tokens=args.max_tokens,
+                                         runs=args.runs, warmup=args.warmup, trace=args.trace,
+                                         profile=args.profile).result()
+            report["results"].append(result)
+            print(f"{model:<16} io_binding={str(io_binding):<5} "
+                  f"TTFT p50 {result['ttft_p50_s']*1000:8.1f} ms | "
+                  f"prefill {result['prefill_tokens_per_s']:8.1f} tok/s | "
+                  f"decode {result['decode_tokens_per_s']:6.1f} tok/s "
+                  f"(p50 {_format_ms(result['decode_latency_p50_ms'])}, p99 {_format_ms(result['decode_latency_p99_ms'])}) | "
+                  f"peak RSS {_format_mb(result['peak_rss_mb'])}")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+if __name__=="__main__":
+    benchmark()
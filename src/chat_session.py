@@ -0,0 +1,329 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import numpy as np
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from constrained_decoding import JSONConstraint
+from deepseek_model_inference import DeepSeekModelInference
+from kv_cache import KV_PRECISIONS, QuantizedTensor, dequantize_kv, quantize_kv
+from streaming import StreamClock, TokenEvent
+
+logger = logging.getLogger(__name__)
+
+END_OF_SENTENCE = "<｜end▁of▁sentence｜>"
+
+class ChatSession():
+    """
+    A multi-turn conversation that keeps its KV cache between turns.
+
+    Only the new user turn is prefilled on each call, on top of the keys/values of the previous turns.
+    The last sampled token of a reply is never run through the model during generation, so it is kept
+    as `pending_token` and prefilled together with the next turn; a reply cut short by `max_tokens` is
+    closed with `<｜end▁of▁sentence｜>` as the chat template expects.
+
+    An idle session can be spilled to disk, dropping its cache from memory. Spilled tensors are
+    restored memory-mapped, so only the pages the next turn actually reads are loaded.
+
+    Args:
+        inference (DeepSeekModelInference): Model used for every turn. It may be shared between sessions,
+            but must not run two turns at once.
+        persona (Optional[str]): Persona applied to the first turn.
+        session_id (Optional[str]): Identifier, also used as the spill directory name. Random if omitted.
+
+    Attributes:
+        length (int): Number of positions held by the KV cache.
+        turns (List[dict]): {"user": ..., "assistant": ...} for every completed turn.
+        spill_path (Optional[Path]): Directory holding the spilled cache, while spilled.
+    """
+
+    def __init__(self, inference: DeepSeekModelInference, persona: Optional[str]=None,
+                 session_id: Optional[str]=None):
+        self.inference = inference
+        self.persona = persona
+        self.session_id = session_id or uuid.uuid4().hex
+        self.kv_cache: Dict[str, np.ndarray] = {}
+        self.length = 0
+        self.pending_token: Optional[int] = None
+        self.turns: List[dict] = []
+        self.spill_path: Optional[Path] = None
+        self.last_used = time.monotonic()
+
+    @property
+    def spilled(self) -> bool:
+        return self.spill_path is not None
+
+    def turn_tokens(self, message: str) -> np.array:
+        """
+        Token IDs appended to the cache for a new user message.
+
+        Args:
+            message (str): User message.
+
+        Returns:
+            np.array: Token IDs of shape (1, turn_length); the whole formatted prompt on the first turn.
+        """
+        if self.pending_token is None:
+            return self.inference.tokenize(self.inference.query(message, self.persona))
+
+        prompt = self.inference.query(message)
+        if self.pending_token != self.inference.eos_token_id:
+            prompt = END_OF_SENTENCE + prompt
+        token_ids = self.inference.tokenizer.encode(prompt, add_special_tokens=False).ids
+        return np.array([[self.pending_token] + token_ids], dtype=np.int64)
+
+    def send(self, message: str,
+             top_k: int=10,
+             temperature: float=0.6,
+             max_tokens: int=100,
+             repetition_penalty: float=1.1,
+             io_binding: bool=True,
+             top_p: Optional[float]=None,
+             min_p: Optional[float]=None,
+             cancel: Optional[threading.Event]=None,
+             constraint: Optional[JSONConstraint]=None) -> Iterator[TokenEvent]:
+        """
+        Streams the reply to `message`, restoring a spilled cache first.
+
+        Arguments other than `message` are the same as `DeepSeekModelInference.generate`.
+
+        Yields:
+            TokenEvent: Each generated token with its text delta and timing.
+
+        If generation fails, the exception is re-raised and the session is left as it was before the
+        message; the turn is not recorded.
+
+        Raises:
+            ValueError: If the conversation no longer fits in the model's context length.
+        """
+        clock = StreamClock()
+        if self.spilled:
+            self.restore()
+
+        inference = self.inference
+        token_ids = self.turn_tokens(message)
+        inference.kv_cache = self.kv_cache
+        inference.output_hidden_states_buffer = None
+
+        reply = ""
+        events = None
+        finished = False
+        try:
+            with inference.tracer.span("prefill", category="step", start=self.length):
+                logits = inference.prefill(token_ids=token_ids, start=self.length)
+            events = inference.decode_stream(logits=logits, sequence_length=self.length + token_ids.shape[-1],
+                                             top_k=top_k, temperature=temperature, max_tokens=max_tokens,
+                                             repetition_penalty=repetition_penalty, io_binding=io_binding,
+                                             top_p=top_p, min_p=min_p, cancel=cancel, clock=clock,
+                                             keep_kv=True, constraint=constraint)
+            for event in events:
+                reply += event.text
+                yield event
+            finished = True
+        except GeneratorExit:
+            # The consumer stopped reading: the turn ends after the tokens it received, like a cancel
+            finished = True
+            raise
+        finally:
+            if events is not None:
+                # Copies the decoded keys/values back into inference.kv_cache
+                events.close()
+            kv_cache, inference.kv_cache = inference.kv_cache, {}
+            if finished:
+                self.kv_cache = kv_cache
+                self.length, self.pending_token = inference.kv_length, inference.last_token_id
+                self.turns.append({"user": message, "assistant": reply})
+            # On an error the session keeps the cache and length of its previous turns
+            self.last_used = time.monotonic()
+
+    def chat(self, message: str, **kwargs) -> str:
+        """
+        Sends `message` and returns the whole reply. Accepts the keyword arguments of `send`.
+        """
+        return "".join(event.text for event in self.send(message, **kwargs))
+
+    def spill(self, directory: Path, precision: str="fp32") -> Path:
+        """
+        Writes the KV cache to `directory/session_id` and releases it from memory.
+
+        Args:
+            directory (Path): Parent directory of the spill files.
+            precision (str): Storage precision, one of "fp32", "fp16", "int8".
+
+        Returns:
+            Path: Directory holding the spilled session.
+
+        Raises:
+            ValueError: If `precision` is not supported.
+        """
+        if precision not in KV_PRECISIONS:
+            raise ValueError(f"Unsupported KV precision: {precision}. Select {' | '.join(KV_PRECISIONS)}")
+        if self.spilled:
+            return self.spill_path
+
+        path = Path(directory)/self.session_id
+        path.mkdir(parents=True, exist_ok=True)
+        # After `restore`, fp32 tensors are still memory-mapped from the files being replaced: write next to
+        # them and move the new files into place once the mapped arrays are released
+        written = []
+        dtype = None
+        # The live cache may already be held at the inference's kv_precision
+        for name, cache in quantize_kv(dequantize_kv(self.kv_cache), precision).items():
+            if isinstance(cache, QuantizedTensor):
+                arrays = {name: cache.data, f"{name}.scale": cache.scale}
+                dtype = np.dtype(cache.dtype).name
+            else:
+                arrays = {name: cache}
+                dtype = cache.dtype.name
+            for stem, array in arrays.items():
+                if array is not None:
+                    np.save(path/f"{stem}.tmp.npy", array)
+                    written.append(stem)
+            cache = arrays = None
+
+        names = list(self.kv_cache)
+        self.kv_cache = {}
+        for stem in written:
+            os.replace(path/f"{stem}.tmp.npy", path/f"{stem}.npy")
+
+        meta = {"session_id": self.session_id,
+                "persona": self.persona,
+                "length": self.length,
+                "pending_token": self.pending_token,
+                "turns": self.turns,
+                "precision": precision,
+                "dtype": dtype,
+                "names": names}
+        with open(path/"session.json", "w") as f:
+            json.dump(meta, f)
+
+        self.spill_path = path
+        logger.info(f"Spilled chat session {self.session_id} ({self.length} positions) to {path}")
+        return path
+
+    def restore(self) -> None:
+        """
+        Maps a spilled cache back in. fp32 tensors stay memory-mapped; fp16/int8 tensors are expanded
+        to the model's precision.
+        """
+        if not self.spilled:
+            return
+
+        self.kv_cache = self._load(self.spill_path)
+        self.spill_path = None
+        self.last_used = time.monotonic()
+
+    @classmethod
+    def load(cls, inference: DeepSeekModelInference, path: Path) -> "ChatSession":
+        """
+        Recreates a spilled session from its directory, e.g. after a restart.
+
+        Args:
+            inference (DeepSeekModelInference): Model used for the following turns.
+            path (Path): Directory returned by `spill`.
+
+        Returns:
+            ChatSession: The session, still spilled until its next turn or `restore`.
+        """
+        with open(Path(path)/"session.json", "r") as f:
+            meta = json.load(f)
+        session = cls(inference=inference, persona=meta["persona"], session_id=meta["session_id"])
+        session.length = meta["length"]
+        session.pending_token = meta["pending_token"]
+        session.turns = meta["turns"]
+        session.spill_path = Path(path)
+        return session
+
+    @staticmethod
+    def _load(path: Path) -> Dict[str, np.ndarray]:
+        with open(path/"session.json", "r") as f:
+            meta = json.load(f)
+
+        kv_cache = {}
+        for name in meta["names"]:
+            data = np.load(path/f"{name}.npy", mmap_mode="r")
+            if meta["precision"] == "fp32":
+                kv_cache[name] = data
+                continue
+            scale_path = path/f"{name}.scale.npy"
+            scale = np.load(scale_path) if scale_path.exists() else None
+            kv_cache[name] = QuantizedTensor(data=data, scale=scale, dtype=np.dtype(meta["dtype"]))
+        return dequantize_kv(kv_cache)
+
+
+class ChatSessionStore():
+    """
+    Keeps many chat sessions on one model, with at most `max_resident` caches in memory.
+
+    When a turn would leave more than `max_resident` sessions in memory, the least recently used ones are
+    spilled to `spill_directory`. Turns are serialized, since the sessions share one model.
+
+    Args:
+        inference (DeepSeekModelInference): Model shared by every session.
+        spill_directory (Path): Where idle sessions are spilled.
+        max_resident (int): Sessions whose KV cache stays in memory.
+        precision (str): Spill precision, one of "fp32", "fp16", "int8".
+    """
+
+    def __init__(self, inference: DeepSeekModelInference, spill_directory: Path, max_resident: int=4,
+                 precision: str="fp16"):
+        if precision not in KV_PRECISIONS:
+            raise ValueError(f"Unsupported KV precision: {precision}. Select {' | '.join(KV_PRECISIONS)}")
+        self.inference = inference
+        self.spill_directory = Path(spill_directory)
+        self.max_resident = max_resident
+        self.precision = precision
+        self.sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def session(self, session_id: Optional[str]=None, persona: Optional[str]=None) -> ChatSession:
+        """
+        Returns the session `session_id`, reloading it from the spill directory or creating it if needed.
+        """
+        with self._lock:
+            if session_id in self.sessions:
+                return self.sessions[session_id]
+            spill_path = self.spill_directory/session_id if session_id else None
+            if spill_path is not None and (spill_path/"session.json").exists():
+                session = ChatSession.load(self.inference, spill_path)
+            else:
+                session = ChatSession(inference=self.inference, persona=persona, session_id=session_id)
+            self.sessions[session.session_id] = session
+            return session
+
+    def chat(self, session_id: str, message: str, **kwargs) -> str:
+        """
+        Sends `message` in session `session_id` and returns the reply, spilling idle sessions afterwards.
+        """
+        session = self.session(session_id)
+        with self._lock:
+            reply = session.chat(message, **kwargs)
+            self.sessions.move_to_end(session.session_id)
+            self._spill_idle()
+        return reply
+
+    def spill_idle(self, max_idle_s: float) -> int:
+        """
+        Spills every resident session unused for `max_idle_s` seconds.
+
+        Returns:
+            int: Number of sessions spilled.
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = [session for session in self.sessions.values()
+                    if not session.spilled and now - session.last_used >= max_idle_s]
+            for session in idle:
+                session.spill(self.spill_directory, precision=self.precision)
+        return len(idle)
+
+    def _spill_idle(self) -> None:
+        resident = [session for session in self.sessions.values() if not session.spilled]
+        for session in resident[:max(0, len(resident) - self.max_resident)]:
+            session.spill(self.spill_directory, precision=self.precision)
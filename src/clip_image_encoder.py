@@ -0,0 +1,303 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import logging
+import time
+import numpy as np
+import onnxruntime as ort
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterator, List, Optional, Sequence, Union
+
+from clip_preprocessing import ImageInput, preprocess_batch, preprocess_image
+from kv_cache import ONNX_KV_DTYPES
+from model_loader import ModelLoader
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLIP_MODEL = "clip_vit_l14"
+HF_CLIP_MODEL = "openai/clip-vit-large-patch14"
+
+# models.json model types of the exported variants
+CLIP_VARIANTS = {"fp32": "DEFAULT", "fp16": "FP16", "int8": "QUANTIZED"}
+
+class CLIPImageEncoder():
+    """
+    CLIP ViT-L/14 vision tower exported to ONNX, returning the projected `image_embeds`.
+
+    The session comes from `ModelLoader`, so the encoder runs on the QNN NPU or the CPU execution
+    provider without torch. The fp32, fp16 and int8 (QDQ) exports are registered in models.json
+    under the model types "DEFAULT", "FP16" and "QUANTIZED"; `export_clip_vision` creates them.
+
+    Args:
+        session (ort.InferenceSession): Vision tower session with a `pixel_values` input of shape
+            (batch, 3, image_size, image_size).
+        image_size (int): Side of the square model input.
+
+    Attributes:
+        input_dtype (np.dtype): Pixel dtype expected by the session (float16 for graphs exported without
+            float32 inputs).
+        dimension (int): Embedding dimension.
+        batch_size (Optional[int]): Static batch of the graph; inputs are split or padded to it.
+            None when the batch dimension is symbolic.
+    """
+
+    def __init__(self, session: ort.InferenceSession, image_size: int=224):
+        self.session = session
+        self.image_size = image_size
+
+        model_input = session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_dtype = ONNX_KV_DTYPES.get(model_input.type, np.float32)
+        self.output_name = session.get_outputs()[0].name
+        self.dimension = session.get_outputs()[0].shape[-1]
+        # QNN graphs have a static batch; symbolic batch dimensions (CPU exports) accept any batch
+        batch = model_input.shape[0]
+        self.batch_size = batch if isinstance(batch, int) and batch > 0 else None
+
+    @classmethod
+    def from_model(cls, model: str=DEFAULT_CLIP_MODEL, processor: str="npu", variant: str="fp32",
+                   **load_options) -> "CLIPImageEncoder":
+        """
+        Loads an exported variant with `ModelLoader`.
+
+        Args:
+            model (str): Model name in models.json.
+            processor (str): "npu" or "cpu".
+            variant (str): "fp32", "fp16" or "int8".
+            **load_options: Keyword arguments forwarded to `ModelLoader.load_model`.
+
+        Returns:
+            CLIPImageEncoder: The encoder.
+
+        Raises:
+            ValueError: If `variant` is not supported.
+        """
+        if variant not in CLIP_VARIANTS:
+            raise ValueError(f"Unsupported CLIP variant: {variant}. Select {' | '.join(CLIP_VARIANTS)}")
+        loader = ModelLoader(model=model, processor=processor, model_type=CLIP_VARIANTS[variant])
+        graphs = loader.graphs
+        start = time.perf_counter()
+        session = loader.load_model(graphs["MODEL"], **load_options)
+        logger.info(f"Loaded {model} ({variant}) on {loader.processor} in {time.perf_counter() - start:.1f} s")
+        return cls(session, image_size=graphs.get("META_DATA", {}).get("image_size", 224))
+
+    def preprocess(self, image: ImageInput) -> np.ndarray:
+        return preprocess_image(image, image_size=self.image_size)
+
+    def embed_pixels(self, pixel_values: np.ndarray) -> np.ndarray:
+        """
+        Runs the vision tower on preprocessed pixels.
+
+        Args:
+            pixel_values (np.ndarray): Pixels of shape (batch, 3, image_size, image_size).
+
+        Returns:
+            np.ndarray: float32 embeddings of shape (batch, dimension).
+        """
+        pixel_values = np.ascontiguousarray(pixel_values, dtype=self.input_dtype)
+        count = pixel_values.shape[0]
+        if self.batch_size is None or count == self.batch_size:
+            embeddings = self.session.run([self.output_name], {self.input_name: pixel_values})[0]
+            return embeddings.astype(np.float32, copy=False)
+
+        # Static batch: run full batches, zero-padding the last one
+        embeddings = np.empty((count, self.dimension), dtype=np.float32)
+        batch = np.zeros((self.batch_size,) + pixel_values.shape[1:], dtype=self.input_dtype)
+        for start in range(0, count, self.batch_size):
+            chunk = pixel_values[start:start + self.batch_size]
+            batch[:len(chunk)] = chunk
+            batch[len(chunk):] = 0
+            embeddings[start:start + len(chunk)] = self.session.run([self.output_name],
+                                                                    {self.input_name: batch})[0][:len(chunk)]
+        return embeddings
+
+    def embed(self, images: Union[ImageInput, Sequence[ImageInput]],
+              executor: Optional[Executor]=None) -> np.ndarray:
+        """
+        Embeds one image or a list of images in a single model call per graph batch.
+
+        Args:
+            images (Union[ImageInput, Sequence[ImageInput]]): PIL images, encoded bytes or file paths.
+            executor (Optional[Executor]): Pool used to preprocess the images, see `preprocess_batch`.
+
+        Returns:
+            np.ndarray: float32 embeddings of shape (n_images, dimension).
+        """
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        return self.embed_pixels(preprocess_batch(images, image_size=self.image_size, executor=executor))
+
+
+class _CalibrationReader():
+    """
+    Feeds preprocessed calibration images to the ONNX Runtime static quantizer.
+    """
+
+    def __init__(self, image_paths: List[Path], image_size: int, batch_size: int):
+        batch_size = max(batch_size, 1)
+        self._batches: Iterator[dict] = ({"pixel_values": preprocess_batch(image_paths[start:start + batch_size], image_size)}
+                                         for start in range(0, len(image_paths) - batch_size + 1, batch_size))
+
+    def get_next(self) -> Optional[dict]:
+        return next(self._batches, None)
+
+def export_clip_vision(output_directory: Path,
+                       variants: Sequence[str]=("fp32", "fp16", "int8"),
+                       calibration_images: Optional[Path]=None,
+                       hf_model: str=HF_CLIP_MODEL,
+                       image_size: int=224,
+                       batch_size: int=1,
+                       opset: int=17) -> List[Path]:
+    """
+    Exports the CLIP vision tower with its projection to ONNX.
+
+    Needs torch, transformers and onnx, which are only required for exporting, not for inference.
+    The QNN execution provider requires static shapes, so the batch dimension is fixed to `batch_size`
+    unless it is 0 (symbolic batch, CPU only).
+    The int8 variant is QDQ-quantized for the QNN HTP (uint8 activations and weights), calibrated on
+    the images in `calibration_images`.
+
+    Args:
+        output_directory (Path): Directory receiving the models, e.g. "models/clip-vit-large-patch14".
+        variants (Sequence[str]): Any of "fp32", "fp16", "int8".
+        calibration_images (Optional[Path]): Directory of .jpg/.png images, required for "int8".
+        hf_model (str): Hugging Face model to export.
+        image_size (int): Side of the square model input.
+        batch_size (int): Static batch size of the graph; 0 exports a symbolic batch.
+        opset (int): ONNX opset version.
+
+    Returns:
+        List[Path]: Exported model files.
+    """
+    import torch
+    from transformers import CLIPVisionModelWithProjection
+
+    class VisionTower(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model(pixel_values=pixel_values).image_embeds
+
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    fp32_path = output_directory/"clip_vit_l14_vision.onnx"
+    exported = []
+
+    model = CLIPVisionModelWithProjection.from_pretrained(hf_model).eval()
+    with torch.no_grad():
+        torch.onnx.export(VisionTower(model),
+                          torch.zeros(max(batch_size, 1), 3, image_size, image_size),
+                          str(fp32_path),
+                          input_names=["pixel_values"],
+                          output_names=["image_embeds"],
+                          dynamic_axes=None if batch_size else {"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                          opset_version=opset)
+    logger.info(f"Exported {fp32_path}")
+    if "fp32" in variants:
+        exported.append(fp32_path)
+
+    if "fp16" in variants:
+        import onnx
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+
+        fp16_path = output_directory/"clip_vit_l14_vision_fp16.onnx"
+        # float32 inputs/outputs are kept, so every variant is fed the same pixels
+        onnx.save(convert_float_to_float16(onnx.load(str(fp32_path)), keep_io_types=True), str(fp16_path))
+        logger.info(f"Exported {fp16_path}")
+        exported.append(fp16_path)
+
+    if "int8" in variants:
+        from onnxruntime.quantization import QuantType, quantize
+        from onnxruntime.quantization.execution_providers.qnn import get_qnn_qdq_config
+
+        if calibration_images is None:
+            raise ValueError("The int8 variant needs --calibration_images")
+        image_paths = sorted(path for path in Path(calibration_images).iterdir()
+                             if path.suffix.lower() in (".jpg", ".jpeg", ".png"))
+        if len(image_paths) < max(batch_size, 1):
+            raise ValueError(f"Not enough calibration images found in {calibration_images}")
+
+        int8_path = output_directory/"clip_vit_l14_vision_quant.onnx"
+        config = get_qnn_qdq_config(str(fp32_path), _CalibrationReader(image_paths, image_size, batch_size),
+                                    activation_type=QuantType.QUInt8, weight_type=QuantType.QUInt8)
+        quantize(str(fp32_path), str(int8_path), config)
+        logger.info(f"Exported {int8_path} (calibrated on {len(image_paths)} images)")
+        exported.append(int8_path)
+
+    if "fp32" not in variants:
+        fp32_path.unlink()
+    return exported
+
+def clip_image_encoder():
+
+    parser = argparse.ArgumentParser(description="Export or run the ONNX CLIP ViT-L/14 image encoder")
+
+    parser.add_argument("--export",
+                        action="store_true",
+                        help="Export the vision tower to ONNX instead of embedding images")
+    parser.add_argument("--output_directory",
+                        type=str,
+                        default="./models/clip-vit-large-patch14",
+                        help="Where the exported models are written")
+    parser.add_argument("--variants",
+                        type=str,
+                        default="fp32,fp16,int8",
+                        help="Comma separated variants to export: fp32, fp16, int8")
+    parser.add_argument("--calibration_images",
+                        type=str,
+                        default="./images",
+                        help="Directory of images used to calibrate the int8 variant")
+    parser.add_argument("--batch_size",
+                        type=int,
+                        default=1,
+                        help="Static batch size of the exported graphs (0 for a symbolic batch, CPU only)")
+    parser.add_argument("--variant",
+                        type=str,
+                        default="fp32",
+                        help="Variant to run: fp32, fp16, int8")
+    parser.add_argument("--processor",
+                        type=str,
+                        default="npu",
+                        help="Processors Available: Hexagon(NPU), CPU")
+    parser.add_argument("--images",
+                        type=str,
+                        nargs="*",
+                        default=[],
+                        help="Images to embed")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=0,
+                        help="Preprocessing processes (0 preprocesses in this process)")
+
+    args = parser.parse_args()
+
+    if args.export:
+        for path in export_clip_vision(Path(args.output_directory),
+                                       variants=[variant.strip() for variant in args.variants.split(",")],
+                                       calibration_images=Path(args.calibration_images),
+                                       batch_size=args.batch_size):
+            print(f"Exported {path}")
+        return
+
+    if not args.images:
+        parser.error("Provide --images or --export")
+    encoder = CLIPImageEncoder.from_model(processor=args.processor, variant=args.variant)
+    executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers else None
+    try:
+        start = time.perf_counter()
+        embeddings = encoder.embed(args.images, executor=executor)
+        elapsed = time.perf_counter() - start
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    print(f"Embedded {len(embeddings)} images ({embeddings.shape[-1]}-d) in {elapsed * 1000:.1f} ms "
+          f"({len(embeddings) / elapsed:.1f} images/s)")
+
+if __name__=="__main__":
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler()])
+    clip_image_encoder()
@@ -0,0 +1,118 @@
+import io
+import numpy as np
+
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Optional, Sequence, Union
+from PIL import Image
+
+# Normalization constants of the CLIP image processor
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+
+# Rescaling to [0, 1] and normalization folded into one multiply-add per channel
+_SCALE = (1.0 / (255.0 * CLIP_STD)).astype(np.float32)
+_BIAS = (-CLIP_MEAN / CLIP_STD).astype(np.float32)
+
+# Pillow first shrinks by an integer factor (box filter) down to this multiple of the target size,
+# then resamples bicubically; pixels stay within one 8-bit level of a direct bicubic resize
+REDUCING_GAP = 3.0
+
+ImageInput = Union[Image.Image, bytes, str, Path]
+
+def resize_shape(width: int, height: int, image_size: int=224) -> tuple:
+    """
+    Size after resizing the shortest side to `image_size`, as computed by `CLIPImageProcessor`
+    and torchvision `Resize(image_size)`.
+    """
+    if width <= height:
+        return image_size, int(image_size * height / width)
+    return int(image_size * width / height), image_size
+
+def load_image(image: ImageInput, image_size: Optional[int]=None) -> Image.Image:
+    """
+    Opens `image` (a PIL image, encoded bytes or a file path) as RGB.
+
+    When `image_size` is given, JPEGs are decoded at reduced size (`Image.draft`): the decoder skips
+    DCT coefficients and returns the smallest power-of-two downscale whose shortest side still
+    covers `image_size`. A 4000x3000 photo then decodes at 500x375; after resizing, pixels differ
+    from a full decode by at most two 8-bit levels.
+
+    Args:
+        image (ImageInput): PIL image, encoded bytes or file path.
+        image_size (Optional[int]): Target shortest side, enabling draft decoding.
+
+    Returns:
+        Image.Image: The image in RGB mode.
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(io.BytesIO(image) if isinstance(image, (bytes, bytearray)) else image)
+        if image_size is not None and image.format == "JPEG":
+            image.draft("RGB", resize_shape(*image.size, image_size=image_size))
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+def preprocess_image(image: ImageInput, image_size: int=224, out: Optional[np.ndarray]=None) -> np.ndarray:
+    """
+    Prepares an image like `CLIPImageProcessor`: bicubic resize of the shortest side to `image_size`,
+    center crop, scaling to [0, 1] and per-channel normalization.
+
+    The crop is taken during the resize (`box`), so only the output pixels are resampled. The uint8
+    pixels are normalized with one fused multiply-add per channel, written straight into `out`,
+    without float intermediates of the whole image.
+
+    Args:
+        image (ImageInput): PIL image, encoded bytes or file path.
+        image_size (int): Side of the square model input.
+        out (Optional[np.ndarray]): float32 buffer of shape (3, image_size, image_size) to fill,
+            e.g. a row of a preallocated batch. Allocated if None.
+
+    Returns:
+        np.ndarray: `out`, holding the float32 pixel values.
+    """
+    image = load_image(image, image_size=image_size)
+    width, height = image.size
+    resized_width, resized_height = resize_shape(width, height, image_size=image_size)
+
+    # Center crop in resized coordinates, mapped back onto the source image
+    left = (resized_width - image_size) // 2
+    top = (resized_height - image_size) // 2
+    scale_x, scale_y = width / resized_width, height / resized_height
+    box = (left * scale_x, top * scale_y, (left + image_size) * scale_x, (top + image_size) * scale_y)
+    image = image.resize((image_size, image_size), resample=Image.BICUBIC, box=box, reducing_gap=REDUCING_GAP)
+
+    if out is None:
+        out = np.empty((3, image_size, image_size), dtype=np.float32)
+    pixels = np.asarray(image)
+    for channel in range(3):
+        np.multiply(pixels[:, :, channel], _SCALE[channel], out=out[channel], casting="unsafe")
+        out[channel] += _BIAS[channel]
+    return out
+
+def preprocess_batch(images: Sequence[ImageInput], image_size: int=224,
+                     executor: Optional[Executor]=None, out: Optional[np.ndarray]=None) -> np.ndarray:
+    """
+    Preprocesses many images into one contiguous batch.
+
+    Without an executor every image is written directly into its row of the batch. With a
+    `ProcessPoolExecutor`, decoding and resizing run in parallel worker processes (outside the GIL)
+    and each result is copied into its row.
+
+    Args:
+        images (Sequence[ImageInput]): Encoded bytes or file paths (PIL images only without an executor,
+            since they are not sent to worker processes efficiently).
+        image_size (int): Side of the square model input.
+        executor (Optional[Executor]): Pool running `preprocess_image`. Images are processed inline if None.
+        out (Optional[np.ndarray]): float32 buffer of shape (n_images, 3, image_size, image_size) to fill.
+
+    Returns:
+        np.ndarray: float32 pixel values of shape (n_images, 3, image_size, image_size).
+    """
+    batch = np.empty((len(images), 3, image_size, image_size), dtype=np.float32) if out is None else out
+    if executor is None or len(images) == 1:
+        for row, image in enumerate(images):
+            preprocess_image(image, image_size, out=batch[row])
+        return batch
+
+    for row, pixels in enumerate(executor.map(preprocess_image, images, [image_size] * len(images))):
+        batch[row] = pixels
+    return batch
@@ -0,0 +1,487 @@
+import json
+import logging
+import numpy as np
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tokenizers import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+NUTRITION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "dish": {"type": "string", "maxLength": 80},
+        "ingredients": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": 20,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "minLength": 1, "maxLength": 40},
+                    "grams": {"type": "number", "minimum": 0, "maximum": 9999},
+                    "percentage": {"type": "number", "minimum": 0, "maximum": 100},
+                },
+            },
+        },
+        "calories": {"type": "number", "minimum": 0, "maximum": 99999},
+    },
+}
+
+MAX_INTEGER_DIGITS = 9
+MAX_FRACTION_DIGITS = 3
+MAX_CACHED_TRANSITIONS = 1_000_000
+# Masks are stored bit-packed (vocab_size / 8 bytes, ~19 KB for a 152k vocabulary)
+MAX_CACHED_MASKS = 1024
+
+# Automaton frames are tuples whose first element is the node index; a state is a tuple of frames
+# (bottom of the stack first). Node.step returns the frames replacing the top one and whether the
+# character was consumed, or None if the character is rejected.
+Frame = Tuple
+State = Tuple[Frame, ...]
+Step = Optional[Tuple[Tuple[Frame, ...], bool]]
+
+class _Node():
+
+    def __init__(self, index: int):
+        self.index = index
+
+    def start(self) -> Frame:
+        return (self.index,)
+
+    def step(self, frame: Frame, ch: str) -> Step:
+        raise NotImplementedError
+
+    def finished(self, frame: Frame) -> bool:
+        return False
+
+
+class _Literal(_Node):
+
+    def __init__(self, index: int, text: str):
+        super().__init__(index)
+        self.text = text
+
+    def start(self) -> Frame:
+        return (self.index, 0)
+
+    def step(self, frame: Frame, ch: str) -> Step:
+        position = frame[1]
+        if ch != self.text[position]:
+            return None
+        return (((self.index, position + 1),) if position + 1 < len(self.text) else ()), True
+
+
+class _Choice(_Node):
+    """
+    One of several JSON literals (enum values, booleans).
+    """
+
+    def __init__(self, index: int, options: Sequence[str]):
+        super().__init__(index)
+        self.options = tuple(options)
+
+    def start(self) -> Frame:
+        return (self.index, "")
+
+    def step(self, frame: Frame, ch: str) -> Step:
+        prefix = frame[1] + ch
+        extended = [option for option in self.options if option.startswith(prefix)]
+        if not extended:
+            # A complete option followed by something else (e.g. enum 1 vs 10) ends here
+            return ((), False) if frame[1] in self.options else None
+        if extended == [prefix]:
+            return (), True
+        return ((self.index, prefix),), True
+
+
+class _String(_Node):
+
+    def __init__(self, index: int, min_length: int=0, max_length: Optional[int]=None):
+        super().__init__(index)
+        self.min_length = min_length
+        self.max_length = max_length
+
+    def start(self) -> Frame:
+        return (self.index, False, 0)
+
+    def step(self, frame: Frame, ch: str) -> Step:
+        _, opened, count = frame
+        if not opened:
+            return (((self.index, True, 0),), True) if ch == '"' else None
+        if ch == '"':
+            return ((), True) if count >= self.min_length else None
+        # Escapes are not generated; control characters are invalid inside JSON strings
+        if ch == "\\" or ord(ch) < 0x20:
+            return None
+        if self.max_length is not None:
+            return (((self.index, True, count + 1),), True) if count < self.max_length else None
+        # Without a maximum the count only matters up to the minimum, which keeps the state space small
+        return ((self.index, True, min(count + 1, self.min_length)),), True
+
+
+class _Number(_Node):
+    """
+    JSON number. A non-negative `maximum` bounds the value: digits are compared with those of the
+    maximum as they are generated (the frame's order is -1 below, 0 equal, 1 above), so a number
+    exceeding it is rejected at its first offending digit rather than after it is complete.
+    """
+
+    def __init__(self, index: int, integer: bool=False, negative: bool=True,
+                 integer_digits: int=MAX_INTEGER_DIGITS, fraction_digits: int=MAX_FRACTION_DIGITS,
+                 maximum: Optional[float]=None):
+        super().__init__(index)
+        self.integer = integer
+        self.negative = negative
+        self.integer_digits = integer_digits
+        self.fraction_digits = fraction_digits
+        self.maximum = None
+        if maximum is not None and maximum >= 0:
+            whole, fraction = f"{maximum:.{fraction_digits}f}".split(".")
+            self.maximum = (whole, fraction)
+            self.integer_digits = len(whole)
+
+    def start(self) -> Frame:
+        return (self.index, "start", 0, 0)
+
+    def _order(self, order: int, ch: str, position: int, fraction: bool) -> int:
+        if self.maximum is None or order < 0:
+            return -1
+        if order == 0:
+            bound = self.maximum[1 if fraction else 0][position]
+            order = (ch > bound) - (ch < bound)
+        return order
+
+    def step(self, frame: Frame, ch: str) -> Step:
+        _, phase, digits, order = frame
+        if phase in ("start", "minus"):
+            if ch == "-" and phase == "start" and self.negative:
+                # Negative values are below any non-negative maximum
+                return ((self.index, "minus", 0, -1),), True
+            if ch.isdigit() and ch.isascii():
+                order = self._order(order, ch, 0, False)
+                if self.integer_digits == 1 and order > 0:
+                    return None
+                return ((self.index, "zero" if ch == "0" else "integer", 1, order),), True
+            return None
+        if phase == "dot":
+            if not (ch.isdigit() and ch.isascii()):
+                return None
+            order = self._order(order, ch, 0, True)
+            return (((self.index, "fraction", 1, order),), True) if order <= 0 else None
+
+        if ch.isdigit() and ch.isascii():
+            if phase == "integer" and digits < self.integer_digits:
+                order = self._order(order, ch, digits, False)
+                if digits + 1 == self.integer_digits and order > 0:
+                    return None
+                return ((self.index, "integer", digits + 1, order),), True
+            if phase == "fraction" and digits < self.fraction_digits:
+                order = self._order(order, ch, digits, True)
+                return (((self.index, "fraction", digits + 1, order),), True) if order <= 0 else None
+        if ch == "." and phase in ("zero", "integer") and not self.integer:
+            # Fewer integer digits than the maximum: any fraction stays below it
+            return ((self.index, "dot", 0, order if digits == self.integer_digits else -1),), True
+        # The number is complete; the character belongs to the enclosing value
+        return (), False
+
+
+class _Array(_Node):
+
+    def __init__(self, index: int, item: _Node, min_items: int=0, max_items: Optional[int]=None):
+        super().__init__(index)
+        self.item = item
+        self.min_items = min_items
+        self.max_items = max_items
+
+    def start(self) -> Frame:
+        return (self.index, "open", 0)
+
+    def _count(self, count: int) -> int:
+        return count if self.max_items is not None else min(count, self.min_items)
+
+    def step(self, frame: Frame, ch: str) -> Step:
+        _, phase, count = frame
+        if phase == "open":
+            return (((self.index, "first", 0),), True) if ch == "[" else None
+        if phase in ("first", "item"):
+            if phase == "first" and ch == "]" and self.min_items == 0:
+                return (), True
+            if self.max_items is not None and count >= self.max_items:
+                return None
+            return ((self.index, "next", self._count(count + 1)), self.item.start()), False
+        # phase == "next"
+        if ch == "," and (self.max_items is None or count < self.max_items):
+            return ((self.index, "item", count),), True
+        if ch == "]" and count >= self.min_items:
+            return (), True
+        return None
+
+
+class _Sequence(_Node):
+
+    def __init__(self, index: int, children: List[_Node]):
+        super().__init__(index)
+        self.children = children
+
+    def start(self) -> Frame:
+        return (self.index, 0)
+
+    def step(self, frame: Frame, ch: str) -> Step:
+        position = frame[1]
+        if position == len(self.children):
+            return (), False
+        return ((self.index, position + 1), self.children[position].start()), False
+
+    def finished(self, frame: Frame) -> bool:
+        return frame[1] == len(self.children)
+
+
+class JSONSchemaAutomaton():
+    """
+    Character-level automaton accepting compact JSON documents that match a schema.
+
+    Supported schema keywords: object `properties` (emitted in schema order, all present), array
+    `items`/`minItems`/`maxItems`, string `minLength`/`maxLength`, number and integer (a `minimum` of 0
+    or more forbids the sign, other minimums are not enforced; a non-negative `maximum` bounds the
+    value, a negative one only the number of integer digits), boolean, null, `enum` and `const`. Strings are generated without escape sequences and the document without whitespace,
+    which keeps the automaton deterministic and its state space small.
+
+    States are immutable tuples, so they can key caches.
+
+    Args:
+        schema (dict): JSON schema of the document.
+
+    Attributes:
+        initial (State): State before the first character.
+    """
+
+    def __init__(self, schema: dict):
+        self.nodes: List[_Node] = []
+        root = self._compile(schema)
+        self.initial: State = (root.start(),)
+        self._transitions: Dict[Tuple[State, str], Optional[State]] = {}
+
+    def _add(self, node_class, *args, **kwargs) -> _Node:
+        node = node_class(len(self.nodes), *args, **kwargs)
+        self.nodes.append(node)
+        return node
+
+    def _compile(self, schema: dict) -> _Node:
+        if "const" in schema:
+            return self._add(_Literal, json.dumps(schema["const"]))
+        if "enum" in schema:
+            return self._add(_Choice, [json.dumps(value) for value in schema["enum"]])
+
+        schema_type = schema.get("type")
+        if schema_type == "object":
+            children, literal = [], "{"
+            for i, (name, property_schema) in enumerate(schema.get("properties", {}).items()):
+                literal += ("," if i else "") + json.dumps(name) + ":"
+                child = self._compile(property_schema)
+                if isinstance(child, _Literal):
+                    literal += child.text
+                    continue
+                children += [self._add(_Literal, literal), child]
+                literal = ""
+            children.append(self._add(_Literal, literal + "}"))
+            return self._add(_Sequence, children)
+        if schema_type == "array":
+            return self._add(_Array, self._compile(schema.get("items", {"type": "string"})),
+                             min_items=schema.get("minItems", 0), max_items=schema.get("maxItems"))
+        if schema_type == "string":
+            return self._add(_String, min_length=schema.get("minLength", 0), max_length=schema.get("maxLength"))
+        if schema_type in ("number", "integer"):
+            maximum = schema.get("maximum")
+            integer_digits = len(str(int(abs(maximum)))) if maximum is not None else MAX_INTEGER_DIGITS
+            return self._add(_Number, integer=schema_type == "integer",
+                             negative=schema.get("minimum", -1) < 0,
+                             integer_digits=integer_digits, maximum=maximum)
+        if schema_type == "boolean":
+            return self._add(_Choice, ["true", "false"])
+        if schema_type == "null":
+            return self._add(_Literal, "null")
+        raise ValueError(f"Unsupported schema: {schema}")
+
+    def step(self, state: State, ch: str) -> Optional[State]:
+        """
+        Feeds one character.
+
+        Args:
+            state (State): Current state.
+            ch (str): Next character.
+
+        Returns:
+            Optional[State]: The following state, or None if the character is not allowed.
+        """
+        key = (state, ch)
+        if key in self._transitions:
+            return self._transitions[key]
+
+        stack = list(state)
+        next_state = None
+        while stack:
+            frame = stack.pop()
+            result = self.nodes[frame[0]].step(frame, ch)
+            if result is None:
+                break
+            frames, consumed = result
+            stack.extend(frames)
+            if consumed:
+                while stack and self.nodes[stack[-1][0]].finished(stack[-1]):
+                    stack.pop()
+                next_state = tuple(stack)
+                break
+
+        if len(self._transitions) >= MAX_CACHED_TRANSITIONS:
+            self._transitions.clear()
+        self._transitions[key] = next_state
+        return next_state
+
+    def advance(self, state: State, text: str) -> Optional[State]:
+        """
+        Feeds every character of `text`; returns None as soon as one is rejected.
+        """
+        for ch in text:
+            state = self.step(state, ch)
+            if state is None:
+                return None
+        return state
+
+    @staticmethod
+    def accepts(state: State) -> bool:
+        return state == ()
+
+
+class TokenTrie():
+    """
+    Prefix tree over the decoded text of every vocabulary entry.
+
+    Walking the trie alongside the automaton tests all tokens sharing a prefix at once: a rejected
+    character prunes the whole subtree below it. Special tokens and tokens that decode to partial
+    UTF-8 sequences are left out, so they are never allowed inside constrained output.
+
+    Args:
+        tokenizer (Tokenizer): Tokenizer whose vocabulary is indexed.
+
+    Attributes:
+        vocab_size (int): Vocabulary size, including added tokens.
+        texts (List[str]): Decoded text of every token ID ("" for excluded tokens).
+    """
+
+    def __init__(self, tokenizer: Tokenizer):
+        self.vocab_size = tokenizer.get_vocab_size(with_added_tokens=True)
+        self.texts = [tokenizer.decode([token_id], skip_special_tokens=True) for token_id in range(self.vocab_size)]
+        # Children are keyed by character; token IDs ending at a node are stored under None
+        self.root: dict = {}
+        for token_id, text in enumerate(self.texts):
+            if not text or "�" in text:
+                continue
+            node = self.root
+            for ch in text:
+                node = node.setdefault(ch, {})
+            node.setdefault(None, []).append(token_id)
+
+    def allowed(self, automaton: JSONSchemaAutomaton, state: State) -> np.ndarray:
+        """
+        Computes which tokens the automaton accepts in full from `state`.
+
+        Returns:
+            np.ndarray: Boolean mask of shape (vocab_size,).
+        """
+        mask = np.zeros(self.vocab_size, dtype=bool)
+        stack = [(self.root, state)]
+        while stack:
+            node, node_state = stack.pop()
+            for ch, child in node.items():
+                if ch is None:
+                    continue
+                child_state = automaton.step(node_state, ch)
+                if child_state is None:
+                    continue
+                if None in child:
+                    mask[child[None]] = True
+                stack.append((child, child_state))
+        return mask
+
+
+class JSONConstraint():
+    """
+    Restricts generation to JSON documents matching a schema.
+
+    Before each sampling step the inference classes call `mask` and set every disallowed logit to
+    -inf; after sampling they call `advance` with the chosen token. The mask of a state only depends on
+    the automaton state, so it is computed once per state and kept bit-packed in an LRU cache of
+    `max_cached_masks` states. Most steps (e.g. inside a string) revisit a handful of states, so after
+    the first request nearly every mask is a cache hit. Reuse one
+    constraint across requests to keep the cache warm; `reset` is called at the start of each generation.
+
+    Once the document is complete only the end-of-sequence token is allowed.
+
+    Args:
+        schema (dict): JSON schema, e.g. `NUTRITION_SCHEMA`.
+        tokenizer (Tokenizer): Tokenizer of the model being constrained.
+        eos_token_id (int): Token that ends generation.
+        trie (Optional[TokenTrie]): Prebuilt trie for `tokenizer`, to share between constraints.
+        max_cached_masks (int): Masks kept in the cache.
+
+    Attributes:
+        state (State): Automaton state after the tokens accepted so far.
+    """
+
+    def __init__(self, schema: dict, tokenizer: Tokenizer, eos_token_id: int, trie: Optional[TokenTrie]=None,
+                 max_cached_masks: int=MAX_CACHED_MASKS):
+        self.schema = schema
+        self.automaton = JSONSchemaAutomaton(schema)
+        self.trie = trie or TokenTrie(tokenizer)
+        self.eos_token_id = eos_token_id
+        self.max_cached_masks = max_cached_masks
+        self._masks: "OrderedDict[State, np.ndarray]" = OrderedDict()
+        self.reset()
+
+    def reset(self) -> None:
+        self.state = self.automaton.initial
+
+    @property
+    def complete(self) -> bool:
+        return self.automaton.accepts(self.state)
+
+    def mask(self) -> np.ndarray:
+        """
+        Returns the boolean mask of tokens allowed next, of shape (vocab_size,).
+
+        Raises:
+            ValueError: If no token can continue the document (the vocabulary cannot spell the schema).
+        """
+        packed = self._masks.get(self.state)
+        if packed is not None:
+            self._masks.move_to_end(self.state)
+            return np.unpackbits(packed, count=self.trie.vocab_size).view(bool)
+
+        if self.complete:
+            mask = np.zeros(self.trie.vocab_size, dtype=bool)
+            mask[self.eos_token_id] = True
+        else:
+            mask = self.trie.allowed(self.automaton, self.state)
+            if not mask.any():
+                raise ValueError(f"No token can continue the JSON document from state {self.state}")
+        self._masks[self.state] = np.packbits(mask)
+        if len(self._masks) > self.max_cached_masks:
+            self._masks.popitem(last=False)
+        return mask
+
+    def advance(self, token_id: int) -> None:
+        """
+        Moves the automaton past a sampled token.
+
+        Raises:
+            ValueError: If the token is not allowed in the current state.
+        """
+        if token_id == self.eos_token_id:
+            return
+        state = self.automaton.advance(self.state, self.trie.texts[token_id])
+        if state is None:
+            raise ValueError(f"Token {token_id} ({self.trie.texts[token_id]!r}) does not match the schema")
+        self.state = state
@@ -9,15 +9,24 @@ todo:
 import onnxruntime as ort
 import numpy as np
 import logging
+import json
+import threading
 import time
 
 from enum import IntEnum, Enum
 from tokenizers import Tokenizer
-from typing import List, Dict, Optional, Tuple
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 from dataclasses import dataclass
 from collections import defaultdict
-from utils import apply_repetition_penalty, top_k_probas
+from kv_cache import (KV_PRECISIONS, ONNX_KV_DTYPES, KVCacheArena, dequantize_kv, evict_positions, is_quantized,
+                      quantize_kv, truncate_kv)
+from prefix_cache import PrefixKVCache
+from sampler import Sampler
+from constrained_decoding import JSONConstraint
+from detokenizer import IncrementalDetokenizer
+from instrumentation import NULL_TRACER
+from streaming import StreamClock, TokenEvent, astream
 
 class VerbosityLevel(IntEnum):
     NONE = 0
@@ -42,6 +51,8 @@ class ModelParameters:
     num_key_value_heads: int=2
     seq_len: Optional[int] = None
     hidden_size: Optional[int] = None
+    context_length: int=4096
+    rope_theta: float=10000.0
 
 
 logger = logging.getLogger(__name__)
@@ -67,22 +78,47 @@ class DeepSeekModelInference():
         model_subdirectory (Path): Path to the model directory containing ONNX files and tokenizer.
         model_meta (dict): A dictionary containing model metadata (e.g., number of layers, heads, etc.).
         verbose (VerbosityLevel, optional): Level of verbosity to control debug output. Defaults to VerbosityLevel.NONE.
+        prefix_cache (Optional[PrefixKVCache], optional): Cache of prefilled prompt KV tensors reused across requests.
+        seed (Optional[int], optional): Seed for the token sampler.
+        tracer (Tracer, optional): Records timing spans for session runs, sampling and detokenization.
+            Defaults to a tracer that records nothing.
+        kv_window (Optional[int], optional): Bounded-memory mode. At most this many positions are kept in
+            the KV cache; older positions are evicted in blocks of genai_config's sliding_window size.
+            Defaults to None (the cache grows up to `context_length`).
+        attention_sinks (int, optional): Number of leading positions never evicted in bounded-memory mode.
+        kv_precision (str, optional): Precision the KV cache is held at between graph runs: "fp32", "fp16"
+            or "int8" (per-position scales). Applies to decoding without IO binding, where the cache is
+            dequantized at the graph boundary of every step and only the new position is quantized,
+            and to the cache kept for a later turn (`keep_kv`). The IO binding arena is read by the graph
+            in place, so it always uses the graph's KV type (float16 for graphs exported with float16
+            KV inputs). Defaults to "fp32" (the graph's own type).
 
     Attributes:
         session_mapper (Dict[str, ort.InferenceSession]): Stores mapped inference sessions.
         tokenizer_path (Path): Full path to the tokenizer file.
         tokenizer (Tokenizer): Initialized tokenizer object.
         model_params (ModelParameters): Parsed and structured model metadata.
-        softmax (Callable): Softmax function with temperature scaling for logits.
+        sampler (Sampler): Vectorized sampler used to pick each next token.
         verbose (VerbosityLevel): Current verbosity level.
         root_dir (Path): Root working directory at runtime.
+        genai_config (dict): Parsed genai_config.json from the model subdirectory, empty if absent.
+        kv_arena (Optional[KVCacheArena]): Preallocated KV cache reused by the IO binding decode loop.
+        eos_token_id (int): Token ID that ends generation.
     """
 
     def __init__(self, model_sessions: Dict[str,ort.InferenceSession], 
                  tokenizer: str,
                  model_subdirectory: Path,
                  model_meta: dict,
-                 verbose: VerbosityLevel = VerbosityLevel.NONE):
+                 verbose: VerbosityLevel = VerbosityLevel.NONE,
+                 prefix_cache: Optional[PrefixKVCache]=None,
+                 seed: Optional[int]=None,
+                 tracer=NULL_TRACER,
+                 kv_window: Optional[int]=None,
+                 attention_sinks: int=4,
+                 kv_precision: str="fp32"):
+        if kv_precision not in KV_PRECISIONS:
+            raise ValueError(f"Unsupported KV precision: {kv_precision}. Select {' | '.join(KV_PRECISIONS)}")
         self.session_mapper = model_sessions
         self.root_dir = Path.cwd()
         self.model_subdirectory = model_subdirectory
@@ -90,10 +126,42 @@ class DeepSeekModelInference():
         self.tokenizer = Tokenizer.from_file(str(self.tokenizer_path))
         self.model_params = ModelParameters(**model_meta)
         self.verbose = verbose
-        self.softmax = lambda x, temperature=1: np.exp((x-np.max(x))/temperature)/np.sum(np.exp((x-np.max(x))/temperature), axis=-1)
+        self.sampler = Sampler(seed=seed)
+        self.genai_config = self._load_genai_config()
+        self.model_params.context_length = self.genai_config.get("model", {}).get("context_length",
+                                                                                  self.model_params.context_length)
+        self.kv_arena = None
+        self.input_hidden_states_buffer = None
+        self.prefix_cache = prefix_cache
+        self.tracer = tracer
+        self.eos_token_id = self.genai_config.get("model", {}).get("eos_token_id",
+                                                                  self.tokenizer.token_to_id("<｜end▁of▁sentence｜>"))
+
+        self.kv_precision = kv_precision
+        self.kv_window = kv_window
+        self.attention_sinks = attention_sinks
+        sliding_window = self.genai_config.get("model", {}).get("decoder", {}).get("sliding_window", {})
+        self.kv_evict_block = sliding_window.get("window_size", self.model_params.max_seq_len)
+        if kv_window is not None and kv_window <= attention_sinks + self.kv_evict_block:
+            raise ValueError(f"kv_window ({kv_window}) must exceed attention_sinks + eviction block "
+                             f"({attention_sinks} + {self.kv_evict_block})")
 
         self.verbosity_init(self.verbose)
 
+    def _load_genai_config(self) -> dict:
+        """
+        Loads genai_config.json from the model subdirectory.
+
+        Returns:
+            dict: The parsed configuration, or an empty dictionary if the file does not exist.
+        """
+        config_path = self.model_subdirectory/"genai_config.json"
+        if not config_path.exists():
+            return {}
+
+        with open(config_path, "r") as f:
+            return json.load(f)
+
     def query(self, query: str, persona: Optional[str]=None) -> str:
         """
         Constructs a formatted query prompt for the model, optionally including a predefined persona.
@@ -175,14 +243,15 @@ class DeepSeekModelInference():
         self.model_params.seq_len = expected_outputs.shape[1]
         self.model_params.hidden_size = expected_outputs.shape[2]
 
-        embedding_output = self.session_mapper["EMBEDDING"].run(None, {"input_ids": token_ids})[0]
+        with self.tracer.span("EMBEDDING", tokens=token_ids.shape[-1]):
+            embedding_output = self.session_mapper["EMBEDDING"].run(None, {"input_ids": token_ids})[0]
         
         self.verbosity_embedding(token_id=token_ids,
                                  embed_output=embedding_output.shape, 
                                  verbose=verbose)
         return embedding_output
     
-    def context_session(self, embedding_session_outputs: np.array) -> np.array:
+    def context_session(self, embedding_session_outputs: np.array, start: int=0) -> np.array:
         """
         Runs the context session to generate hidden states and update the KV cache.
 
@@ -190,15 +259,32 @@ class DeepSeekModelInference():
         executes the context ONNX model, and extracts the hidden states for subsequent layers.
         It also updates internal cache state and optionally logs context-related verbosity details.
 
+        When `start` is non-zero the call processes one chunk of a longer prompt: the keys/values of the
+        first `start` positions already held in `self.kv_cache` are fed as past, and on return
+        `self.kv_cache` covers every position up to the end of the chunk.
+
         Args:
-            embedding_session_outputs (np.array): The output tensor from the embedding session.
+            embedding_session_outputs (np.array): The output tensor from the embedding session
+                (at most `max_seq_len` tokens).
+            start (int): Number of positions already processed before this chunk.
 
         Returns:
             np.array: The context hidden states, typically the first output from the context session.
         """
-        init_prompts = self._cache_init(embedding_session_outputs)
-        ctx_outputs = self.session_mapper["CONTEXT"].run(None, init_prompts)
-        self.kv_cache = self.kv_cache_update(ctx_outputs=ctx_outputs)
+        chunk_length = embedding_session_outputs.shape[1]
+        end = start + chunk_length
+        init_prompts = self._cache_init(embedding_session_outputs, start=start)
+        with self.tracer.span("CONTEXT", start=start, tokens=chunk_length):
+            ctx_outputs = self.session_mapper["CONTEXT"].run(None, init_prompts)
+        present_kv = self.kv_cache_update(ctx_outputs=ctx_outputs)
+
+        if start == 0:
+            self.kv_cache = present_kv
+        else:
+            # Present tensors either span the whole past buffer or only the new chunk
+            self.kv_cache = {name: present[:, :, :end] if present.shape[2] >= end
+                             else np.concatenate([self.kv_cache[name][:, :, :start], present[:, :, :chunk_length]], axis=2)
+                             for name, present in present_kv.items()}
         hidden_states = ctx_outputs[0]
         self.verbosity_context(init_prompt_inputs=init_prompts,
                                ctx_outputs=ctx_outputs,
@@ -220,7 +306,8 @@ class DeepSeekModelInference():
             np.array: The logits tensor, typically of shape.
         """
 
-        logits = self.session_mapper["HEAD"].run(None, {"output_hidden_states": ctx_hidden_states})[0]
+        with self.tracer.span("HEAD", tokens=ctx_hidden_states.shape[1]):
+            logits = self.session_mapper["HEAD"].run(None, {"output_hidden_states": ctx_hidden_states})[0]
 
         self.verbosity_head(logits=logits,
                             verbose=self.verbose)
@@ -248,55 +335,45 @@ class DeepSeekModelInference():
         Raises:
             ValueError: If `io_binding` is enabled but `iBindingManager` is not initialized.
         """
-        seq_lengths = {
-            "past_seq_len": np.array([[previous_sequence_length]], dtype=np.int32),
-            "total_seq_len": np.array([previous_sequence_length+1], dtype=np.int32)
-            }
-        
-        iter_inputs = {
-            "input_hidden_states": embedding_session_output,
-            **self.kv_cache,
-            **seq_lengths
-        }
         if io_binding:
             if not hasattr(self,"iBindingManager"):
                     raise ValueError("IO binding cannot proceed: 'iBindingManager' has not been initialized")
-            for name, value in iter_inputs.items():
+
+            # KV arena, sequence length and output buffers stay bound between steps;
+            # only their contents and the new hidden state change
+            self.past_seq_len_buffer[...] = previous_sequence_length
+            self.total_seq_len_buffer[...] = previous_sequence_length+1
+            # The EMBEDDING output buffer is bound once in `_io_binding_init`
+            if embedding_session_output is not self.input_hidden_states_buffer:
                 self.iBindingManager.bind_input(
-                    name=name,
-                    buffer=value
+                    name="input_hidden_states",
+                    buffer=embedding_session_output
                 )
-           
-            self.iBindingManager.bind_output(
-                name = self.iBindingManager.layer_names[0],
-                buffer = self.output_hidden_states_buffer # need to add checks for all used buffers, do it at the top and abstract out
-            )
-            
-            kv_shape_update = (1, self.model_params.num_key_value_heads, previous_sequence_length+1, self.model_params.attn_head_size)
-            
-            self.iBindingManager.buffer_reallocation_kv(
-                updated_buffer_shape=kv_shape_update,
-                num_layers=self.model_params.num_layers,
-                present_key_buffer=self.present_key_buffer,
-                present_value_buffer=self.present_value_buffer,
-            )
-            # start = time.time()
-            self.session_mapper.get("CONTEXT_ITER").run_with_iobinding(self.iBindingManager.io_binding)
-            # duration = time.time() - start
-            # print("Time per iteration (IOBinding):", duration)
+            with self.tracer.span("CONTEXT_ITER", position=previous_sequence_length, io_binding=True):
+                self.session_mapper.get("CONTEXT_ITER").run_with_iobinding(self.iBindingManager.io_binding)
+            self.kv_arena.length = previous_sequence_length+1
             hidden_states = self.output_hidden_states_buffer
-            self.kv_cache = {
-                **self.present_key_buffer,
-                **self.present_value_buffer
-            }
-            
 
         else:
-            # start = time.time()
-            iter_outputs = self.session_mapper["CONTEXT_ITER"].run(None, iter_inputs)
-            # duration = time.time() - start
-            # print("Time per iteration (No IOBinding):", duration)
-            self.kv_cache = self.kv_cache_update(ctx_outputs=iter_outputs) 
+            seq_lengths = {
+                "past_seq_len": np.array([[previous_sequence_length]], dtype=np.int32),
+                "total_seq_len": np.array([previous_sequence_length+1], dtype=np.int32)
+                }
+            iter_inputs = {
+                "input_hidden_states": embedding_session_output,
+                **dequantize_kv(self.kv_cache),
+                **seq_lengths
+            }
+            with self.tracer.span("CONTEXT_ITER", position=previous_sequence_length, io_binding=False):
+                iter_outputs = self.session_mapper["CONTEXT_ITER"].run(None, iter_inputs)
+            present_kv = self.kv_cache_update(ctx_outputs=iter_outputs)
+            if is_quantized(self.kv_cache):
+                # Only the new position is quantized; earlier ones keep their stored values
+                self.kv_cache = {name: self.kv_cache[name].append(present[:, :, previous_sequence_length:],
+                                                                  start=previous_sequence_length)
+                                 for name, present in present_kv.items()}
+            else:
+                self.kv_cache = present_kv
             hidden_states = iter_outputs[0]
         # self.verbosity_context_iter()
 
@@ -305,14 +382,16 @@ class DeepSeekModelInference():
 
     def next_token_prediction(self, logits: list, generated_ids: list,
                               temperature: float=1, top_k: Optional[int]=None,
-                              repetition_penalty: Optional[float]=None):
+                              repetition_penalty: Optional[float]=None,
+                              top_p: Optional[float]=None,
+                              min_p: Optional[float]=None,
+                              constraint: Optional[JSONConstraint]=None):
         """
-        Samples the next token from the output logits using temperature scaling, top-k filtering,
-        and optional repetition penalty.
+        Samples the next token from the output logits using temperature scaling, top-k/top-p/min-p
+        filtering and optional repetition penalty.
 
-        This method extracts the logits for the last position, applies optional repetition penalties,
-        normalizes with softmax, and samples from the distribution. It supports both unrestricted
-        sampling and top-k restricted sampling.
+        This method extracts the logits for the last position and hands them to the vectorized
+        sampler, which penalizes repeats, filters and samples without sorting the full vocabulary.
 
         Args:
             logits (list): Logits array of shape (1, seq_len, vocab_size) from the model head.
@@ -320,23 +399,25 @@ class DeepSeekModelInference():
             temperature (float): Softmax temperature to control randomness (lower = more deterministic).
             top_k (Optional[int]): If provided, restricts sampling to the top-k highest probability tokens.
             repetition_penalty (Optional[float]): If provided, penalizes previously generated tokens.
+            top_p (Optional[float]): If provided, restricts sampling to the nucleus holding this probability mass.
+            min_p (Optional[float]): If provided, drops tokens below this fraction of the top probability.
+            constraint (Optional[JSONConstraint]): If provided, only tokens continuing a schema-valid
+                JSON document can be sampled; the constraint advances past the sampled token.
 
         Returns:
             int: The ID of the next predicted token.
         """
-        last_logit = logits[0,-1]
-        if repetition_penalty:
-            last_logit = apply_repetition_penalty(logits=last_logit, generated_ids=generated_ids, penalty=repetition_penalty)#self.apply_repetition_penalty(logits=last_logit, generated_ids=generated_ids, penalty=repetition_penalty)
-
-        probas = self.softmax(last_logit, temperature=temperature)
-        indices = probas.copy()
- 
-        if top_k:
-            indices, probas = top_k_probas(probas=probas, k=top_k)
-            next_token_id = int(np.random.choice(indices, p=probas))
-        else:
-            next_token_id = int(np.random.choice(len(indices), p=probas))
-        
+        with self.tracer.span("sampler", category="sampler"):
+            next_token_id = int(self.sampler.sample(logits[:, -1],
+                                                    generated_ids=[generated_ids],
+                                                    temperature=temperature,
+                                                    top_k=top_k,
+                                                    top_p=top_p,
+                                                    min_p=min_p,
+                                                    repetition_penalty=repetition_penalty,
+                                                    allowed=None if constraint is None else constraint.mask())[0])
+            if constraint is not None:
+                constraint.advance(next_token_id)
         return next_token_id
     
     def run_inference(self, query: str, 
@@ -345,14 +426,13 @@ class DeepSeekModelInference():
                       persona: Optional[str]=None, 
                       max_tokens: int=100,
                       repetition_penalty: float=1.1,
-                      io_binding: bool=True
-                      ) -> List[str]:
+                      io_binding: bool=True,
+                      top_p: Optional[float]=None,
+                      min_p: Optional[float]=None,
+                      constraint: Optional[JSONConstraint]=None
+                      ) -> str:
         """
-        Runs end-to-end autoregressive inference using a multi-stage ONNX model pipeline.
-
-        This method performs token generation starting from the input query. It initializes the
-        embedding and context layers, then iteratively generates tokens using the context iteration
-        model (`CONTEXT_ITER`) and head model. Supports ONNX Runtime IOBinding for performance.
+        Runs end-to-end autoregressive inference and prints the response as it is generated.
 
         Args:
             query (str): Initial prompt from the user.
@@ -362,75 +442,477 @@ class DeepSeekModelInference():
             max_tokens (int): Maximum number of tokens to generate.
             repetition_penalty (float): Penalizes repetition by adjusting logits for previously seen tokens.
             io_binding (bool): If True, uses preallocated buffers and ONNX IOBinding for inference.
+            top_p (Optional[float]): Nucleus sampling threshold.
+            min_p (Optional[float]): Minimum probability relative to the most likely token.
+            constraint (Optional[JSONConstraint]): Restricts the response to JSON matching a schema.
 
         Returns:
-            List[int]: A list of generated token IDs, including the first token and any subsequent tokens until
-                    either `<|end_of_sentence|>` is reached or `max_tokens` is generated.
+            str: The decoded response, up to `<｜end▁of▁sentence｜>` or `max_tokens` generated tokens.
+        """
+        logger.info(f"\nInitial Query:\n{query}")
+        logger.info("\nGenerated:\n")
+
+        generated_ids = []
+        for event in self.generate(query=query, top_k=top_k, temperature=temperature, persona=persona,
+                                   max_tokens=max_tokens, repetition_penalty=repetition_penalty,
+                                   io_binding=io_binding, top_p=top_p, min_p=min_p, constraint=constraint):
+            print(event.text, end="", flush=True)
+            generated_ids.append(event.token_id)
+
+        return self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+
+    def generate(self, query: str,
+                 top_k: int,
+                 temperature: float,
+                 persona: Optional[str]=None,
+                 max_tokens: int=100,
+                 repetition_penalty: float=1.1,
+                 io_binding: bool=True,
+                 top_p: Optional[float]=None,
+                 min_p: Optional[float]=None,
+                 cancel: Optional[threading.Event]=None,
+                 constraint: Optional[JSONConstraint]=None) -> Iterator[TokenEvent]:
+        """
+        Streams the response token by token.
+
+        The first token is yielded right after prefill, before any decode step runs. Generation stops
+        at `<｜end▁of▁sentence｜>`, after `max_tokens` decode steps, when `cancel` is set, or when the
+        consumer stops iterating; in every case the IO bindings are released before returning.
+
+        Args:
+            query (str): Initial prompt from the user.
+            top_k, temperature, persona, max_tokens, repetition_penalty, io_binding, top_p, min_p, constraint:
+                Same as `run_inference`.
+            cancel (Optional[threading.Event]): Checked before every decode step; set it to stop generating.
+
+        Yields:
+            TokenEvent: Each generated token with its text delta and timing.
 
         Raises:
             ValueError: If IO binding is enabled but required buffers or manager are not initialized.
         """
+        clock = StreamClock()
         # Reset internal buffers and state
         self.kv_cache = {}
-        self.present_key_buffer = {}
-        self.present_value_buffer = {}
         self.output_hidden_states_buffer = None
 
-        # Iter set to false because this is prefill stage
-        embedding_output = self.embedding_session(query=query, persona=persona, iter=False)
-        context_output = self.context_session(embedding_session_outputs=embedding_output)
-        logits = self.head_session(ctx_hidden_states=context_output)
-        next_token_id = self.next_token_prediction(logits=logits, generated_ids=logits, temperature=temperature)
+        with self.tracer.span("prefill", category="step"):
+            token_ids = self.tokenize(self.query(query, persona))
+            logits = self.prefill(token_ids=token_ids)
+
+        yield from self.decode_stream(logits=logits, sequence_length=token_ids.shape[-1], top_k=top_k,
+                                      temperature=temperature, max_tokens=max_tokens,
+                                      repetition_penalty=repetition_penalty, io_binding=io_binding,
+                                      top_p=top_p, min_p=min_p, cancel=cancel, clock=clock,
+                                      constraint=constraint)
+
+    def decode_stream(self, logits: np.array,
+                      sequence_length: int,
+                      top_k: int,
+                      temperature: float,
+                      max_tokens: int=100,
+                      repetition_penalty: float=1.1,
+                      io_binding: bool=True,
+                      top_p: Optional[float]=None,
+                      min_p: Optional[float]=None,
+                      cancel: Optional[threading.Event]=None,
+                      clock: Optional[StreamClock]=None,
+                      keep_kv: bool=False,
+                      constraint: Optional[JSONConstraint]=None) -> Iterator[TokenEvent]:
+        """
+        Samples from prefill logits and decodes autoregressively on top of `self.kv_cache`.
+
+        On return `self.kv_length` holds the number of cached positions and `self.last_token_id` the last
+        sampled token, which is not in the cache yet. With `keep_kv`, keys/values decoded into the IO
+        binding arena are copied back into `self.kv_cache` so the conversation can be continued later.
+
+        Args:
+            logits (np.array): Logits of the last prefilled position.
+            sequence_length (int): Number of positions held by `self.kv_cache`.
+            top_k, temperature, max_tokens, repetition_penalty, io_binding, top_p, min_p, cancel:
+                Same as `generate`.
+            clock (Optional[StreamClock]): Clock started when the request arrived.
+            keep_kv (bool): Leave the final KV cache in `self.kv_cache`.
+            constraint (Optional[JSONConstraint]): Restricts the response to JSON matching a schema; reset
+                before the first token.
+
+        Yields:
+            TokenEvent: Each generated token with its text delta and timing.
+        """
+        clock = clock or StreamClock()
+        detokenizer = IncrementalDetokenizer(tokenizer=self.tokenizer)
+        if constraint is not None:
+            constraint.reset()
+        # Step spans close before each yield so consumer time is not attributed to the model
+        with self.tracer.span("first_token", category="step"):
+            next_token_id = self.next_token_prediction(logits=logits, generated_ids=[], temperature=temperature,
+                                                       constraint=constraint)
+            with self.tracer.span("detokenize", category="detokenize"):
+                text = detokenizer.add(next_token_id)
 
         generated_ids = [next_token_id]
-        prev_sequence_length = self.model_params.max_seq_len
+        prev_sequence_length = self._slide_kv_window(length=sequence_length, io_binding=False)
+        self.kv_length, self.last_token_id = prev_sequence_length, next_token_id
+        yield clock.event(token_id=next_token_id, text=text, index=0)
 
         if io_binding:
-            self.iBindingManager = IOBindingManager(inference_session=self.session_mapper["CONTEXT_ITER"])
-            _, _, hidden_dimensions = context_output.shape
-            _, num_heads, _, head_dimensions = self.kv_cache.get("past_keys_0").shape
-
-            # Initial Buffer allocation
-            hidden_state_dimensions = (1,1,hidden_dimensions)
-            kv_cache_dimensions = (1, num_heads, prev_sequence_length, head_dimensions)
-            self.output_hidden_states_buffer = self.iBindingManager.buffer_preallocation_hidden_states(buffer_shape=hidden_state_dimensions)
-
-            self.present_key_buffer = self.iBindingManager.buffer_preallocation_kv(buffer_shape=kv_cache_dimensions,
-                                                                         num_layers=ModelParameters.num_layers,
-                                                                         keys_or_values="keys")
-            self.present_value_buffer = self.iBindingManager.buffer_preallocation_kv(buffer_shape=kv_cache_dimensions,
-                                                                           num_layers=ModelParameters.num_layers,
-                                                                           keys_or_values="values")
-        logger.info(f"\nInitial Query:\n{query}")
-        logger.info("\nGenerated:\n")
+            self._io_binding_init()
+            self.kv_arena.write(kv_cache=dequantize_kv(self.kv_cache, length=prev_sequence_length),
+                                start=0, length=prev_sequence_length)
+        else:
+            self.kv_cache = self._compress_kv(self.kv_cache)
 
         self.verbose = VerbosityLevel.NONE
-        for _ in range(max_tokens):
-            
-            input_ids = np.array([[next_token_id]], dtype=np.int64)
-            print(self.tokenizer.decode([next_token_id], skip_special_tokens=True), end="", flush=True)
-            
-            embedding_output = self.embedding_session(query=input_ids)
-            iter_outputs = self.context_itr_session(embedding_session_output=embedding_output,
-                                                    previous_sequence_length=prev_sequence_length,
-                                                    io_binding=io_binding)
-            logits = self.head_session(ctx_hidden_states=iter_outputs)
-            next_token_id = self.next_token_prediction(logits=logits, generated_ids=generated_ids,
-                                                       temperature=temperature, top_k=top_k,
-                                                       repetition_penalty=repetition_penalty)
-            generated_ids.append(next_token_id)
-            prev_sequence_length += 1
-
-            if next_token_id == self.tokenizer.token_to_id("< | end_of_sentence | >"):
+        try:
+            for step in range(max_tokens):
+                if next_token_id == self.eos_token_id or (cancel is not None and cancel.is_set()):
+                    break
+                if self.kv_window is None and prev_sequence_length >= self.model_params.context_length:
+                    logger.warning(f"Context length ({self.model_params.context_length}) reached")
+                    break
+
+                with self.tracer.span("decode_step", category="step", position=prev_sequence_length):
+                    prev_sequence_length = self._slide_kv_window(length=prev_sequence_length, io_binding=io_binding)
+                    if io_binding:
+                        logits = self._bound_decode_step(token_id=next_token_id,
+                                                         previous_sequence_length=prev_sequence_length)
+                    else:
+                        input_ids = np.array([[next_token_id]], dtype=np.int64)
+                        embedding_output = self.embedding_session(query=input_ids)
+                        iter_outputs = self.context_itr_session(embedding_session_output=embedding_output,
+                                                                previous_sequence_length=prev_sequence_length,
+                                                                io_binding=False)
+                        logits = self.head_session(ctx_hidden_states=iter_outputs)
+                    next_token_id = self.next_token_prediction(logits=logits, generated_ids=generated_ids,
+                                                               temperature=temperature, top_k=top_k,
+                                                               repetition_penalty=repetition_penalty,
+                                                               top_p=top_p, min_p=min_p, constraint=constraint)
+                    generated_ids.append(next_token_id)
+                    prev_sequence_length += 1
+                    self.kv_length, self.last_token_id = prev_sequence_length, next_token_id
+
+                    with self.tracer.span("detokenize", category="detokenize"):
+                        text = detokenizer.add(next_token_id)
+                        if next_token_id == self.eos_token_id or step == max_tokens - 1:
+                            text += detokenizer.flush()
+                yield clock.event(token_id=next_token_id, text=text, index=len(generated_ids)-1)
+        finally:
+            if keep_kv and io_binding:
+                self.kv_cache = self._compress_kv(self.kv_arena.read(length=prev_sequence_length))
+            elif keep_kv:
+                self.truncate_kv_cache(length=prev_sequence_length)
+            if io_binding:
+                for manager in (self.iBindingManager, self.embeddingBindingManager, self.headBindingManager):
+                    manager.clear_all_bindings()
+            if constraint is not None and not constraint.complete:
+                logger.warning("Generation stopped before the JSON document was complete")
+
+    async def agenerate(self, query: str,
+                        top_k: int,
+                        temperature: float,
+                        persona: Optional[str]=None,
+                        max_tokens: int=100,
+                        repetition_penalty: float=1.1,
+                        io_binding: bool=True,
+                        top_p: Optional[float]=None,
+                        min_p: Optional[float]=None,
+                        constraint: Optional[JSONConstraint]=None) -> AsyncIterator[TokenEvent]:
+        """
+        Async twin of `generate`. Model steps run on a worker thread; cancelling the consuming task
+        or leaving the `async for` loop stops generation before the next decode step.
+
+        Yields:
+            TokenEvent: Each generated token with its text delta and timing.
+        """
+        cancel = threading.Event()
+        events = self.generate(query=query, top_k=top_k, temperature=temperature, persona=persona,
+                               max_tokens=max_tokens, repetition_penalty=repetition_penalty,
+                               io_binding=io_binding, top_p=top_p, min_p=min_p, cancel=cancel,
+                               constraint=constraint)
+        async for event in astream(events, cancel=cancel):
+            yield event
+
+    def prefill(self, token_ids: np.array, start: int=0) -> np.array:
+        """
+        Processes the prompt and leaves its keys/values in `self.kv_cache`.
+
+        Prompts longer than the CONTEXT graph's `max_seq_len` window are processed in consecutive
+        window-sized chunks, carrying the KV cache from one chunk to the next, up to the model's
+        `context_length`. If the CONTEXT graph declares a fixed past length too short for a chunk, the
+        remaining tokens are fed one at a time through CONTEXT_ITER instead.
+
+        If a prefix cache is attached, the longest cached token prefix is restored instead of recomputed:
+        an exact match skips the model entirely, otherwise only the remaining suffix is prefilled on top
+        of the restored cache. Newly prefilled prompts are added to the cache.
+
+        With `start` > 0, `self.kv_cache` already holds the keys/values of `start` earlier positions (e.g. the
+        previous turns of a chat, possibly at `kv_precision`) and `token_ids` are appended after them; the
+        prefix cache is not used.
+
+        Args:
+            token_ids (np.array): Prompt token IDs of shape (1, prompt_length).
+            start (int): Number of positions already present in `self.kv_cache`.
+
+        Returns:
+            np.array: Logits of the last prompt token, of shape (1, 1, vocab_size).
+
+        Raises:
+            ValueError: If the prompt does not fit in the model's context length.
+        """
+        prompt_length = token_ids.shape[-1]
+        if start + prompt_length >= self.model_params.context_length:
+            raise ValueError(f"Prompt of {start + prompt_length} tokens exceeds the context length ({self.model_params.context_length})")
+
+        if start:
+            # Positions below `start` are only used as offsets; their IDs are never embedded
+            hidden_states = self._prefill_chunks(token_ids=np.concatenate([np.zeros((1, start), dtype=token_ids.dtype),
+                                                                           token_ids], axis=-1),
+                                                 start=start)
+            return self.head_session(ctx_hidden_states=hidden_states)
+
+        prefix_length, entry = (0, None) if self.prefix_cache is None else self.prefix_cache.match(token_ids[0])
+
+        if prefix_length == prompt_length:
+            self.kv_cache = entry.kv_slice(prefix_length)
+            return entry.logits
+
+        self.kv_cache = entry.kv_slice(prefix_length) if prefix_length else {}
+        hidden_states = self._prefill_chunks(token_ids=token_ids, start=prefix_length)
+        self.verbosity_embedding(token_id=token_ids,
+                                 embed_output=(1, prompt_length, self.model_params.hidden_size),
+                                 verbose=self.verbose)
+
+        logits = self.head_session(ctx_hidden_states=hidden_states)
+        if self.prefix_cache is not None:
+            self.prefix_cache.insert(token_ids=token_ids[0], kv_cache=self.kv_cache, logits=logits)
+        return logits
+
+    def _prefill_chunks(self, token_ids: np.array, start: int=0, all_positions: bool=False) -> np.array:
+        """
+        Runs prompt positions `start:` through the CONTEXT graph in `max_seq_len`-sized chunks.
+
+        Args:
+            token_ids (np.array): Prompt token IDs of shape (1, prompt_length).
+            start (int): Number of leading positions already present in `self.kv_cache`.
+            all_positions (bool): Return the hidden states of every processed position instead of the last.
+
+        Returns:
+            np.array: Hidden state of the last prompt token, of shape (1, 1, hidden_size), or of every
+                position from `start` on, of shape (1, prompt_length - start, hidden_size).
+        """
+        prompt_length = token_ids.shape[-1]
+        window = self.model_params.max_seq_len
+        context_capacity = self._past_capacity(graph_name="CONTEXT")
+        position = start
+        hidden_states = []
+        if start:
+            # The CONTEXT graph is fed full precision pasts
+            self.kv_cache = dequantize_kv(self.kv_cache, length=start)
+
+        while position < prompt_length:
+            if context_capacity is not None and position + window > context_capacity:
                 break
+            end = min(position + window, prompt_length)
+            embedding_output = self.embedding_session(query=token_ids[:, position:end])
+            context_output = self.context_session(embedding_session_outputs=embedding_output, start=position)
+            # Positions past the chunk hold padding; keep only the prompt's keys/values and hidden states
+            self.kv_cache = {name: cache[:, :, :end] for name, cache in self.kv_cache.items()}
+            hidden_states.append(context_output[:, :end-position] if all_positions
+                                 else context_output[:, end-position-1:end-position])
+            position = end
+
+        # Fallback for a CONTEXT graph whose fixed past length cannot hold the next chunk
+        for position in range(position, prompt_length):
+            embedding_output = self.embedding_session(query=token_ids[:, position:position+1])
+            hidden_states.append(self.context_itr_session(embedding_session_output=embedding_output,
+                                                          previous_sequence_length=position,
+                                                          io_binding=False))
+
+        if all_positions:
+            return np.concatenate(hidden_states, axis=1)
+        return hidden_states[-1]
+
+    def score_tokens(self, token_ids: np.array, start: int) -> np.array:
+        """
+        Processes positions `start:` of a sequence on top of the KV cache and returns logits for each.
 
-        final_response = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+        `self.kv_cache` must hold exactly the first `start` positions; on return it also covers the
+        newly processed ones. Used to verify several speculative tokens in one pass.
 
-        if io_binding:
-            self.iBindingManager.clear_all_bindings()
+        Args:
+            token_ids (np.array): Full sequence of token IDs of shape (1, sequence_length).
+            start (int): Number of positions already present in the KV cache.
+
+        Returns:
+            np.array: Logits of shape (1, sequence_length - start, vocab_size).
+        """
+        hidden_states = self._prefill_chunks(token_ids=token_ids, start=start, all_positions=True)
+        return self.head_session(ctx_hidden_states=hidden_states)
+
+    def truncate_kv_cache(self, length: int) -> None:
+        """
+        Discards every cached position from `length` on (e.g. rejected speculative tokens).
+
+        Args:
+            length (int): Number of leading positions to keep.
+        """
+        self.kv_cache = truncate_kv(self.kv_cache, length)
+
+    def _compress_kv(self, kv_cache: Dict[str, np.ndarray]) -> Dict[str, object]:
+        """
+        Converts a KV dictionary to `kv_precision` with per-position scales; "fp32" and already
+        quantized dictionaries are returned unchanged.
+        """
+        if self.kv_precision == "fp32" or is_quantized(kv_cache):
+            return kv_cache
+        return quantize_kv(kv_cache, self.kv_precision, per_position=True)
+
+    def _slide_kv_window(self, length: int, io_binding: bool) -> int:
+        """
+        Makes room for the next position when bounded-memory mode is on.
+
+        Once the cache holds `kv_window` positions, a block of the oldest positions after the attention
+        sinks is evicted (StreamingLLM-style) and the rest shift left, with keys re-rotated to their new
+        positions. Evicting a whole block at a time keeps the copy off most decode steps; afterwards
+        memory and per-step attention cost stay bounded by `kv_window`.
+
+        Args:
+            length (int): Number of positions currently cached.
+            io_binding (bool): Whether the cache lives in the KV arena (True) or in `self.kv_cache`.
+
+        Returns:
+            int: Number of positions cached after eviction.
+        """
+        if self.kv_window is None or length < self.kv_window:
+            return length
+
+        count = length - (self.kv_window - self.kv_evict_block)
+        with self.tracer.span("kv_evict", category="kv", count=count):
+            if io_binding:
+                return self.kv_arena.evict(start=self.attention_sinks, count=count,
+                                           rope_theta=self.model_params.rope_theta)
+            quantized = is_quantized(self.kv_cache)
+            self.kv_cache = evict_positions(dequantize_kv(self.kv_cache), start=self.attention_sinks, count=count,
+                                            rope_theta=self.model_params.rope_theta)
+            if quantized:
+                self.kv_cache = quantize_kv(self.kv_cache, self.kv_precision, per_position=True)
+        return length - count
+
+    def _past_capacity(self, graph_name: str) -> Optional[int]:
+        """
+        Reads the past sequence length a graph was exported with.
+
+        Args:
+            graph_name (str): Key of the session in `session_mapper`.
+
+        Returns:
+            Optional[int]: The fixed past length, or None if the dimension is dynamic.
+        """
+        past_input = next((graph_input for graph_input in self.session_mapper[graph_name].get_inputs()
+                           if graph_input.name == "past_keys_0"), None)
+        if past_input is None or not isinstance(past_input.shape[2], int):
+            return None
+        return past_input.shape[2]
+
+    def kv_dtype(self, graph_name: str) -> np.dtype:
+        """
+        Returns the storage type a graph expects for its past keys/values (float32 or float16).
+
+        Graphs exported with float16 KV inputs get float16 buffers, halving KV memory without any
+        conversion at the graph boundary.
+
+        Args:
+            graph_name (str): Key of the session in `session_mapper`.
+
+        Returns:
+            np.dtype: numpy type matching the `past_keys_0` input, np.float32 if unknown.
+        """
+        past_input = next((graph_input for graph_input in self.session_mapper[graph_name].get_inputs()
+                           if graph_input.name == "past_keys_0"), None)
+        return ONNX_KV_DTYPES.get(getattr(past_input, "type", None), np.float32)
+
+    def _io_binding_init(self) -> None:
+        """
+        Prepares IO bindings for the whole decode pipeline: EMBEDDING, CONTEXT_ITER and HEAD.
+
+        The KV arena is allocated once per instance (sized to genai_config's `context_length`, or to
+        `kv_window` in bounded-memory mode) and reused across calls. Its per-layer blocks are bound by offset as both past inputs and present outputs,
+        so each decode step writes the new position in place. Sequence length scalars and the output
+        hidden state buffer are bound once and updated in place.
+
+        The graphs are chained through shared buffers: the buffer EMBEDDING writes its output to is
+        CONTEXT_ITER's bound input, and CONTEXT_ITER's output buffer is HEAD's bound input, so a decode
+        step hands tensors between graphs without any host copy or allocation. Only the token ID is
+        written per step and the logits are read from their bound buffer.
+        """
+        if self.kv_arena is None:
+            self.kv_arena = KVCacheArena(num_layers=self.model_params.num_layers,
+                                         batch_size=self.model_params.batch_size,
+                                         num_key_value_heads=self.model_params.num_key_value_heads,
+                                         capacity=self.kv_window or self.model_params.context_length,
+                                         head_size=self.model_params.attn_head_size,
+                                         dtype=self.kv_dtype(graph_name="CONTEXT_ITER"))
+        self.kv_arena.reset()
+
+        self.iBindingManager = IOBindingManager(inference_session=self.session_mapper["CONTEXT_ITER"])
+        hidden_size = self.iBindingManager.outputs[0].shape[-1]
+        self.output_hidden_states_buffer = self.iBindingManager.buffer_preallocation_hidden_states(
+            buffer_shape=(1,1,hidden_size),
+            dtype=ONNX_KV_DTYPES.get(self.iBindingManager.outputs[0].type, np.float32))
+        self.past_seq_len_buffer = np.zeros((1,1), dtype=np.int32)
+        self.total_seq_len_buffer = np.zeros((1,), dtype=np.int32)
+
+        self.iBindingManager.bind_kv_arena(kv_arena=self.kv_arena)
+        self.iBindingManager.bind_input(name="past_seq_len", buffer=self.past_seq_len_buffer)
+        self.iBindingManager.bind_input(name="total_seq_len", buffer=self.total_seq_len_buffer)
+        self.iBindingManager.bind_output(name=self.iBindingManager.layer_names[0],
+                                         buffer=self.output_hidden_states_buffer)
+
+        self.embeddingBindingManager = IOBindingManager(inference_session=self.session_mapper["EMBEDDING"])
+        embedding_output = self.embeddingBindingManager.outputs[0]
+        self.token_id_buffer = np.zeros((1,1), dtype=np.int64)
+        self.input_hidden_states_buffer = np.empty((1,1,embedding_output.shape[-1]),
+                                                   dtype=ONNX_KV_DTYPES.get(embedding_output.type, np.float32))
+        self.embeddingBindingManager.bind_input(name="input_ids", buffer=self.token_id_buffer)
+        self.embeddingBindingManager.bind_output(name=embedding_output.name, buffer=self.input_hidden_states_buffer)
+        self.iBindingManager.bind_input(name="input_hidden_states", buffer=self.input_hidden_states_buffer)
+
+        self.headBindingManager = IOBindingManager(inference_session=self.session_mapper["HEAD"])
+        logits_output = self.headBindingManager.outputs[0]
+        self.headBindingManager.bind_input(name="output_hidden_states", buffer=self.output_hidden_states_buffer)
+        if isinstance(logits_output.shape[-1], int):
+            self.logits_buffer = np.empty((1,1,logits_output.shape[-1]),
+                                          dtype=ONNX_KV_DTYPES.get(logits_output.type, np.float32))
+            self.headBindingManager.bind_output(name=logits_output.name, buffer=self.logits_buffer)
+        else:
+            # Symbolic vocabulary dimension: let the session allocate the logits once per step
+            self.logits_buffer = None
+            self.headBindingManager.io_binding.bind_output(name=logits_output.name, device_type="cpu")
+
+    def _bound_decode_step(self, token_id: int, previous_sequence_length: int) -> np.array:
+        """
+        Runs EMBEDDING, CONTEXT_ITER and HEAD for one token over the buffers bound in `_io_binding_init`.
+
+        Args:
+            token_id (int): Token to feed.
+            previous_sequence_length (int): Number of positions already in the KV arena.
+
+        Returns:
+            np.array: Logits of shape (1, 1, vocab_size). The bound buffer is returned and is overwritten
+                by the next step.
+        """
+        self.token_id_buffer[0, 0] = token_id
+        with self.tracer.span("EMBEDDING", tokens=1, io_binding=True):
+            self.session_mapper["EMBEDDING"].run_with_iobinding(self.embeddingBindingManager.io_binding)
+        self.context_itr_session(embedding_session_output=self.input_hidden_states_buffer,
+                                 previous_sequence_length=previous_sequence_length,
+                                 io_binding=True)
+        with self.tracer.span("HEAD", tokens=1, io_binding=True):
+            self.session_mapper["HEAD"].run_with_iobinding(self.headBindingManager.io_binding)
+        if self.logits_buffer is None:
+            return self.headBindingManager.io_binding.get_outputs()[0].numpy()
+        return self.logits_buffer
 
-        return final_response
-    
     def kv_cache_update(self, ctx_outputs):
         """
         Updates the key-value (KV) cache based on the output of a transformer model context pass.
@@ -469,7 +951,7 @@ class DeepSeekModelInference():
         """
         return f"You are a {role.value}.\n"
 
-    def _cache_init(self, embedding_output: np.array) -> Dict[str,np.array]:
+    def _cache_init(self, embedding_output: np.array, start: int=0) -> Dict[str,np.array]:
         """
         Initializes an empty KV cache and prepares inputs for the first transformer context pass.
 
@@ -478,23 +960,31 @@ class DeepSeekModelInference():
         - sequence length metadata,
         - and padded input embeddings to match the model's sequence expectations.
 
+        For later chunks of a long prompt (`start` > 0) the past buffers are sized to hold the processed
+        positions plus one window and are seeded with the first `start` positions of `self.kv_cache`.
+
         Args:
             embedding_output (np.array): The embedding output array from the embedding session.
+            start (int): Number of positions already processed before this chunk.
 
         Returns:
             Dict[str, np.array]: A dictionary containing all inputs required for the initial context pass,
                 including "past_keys_X", "past_values_X", "input_hidden_states", and sequence length metadata.
         """
         empty_kv = defaultdict()
-        output_dimensionality = embedding_output.shape[1]
+        output_dimensionality = start + embedding_output.shape[1]
         past_shape = (self.model_params.batch_size,
                           self.model_params.num_key_value_heads,
-                          self.model_params.max_seq_len,
+                          start + self.model_params.max_seq_len,
                           self.model_params.attn_head_size)
         
+        kv_dtype = self.kv_dtype(graph_name="CONTEXT")
         for layer in range(self.model_params.num_layers):
-            empty_kv[f"past_keys_{layer}"] = np.zeros(past_shape, dtype=np.float32)
-            empty_kv[f"past_values_{layer}"] = np.zeros(past_shape, dtype=np.float32)
+            empty_kv[f"past_keys_{layer}"] = np.zeros(past_shape, dtype=kv_dtype)
+            empty_kv[f"past_values_{layer}"] = np.zeros(past_shape, dtype=kv_dtype)
+            if start:
+                empty_kv[f"past_keys_{layer}"][:, :, :start] = self.kv_cache[f"past_keys_{layer}"][:, :, :start]
+                empty_kv[f"past_values_{layer}"][:, :, :start] = self.kv_cache[f"past_values_{layer}"][:, :, :start]
         
         seq_lengths = {
             "past_seq_len": np.array(output_dimensionality-1, dtype=np.int32).reshape(1,1),
@@ -619,43 +1109,46 @@ class IOBindingManager():
                                         ) -> np.array:
         return np.empty(buffer_shape, dtype=dtype)
 
-    def buffer_preallocation_kv(self, 
-                                buffer_shape: Tuple,
-                                num_layers: int,
-                                keys_or_values: str,
-                                dtype: np.dtype=np.float32
-                                ) -> Dict[str,str]:
-        return {f"past_{keys_or_values}_{layer}": np.empty(buffer_shape, dtype=dtype) \
-                for layer in range(num_layers)}   
-    
-    def buffer_reallocation_kv(self, 
-                               updated_buffer_shape: Tuple,
-                               num_layers: int,
-                               present_key_buffer: Dict[str,str],
-                               present_value_buffer: Dict[str,str],
-                               dtype: np.dtype=np.float32
-                               ) -> None:
-        for layer in range(num_layers):
+    def bind_kv_arena(self,
+                      kv_arena: KVCacheArena,
+                      slot: Optional[int]=None,
+                      device_type: str="cpu",
+                      device_id: int=0
+                      ) -> None:
+        """
+        Binds every layer of a KV arena as both past input and present output.
+
+        Each layer is bound by offset into the arena's contiguous key and value storage, so the session
+        reads the past and writes the present into the same memory.
+
+        Args:
+            kv_arena (KVCacheArena): Preallocated cache covering all layers.
+            slot (Optional[int]): If provided, bind only this slot's blocks (batch size 1).
+            device_type (str): Device on which the arena resides.
+            device_id (int): Device index.
+        """
+        element_type = kv_arena.keys.dtype
+        shape = kv_arena.layer_shape if slot is None else kv_arena.slot_shape
+        for layer in range(kv_arena.num_layers):
+            key_ptr, value_ptr = kv_arena.layer_pointers(layer, slot=slot)
             key_name = self.layer_names[1 + layer * 2]
             value_name = self.layer_names[1 + layer * 2 + 1]
 
-            key_buffer = np.empty(updated_buffer_shape, dtype=dtype)
-            value_buffer = np.empty(updated_buffer_shape, dtype=dtype)
-
-            present_key_buffer[f"past_keys_{layer}"] = key_buffer
-            present_value_buffer[f"past_values_{layer}"] = value_buffer
-            
-            self.bind_output(name=key_name,
-                             buffer=key_buffer,
-                              device_type="cpu",
-                              device_id=0,
-                              )
-            self.bind_output(name=value_name,
-                             buffer=value_buffer,
-                              device_type="cpu",
-                              device_id=0,
-                              )
-        
+            for input_name, output_name, buffer_ptr in ((f"past_keys_{layer}", key_name, key_ptr),
+                                                        (f"past_values_{layer}", value_name, value_ptr)):
+                self.io_binding.bind_input(input_name,
+                                           device_type=device_type,
+                                           device_id=device_id,
+                                           element_type=element_type,
+                                           shape=shape,
+                                           buffer_ptr=buffer_ptr)
+                self.io_binding.bind_output(name=output_name,
+                                            device_type=device_type,
+                                            device_id=device_id,
+                                            element_type=element_type,
+                                            shape=shape,
+                                            buffer_ptr=buffer_ptr)
+
     def bind_output(self,
                  name: str,
                  buffer: np.array,
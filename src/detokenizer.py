@@ -0,0 +1,68 @@
+from tokenizers import Tokenizer
+
+
+class IncrementalDetokenizer():
+    """
+    Turns a stream of token IDs into text deltas without re-decoding the whole sequence.
+
+    Only a short window of recent tokens is decoded per step: the tokens since the last emitted
+    delta (`read_offset` on) plus the tokens that produced that delta (`prefix_offset` to
+    `read_offset`). Decoding the window with its prefix and diffing against the prefix alone keeps
+    word-boundary handling (leading spaces, byte-level merges) identical to a full decode, while the
+    cost per token stays constant. Text ending in an incomplete UTF-8 sequence (decoded as U+FFFD) is
+    held back until the following tokens complete it.
+
+    Args:
+        tokenizer (Tokenizer): Tokenizer used to decode the IDs.
+        skip_special_tokens (bool): Drop special tokens from the text.
+
+    Attributes:
+        text (str): All text emitted so far.
+    """
+
+    def __init__(self, tokenizer: Tokenizer, skip_special_tokens: bool=True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.text = ""
+        self._window = []
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def add(self, token_id: int) -> str:
+        """
+        Appends a token and returns the newly stable text.
+
+        Args:
+            token_id (int): Next generated token ID.
+
+        Returns:
+            str: Text completed by this token; empty if nothing new is printable yet.
+        """
+        self._window.append(token_id)
+        prefix_text = self._decode(self._window[self._prefix_offset:self._read_offset])
+        new_text = self._decode(self._window[self._prefix_offset:])
+        if len(new_text) <= len(prefix_text) or new_text.endswith("�"):
+            return ""
+
+        delta = new_text[len(prefix_text):]
+        self.text += delta
+        # The tokens just emitted become the prefix of the next window; older ones are dropped
+        self._window = self._window[self._read_offset:]
+        self._prefix_offset = 0
+        self._read_offset = len(self._window)
+        return delta
+
+    def flush(self) -> str:
+        """
+        Returns any text still held back, e.g. a sequence ending in an incomplete character.
+        """
+        prefix_text = self._decode(self._window[self._prefix_offset:self._read_offset])
+        delta = self._decode(self._window[self._prefix_offset:])[len(prefix_text):]
+        self.text += delta
+        self._window = self._window[self._read_offset:]
+        self._prefix_offset = 0
+        self._read_offset = len(self._window)
+        return delta
+
+    def _decode(self, token_ids) -> str:
+        return self.tokenizer.decode(token_ids, skip_special_tokens=self.skip_special_tokens) if token_ids else ""
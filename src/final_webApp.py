@@ -2,22 +2,23 @@ import streamlit as st
 import sqlite3
 import bcrypt
 import os
-import subprocess
-import io
 import uuid
 import datetime
-from PIL import Image
 
-import torch
 #import pandas as pd
-from transformers import CLIPVisionModelWithProjection, AutoProcessor
 
 import numpy as np
-import faiss
-import sqlite3
+
+from clip_preprocessing import load_image
+from llm_backend import LLMBackendError, default_backend
+from resources import db_pool, faiss_index, image_embedding_server
 
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
+# Uploads are decoded at reduced size (JPEG draft mode) with the shortest side kept at least this large,
+# enough for the preview and the 224px CLIP input
+PREVIEW_SIZE = 1024
+
 # ========== USER AUTH ==========
 def connect_user_db():
     return sqlite3.connect("users.db")
@@ -101,11 +102,13 @@ class AskDanApp:
         self.image_file = None
         self.description = ""
         self.image_bytes = None
+        self.image = None
 
-        #backend image model setup 
-        self.image_model = CLIPVisionModelWithProjection.from_pretrained("openai/clip-vit-large-patch14")
-        self.processor = AutoProcessor.from_pretrained("openai/clip-vit-large-patch14")
-        self.index = faiss.read_index("./embedding_database/faiss_index.faiss")
+        #backend image model setup, shared by every session and rerun (loaded once per process)
+        self.image_embedder = image_embedding_server(processor=os.environ.get("CLIP_PROCESSOR", "npu"),
+                                                     variant=os.environ.get("CLIP_VARIANT", "fp32"))
+        self.index = faiss_index("./embedding_database/faiss_index.faiss")
+        self.food_db = db_pool("./embedding_database/food.db")
 
     def run(self):
         st.sidebar.title("🍽️ Navigation")
@@ -123,10 +126,10 @@ class AskDanApp:
         self.description = st.text_area("Food Description", placeholder="e.g. Toast with eggs and avocado.")
 
         if self.image_file:
-            self.image_bytes = self.image_file.read()
+            self.image_bytes = self.image_file.getvalue()
             try:
-                image = Image.open(io.BytesIO(self.image_bytes))
-                st.image(image, caption="Uploaded Image")
+                self.image = self.decoded_upload()
+                st.image(self.image, caption="Uploaded Image")
             except Exception as e:
                 st.error(f"Image error: {e}")
 
@@ -149,13 +152,20 @@ class AskDanApp:
                 )
                 st.success("Meal saved!")
 
+    def decoded_upload(self):
+        # Decode each upload once; Streamlit reruns (typing, Submit) reuse the decoded image
+        cached = st.session_state.get("decoded_upload")
+        if cached is not None and cached[0] == self.image_file.file_id:
+            return cached[1]
+        image = load_image(self.image_bytes, image_size=PREVIEW_SIZE)
+        image.load()
+        st.session_state["decoded_upload"] = (self.image_file.file_id, image)
+        return image
+
     #backend process 
-    def image_vector(self, img_path):
-        print(f"Processing image: {img_path}")
-        input_img = Image.open(img_path).convert("RGB")
-        image_inputs = self.processor(images=input_img, return_tensors="pt")
-        image_inputs = image_inputs.to('cpu').to(torch.HalfTensor)
-        outputs = self.image_model(**image_inputs).image_embeds.detach().numpy()
+    def image_vector(self, image):
+        print(f"Processing image: {image.size[0]}x{image.size[1]}")
+        outputs = self.image_embedder.embed([image])
         return outputs
     
 
@@ -169,17 +179,13 @@ class AskDanApp:
     def get_db_data(self, neighbors):
         print(f"Fetching data for neighbors: {neighbors}")
         neighbors = [int(n) for n in neighbors]  # Ensure all IDs are valid integers
-        conn = sqlite3.connect("./embedding_database/food.db")
-        cursor = conn.cursor()
-
         placeholders = ','.join(['?'] * len(neighbors))
 
         # Build and execute query
         query = f"SELECT * FROM foods WHERE ID IN ({placeholders})"
-        cursor.execute(query, neighbors)
-
-        # Fetch all matching rows
-        rows = cursor.fetchall()
+        with self.food_db.connection() as conn:
+            # Fetch all matching rows
+            rows = conn.execute(query, neighbors).fetchall()
         return rows
     
 
@@ -200,9 +206,9 @@ class AskDanApp:
         return labeled_rows
 
 
-    def backend(self, img_path, k=5):  #the goal is to query the database and then provide the 
+    def backend(self, image, k=5):  #the goal is to query the database and then provide the 
         #get the image vector 
-        output_vector = self.image_vector(img_path)
+        output_vector = self.image_vector(image)
         #query faiss + get vector id codes 
         neighbors = self.get_neighbors(output_vector, k)
         rows = self.get_db_data(neighbors)
@@ -210,31 +216,25 @@ class AskDanApp:
         return processed_rows
     
     def caption_image(self):
-        image_path = f"temp_{uuid.uuid4().hex}.jpg"
         try:
-            with open(image_path, 'wb') as f:
-                f.write(self.image_bytes)
-
-            rows = self.backend(image_path, 5)
+            if self.image is None:
+                self.image = load_image(self.image_bytes, image_size=PREVIEW_SIZE)
+            rows = self.backend(self.image, 5)
             rows = "\n".join(rows) if rows else ""
 
             prompt = (
-                f"Analyze this image file: {image_path}. "
+                f"Analyze the attached image. "
                 f"Describe what you see and estimate ingredient breakdown. "
                 f"User description: {self.description}"
                 f"Here are some context with the top entries in the nutrition database for reference for caloric calculations: {rows}"
             )
-            print(f"Running Ollama with prompt: {prompt}")
-            result = subprocess.run(["ollama", "run", "gemma3:4b", prompt],
-                                    capture_output=True, text=True, encoding='utf-8')
-            if result.returncode != 0:
-                return f"Error running Ollama: {result.stderr.strip()}"
-            return result.stdout.strip()
+            print(f"Running LLM with prompt: {prompt}")
+            # The model gets the uploaded file as is; nothing is re-encoded
+            return default_backend().generate(prompt, images=[self.image_bytes], timeout=300)
+        except LLMBackendError as e:
+            return f"Error running LLM: {e}"
         except Exception as e:
             return f"Exception: {e}"
-        finally:
-            if os.path.exists(image_path):
-                os.remove(image_path)
 
     def run_dashboard(self):
         st.title("📋 Meal Dashboard")
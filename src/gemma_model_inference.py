@@ -12,16 +12,22 @@ import logging
 import time
 import re
 import sys
+import threading
 
 from enum import IntEnum, Enum
 from tokenizers import Tokenizer
-from typing import List, Dict, Optional, Tuple
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Tuple
 from pathlib import Path
 from dataclasses import dataclass
 from collections import defaultdict
 
 sys.path.append(str(Path(__file__).parent.parent))
-from utils import apply_repetition_penalty, top_k_probas
+from prefix_cache import PrefixKVCache
+from sampler import Sampler
+from constrained_decoding import JSONConstraint
+from detokenizer import IncrementalDetokenizer
+from instrumentation import NULL_TRACER
+from streaming import StreamClock, TokenEvent, astream
 
 # Move into a utils
 class VerbosityLevel(IntEnum):
@@ -62,7 +68,10 @@ class GemmaModelInference():
                  tokenizer: str,
                  model_subdirectory: Path,
                  model_meta: dict,
-                 verbose: VerbosityLevel = VerbosityLevel.NONE):
+                 verbose: VerbosityLevel = VerbosityLevel.NONE,
+                 prefix_cache: Optional[PrefixKVCache]=None,
+                 seed: Optional[int]=None,
+                 tracer=NULL_TRACER):
         self.session_mapper = model_sessions
         self.root_dir = Path.cwd()
         self.model_subdirectory = model_subdirectory
@@ -70,13 +79,18 @@ class GemmaModelInference():
         self.tokenizer = Tokenizer.from_file(str(self.tokenizer_path))
         self.model_params = ModelParameters(**model_meta)
         self.verbose = verbose
-        self.softmax = lambda x, temperature=1: np.exp((x-np.max(x))/temperature)/np.sum(np.exp((x-np.max(x))/temperature), axis=-1)
+        self.sampler = Sampler(seed=seed)
+        self.prefix_cache = prefix_cache
+        self.tracer = tracer
+        self.stop_token_ids = {token_id for token_id in (self.tokenizer.token_to_id("<end_of_turn>"),
+                                                         self.tokenizer.token_to_id("<eos>"))
+                               if token_id is not None}
 
         # self.verbosity_init(self.verbose)
     
     def query(self, query: str, system_prompt: Optional[str]=None, persona: Optional[str]=None) -> str:
         
-        self.query = query
+        self.last_query = query
 
         if system_prompt:
             formatted_query = self._prompt_template().replace("[system_instruction]",system_prompt)\
@@ -127,55 +141,169 @@ class GemmaModelInference():
         present_kv.update({f"past_key_values.{i}.value": model_outputs[1 + i * 2 + 1] for i in range(self.model_params.num_layers)})
         return present_kv
     
-    def next_token(self, model_outputs: Dict, temperature: float, top_k: Optional[int]=None):
+    def next_token(self, model_outputs: Dict, temperature: float, top_k: Optional[int]=None,
+                   constraint: Optional[JSONConstraint]=None):
         logits = model_outputs[0]
-        probas = self.softmax(logits[0,-1], temperature=temperature)
-        indices = probas.copy()
-        if top_k:
-            indices, probas = top_k_probas(probas=probas, k=top_k)
-            next_token_id = int(np.random.choice(indices, p=probas))
-        else:
-            next_token_id = int(np.random.choice(len(probas), p=probas))
+        with self.tracer.span("sampler", category="sampler"):
+            next_token_id = int(self.sampler.sample(logits[:, -1], temperature=temperature, top_k=top_k,
+                                                    allowed=None if constraint is None else constraint.mask())[0])
+            if constraint is not None:
+                constraint.advance(next_token_id)
         return next_token_id
     
     def decode(self, input_ids: np.array, next_token_id: int, kv_cache: Dict, max_tokens: int,
-               temperature: float, top_k: int):
+               temperature: float, top_k: int, constraint: Optional[JSONConstraint]=None):
+        logger.info(f"\nInitial Query:\n{self.last_query}")
+        logger.info("\nGenerated:\n")
+
+        generated_ids = []
+        for event in self.decode_stream(input_ids=input_ids, next_token_id=next_token_id, kv_cache=kv_cache,
+                                        max_tokens=max_tokens, temperature=temperature, top_k=top_k,
+                                        constraint=constraint):
+            print(event.text, end="", flush=True)
+            generated_ids.append(event.token_id)
+
+        output_text = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+        return output_text
+
+    def decode_stream(self, input_ids: np.array, next_token_id: int, kv_cache: Dict, max_tokens: int,
+                      temperature: float, top_k: int,
+                      cancel: Optional[threading.Event]=None,
+                      clock: Optional[StreamClock]=None,
+                      constraint: Optional[JSONConstraint]=None) -> Iterator[TokenEvent]:
+        """
+        Yields the already sampled first token, then one token per decode step until a stop token
+        (`<end_of_turn>` or `<eos>`), `max_tokens` steps, or `cancel` being set. A `constraint` must
+        already have advanced past the first token.
+        """
+        clock = clock or StreamClock()
+        detokenizer = IncrementalDetokenizer(tokenizer=self.tokenizer)
         generated_ids = [next_token_id]
         sequence_length = input_ids.shape[-1]
         position_iter = input_ids.shape[-1]
-        printed_length = 0
 
-        logger.info(f"\nInitial Query:\n{self.query}")
-        logger.info("\nGenerated:\n")
+        with self.tracer.span("detokenize", category="detokenize"):
+            text = detokenizer.add(next_token_id)
+        yield clock.event(token_id=next_token_id, text=text, index=0)
 
-        for _ in range(max_tokens):
-            input_ids = np.array([[next_token_id]], dtype=np.int64)
-            position_ids = np.array([[position_iter]], dtype=np.int64)
-            input_dict = self._input_process(input_ids=input_ids,
-                                             current_seq_length=sequence_length,
-                                             position_ids=[position_iter],
-                                             kv_cache=kv_cache)
-            decode_output = self.session_mapper["MODEL"].run(None, input_dict)
-            sequence_length += 1
-            position_iter += 1
-
-            kv_cache = self.kv_cache_update(decode_output)
-            next_token_id = self.next_token(model_outputs=decode_output,
-                                            temperature=temperature,
-                                            top_k=top_k)
-            generated_ids.append(next_token_id)
-            full_text = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
-            new_text = full_text[printed_length:]
-            if new_text:
-                print(new_text, end="", flush=True)
-                printed_length = len(full_text)
-
-            if next_token_id == self.tokenizer.token_to_id("<end_of_turn>"):
-                break    
+        for step in range(max_tokens):
+            if next_token_id in self.stop_token_ids or (cancel is not None and cancel.is_set()):
+                break
 
-        output_text = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
-        return output_text
+            # Step spans close before each yield so consumer time is not attributed to the model
+            with self.tracer.span("decode_step", category="step", position=position_iter):
+                input_ids = np.array([[next_token_id]], dtype=np.int64)
+                input_dict = self._input_process(input_ids=input_ids,
+                                                 current_seq_length=sequence_length,
+                                                 position_ids=[position_iter],
+                                                 kv_cache=kv_cache)
+                with self.tracer.span("MODEL", position=position_iter):
+                    decode_output = self.session_mapper["MODEL"].run(None, input_dict)
+                sequence_length += 1
+                position_iter += 1
+
+                kv_cache = self.kv_cache_update(decode_output)
+                next_token_id = self.next_token(model_outputs=decode_output,
+                                                temperature=temperature,
+                                                top_k=top_k,
+                                                constraint=constraint)
+                generated_ids.append(next_token_id)
+                with self.tracer.span("detokenize", category="detokenize"):
+                    text = detokenizer.add(next_token_id)
+                    if next_token_id in self.stop_token_ids or step == max_tokens - 1:
+                        text += detokenizer.flush()
+            yield clock.event(token_id=next_token_id, text=text, index=len(generated_ids)-1)
+
+    def generate(self,
+                 query: str,
+                 top_k: int=50,
+                 temperature: float=0.6,
+                 max_tokens: int=100,
+                 system_prompt: Optional[str]=None,
+                 cancel: Optional[threading.Event]=None,
+                 constraint: Optional[JSONConstraint]=None) -> Iterator[TokenEvent]:
+        """
+        Streams the response to `query` token by token; the first token is yielded right after prefill.
+
+        Args:
+            query (str): The user's question.
+            top_k (int): Limits token sampling to top-k most probable choices.
+            temperature (float): Sampling temperature.
+            max_tokens (int): Maximum number of decode steps.
+            system_prompt (Optional[str]): Optional system instruction.
+            cancel (Optional[threading.Event]): Checked before every decode step; set it to stop generating.
+            constraint (Optional[JSONConstraint]): Restricts the response to JSON matching a schema. Its
+                end token should be `<end_of_turn>`.
+
+        Yields:
+            TokenEvent: Each generated token with its text delta and timing.
+        """
+        clock = StreamClock()
+        if constraint is not None:
+            constraint.reset()
+        with self.tracer.span("prefill", category="step"):
+            token_ids = self.query(query=query, system_prompt=system_prompt)
+            logits, kv_cache = self.prefill(token_ids=token_ids)
+            next_token_id = self.next_token([logits], temperature=temperature, top_k=top_k, constraint=constraint)
+        yield from self.decode_stream(input_ids=token_ids, next_token_id=next_token_id, kv_cache=kv_cache,
+                                      max_tokens=max_tokens, temperature=temperature, top_k=top_k,
+                                      cancel=cancel, clock=clock, constraint=constraint)
+
+    async def agenerate(self,
+                        query: str,
+                        top_k: int=50,
+                        temperature: float=0.6,
+                        max_tokens: int=100,
+                        system_prompt: Optional[str]=None,
+                        constraint: Optional[JSONConstraint]=None) -> AsyncIterator[TokenEvent]:
+        """
+        Async twin of `generate`. Model steps run on a worker thread; cancelling the consuming task
+        or leaving the `async for` loop stops generation before the next decode step.
+        """
+        cancel = threading.Event()
+        events = self.generate(query=query, top_k=top_k, temperature=temperature, max_tokens=max_tokens,
+                               system_prompt=system_prompt, cancel=cancel, constraint=constraint)
+        async for event in astream(events, cancel=cancel):
+            yield event
     
+    def prefill(self, token_ids: np.array) -> Tuple[np.array, Dict]:
+        """
+        Runs the prompt through the model, reusing a cached token prefix when available.
+
+        With a prefix cache attached, an exact match returns the cached logits and KV cache without
+        running the model; a partial match feeds only the remaining suffix on top of the cached
+        keys/values. Newly prefilled prompts are added to the cache.
+
+        Args:
+            token_ids (np.array): Prompt token IDs of shape (1, prompt_length).
+
+        Returns:
+            Tuple[np.array, Dict]: Logits of the last prompt token (1, 1, vocab_size) and the KV cache.
+        """
+        len_token_id = token_ids.shape[-1]
+        prefix_length, entry = (0, None) if self.prefix_cache is None else self.prefix_cache.match(token_ids[0])
+
+        if prefix_length == len_token_id:
+            return entry.logits, entry.kv_slice(prefix_length)
+
+        if prefix_length:
+            kv_cache = entry.kv_slice(prefix_length)
+        else:
+            kv_cache = self._cache_init()
+        position_ids = np.arange(prefix_length, len_token_id, dtype=np.int64)
+        input_dict = self._input_process(input_ids=token_ids[:, prefix_length:],
+                                         current_seq_length=len_token_id,
+                                         position_ids = position_ids,
+                                         kv_cache=kv_cache)
+        with self.tracer.span("MODEL", start=prefix_length, tokens=len_token_id - prefix_length):
+            prefill_output = self.session_mapper["MODEL"].run(None, input_dict)
+        kv_cache = self.kv_cache_update(model_outputs=prefill_output)
+        logits = prefill_output[0][:, -1:]
+
+        if self.prefix_cache is not None:
+            self.prefix_cache.insert(token_ids=token_ids[0], kv_cache=kv_cache, logits=logits)
+        return logits, kv_cache
+
     def _prompt_template(self):
         return """<start_of_turn>user
                     [system_instruction]. [query]
@@ -190,26 +318,22 @@ class GemmaModelInference():
                       max_tokens: int=100,
                       system_prompt: Optional[str]=None,
                       io_binding: Optional[bool]=None,
-                      repetition_penalty: Optional[float]=None) -> List[str]:
+                      repetition_penalty: Optional[float]=None,
+                      constraint: Optional[JSONConstraint]=None) -> List[str]:
         
         token_ids = self.query(query=query, system_prompt=system_prompt)
-        kv_cache = self._cache_init()
-        len_token_id = token_ids.shape[-1]
-        position_ids = np.array(np.arange(len_token_id, dtype=np.int64))
-        input_dict = self._input_process(input_ids=token_ids,
-                                         current_seq_length=len_token_id,
-                                         position_ids = position_ids,
-                                         kv_cache=kv_cache)
-        prefill_output = self.session_mapper["MODEL"].run(None, input_dict)
-        kv_cache = self.kv_cache_update(model_outputs=prefill_output)
-        next_token_id = self.next_token(prefill_output, temperature=temperature, top_k=top_k)
+        logits, kv_cache = self.prefill(token_ids=token_ids)
+        if constraint is not None:
+            constraint.reset()
+        next_token_id = self.next_token([logits], temperature=temperature, top_k=top_k, constraint=constraint)
 
         decode_output = self.decode(input_ids=token_ids,
                                     next_token_id=next_token_id,
                                     kv_cache=kv_cache,
                                     max_tokens=max_tokens,
                                     temperature=temperature,
-                                    top_k=top_k)
+                                    top_k=top_k,
+                                    constraint=constraint)
         print("*"*50)
         print(decode_output)
         # print(self.tokenizer.decode([decode_output]))
@@ -226,7 +350,7 @@ if __name__=="__main__":
     model_subdirectory = iLoad.model_subdirectory_path
 
     graphs = iLoad.graphs
-    model_sessions = {graph_name: iLoad.load_model(graph,htp_performance_mode="sustained_high_performance") for graph_name,graph in graphs.items() if str(graph).endswith(".onnx")}
+    model_sessions = iLoad.load_graphs(htp_performance_mode="sustained_high_performance")
     tokenizer = next((file for file in graphs.values() if file.endswith("tokenizer.json")), None)
     meta_data = graphs["META_DATA"]
     
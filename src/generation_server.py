@@ -0,0 +1,389 @@
+import numpy as np
+import logging
+import queue
+import threading
+
+from concurrent.futures import CancelledError, Future
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from deepseek_model_inference import DeepSeekModelInference, IOBindingManager
+from kv_cache import KV_PRECISIONS, KVCacheArena, dequantize_kv, quantize_kv, truncate_kv
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class GenerationRequest:
+    query: str
+    persona: Optional[str]=None
+    max_tokens: int=100
+    top_k: int=10
+    temperature: float=0.6
+    repetition_penalty: float=1.1
+    future: Future=field(default_factory=Future)
+    generated_ids: List[int]=field(default_factory=list)
+    position: int=0
+
+class ContinuousBatchingServer():
+    """
+    Serves many concurrent generation requests over one set of DeepSeek sessions.
+
+    Requests are queued by `submit` and handled by a scheduler thread. Every iteration the scheduler
+    admits queued requests into free slots of a shared KV arena (running their prefill through the
+    EMBEDDING, CONTEXT and HEAD sessions), runs one decode step for every active slot, and retires
+    sequences that reached `<｜end▁of▁sentence｜>` or their token budget so their slot can be reused
+    on the next iteration.
+
+    When the EMBEDDING, CONTEXT_ITER and HEAD graphs accept a dynamic batch dimension, all active
+    slots are decoded in a single batched CONTEXT_ITER run. Graphs compiled for batch size 1 are
+    stepped slot by slot, which still interleaves requests token by token instead of serializing
+    whole generations.
+
+    When stepping slot by slot with a `kv_precision` below the graph's KV type, each sequence's cache
+    is held at that precision and only the sequence being decoded is expanded into a single-slot arena
+    (skipped while the same sequence stays resident); each step quantizes just the new position. A
+    batched run reads every slot at once, so it always keeps the arena at the graph's KV type.
+
+    Args:
+        inference (DeepSeekModelInference): Initialized inference object providing sessions and tokenizer.
+        max_batch_size (int): Number of sequences decoded concurrently.
+        capacity (Optional[int]): KV positions per slot. Defaults to the model's context length.
+        kv_precision (Optional[str]): "fp32", "fp16" or "int8". Defaults to the inference object's.
+
+    Attributes:
+        kv_arena (KVCacheArena): Shared cache with one slot per concurrent sequence, or the single
+            working slot when sequences are stored compressed.
+        slot_caches (Optional[List[dict]]): Compressed cache of each slot, None if the arena holds them.
+        batched (bool): Whether decode steps run all slots in one session call.
+        slots (List[Optional[GenerationRequest]]): Request occupying each slot, or None if free.
+    """
+
+    def __init__(self, inference: DeepSeekModelInference,
+                 max_batch_size: int=4,
+                 capacity: Optional[int]=None,
+                 kv_precision: Optional[str]=None):
+        self.inference = inference
+        self.max_batch_size = max_batch_size
+        self.kv_precision = kv_precision or inference.kv_precision
+        if self.kv_precision not in KV_PRECISIONS:
+            raise ValueError(f"Unsupported KV precision: {self.kv_precision}. Select {' | '.join(KV_PRECISIONS)}")
+        params = inference.model_params
+        self.batched = self._supports_batching()
+
+        kv_dtype = inference.kv_dtype(graph_name="CONTEXT_ITER")
+        compressed = self.kv_precision == "int8" or (self.kv_precision == "fp16" and kv_dtype != np.float16)
+        if compressed and self.batched:
+            logger.warning(f"kv_precision {self.kv_precision} is ignored: batched decoding reads every slot at "
+                           f"the graph's KV type")
+            compressed = False
+        self.slot_caches: Optional[List[dict]] = [{} for _ in range(max_batch_size)] if compressed else None
+        self._resident_slot: Optional[int] = None
+
+        self.kv_arena = KVCacheArena(num_layers=params.num_layers,
+                                     batch_size=1 if compressed else max_batch_size,
+                                     num_key_value_heads=params.num_key_value_heads,
+                                     capacity=capacity or params.context_length,
+                                     head_size=params.attn_head_size,
+                                     dtype=kv_dtype)
+        self.slots: List[Optional[GenerationRequest]] = [None] * max_batch_size
+        self.pending = queue.Queue()
+
+        self.iBindingManager = IOBindingManager(inference_session=inference.session_mapper["CONTEXT_ITER"])
+        self.token_buffer = np.zeros((max_batch_size, 1), dtype=np.int64)
+        self.past_seq_len_buffer = np.zeros((max_batch_size, 1), dtype=np.int32)
+        self.total_seq_len_buffer = np.zeros((1,), dtype=np.int32)
+        self.output_hidden_states_buffer = None
+
+        self._running = threading.Event()
+        self._thread = None
+
+    def _supports_batching(self) -> bool:
+        """
+        Checks whether the decode graphs accept more than one sequence per run.
+
+        Returns:
+            bool: False if any of EMBEDDING, CONTEXT_ITER or HEAD declares a static batch size of 1.
+        """
+        if self.max_batch_size == 1:
+            return False
+        for graph_name in ("EMBEDDING", "CONTEXT_ITER", "HEAD"):
+            inputs = self.inference.session_mapper[graph_name].get_inputs()
+            batch_dimension = next(graph_input.shape[0] for graph_input in inputs
+                                   if graph_input.name in ("input_ids", "input_hidden_states", "output_hidden_states"))
+            if batch_dimension == 1:
+                return False
+        return True
+
+    def submit(self, query: str,
+               persona: Optional[str]=None,
+               max_tokens: int=100,
+               top_k: int=10,
+               temperature: float=0.6,
+               repetition_penalty: float=1.1) -> Future:
+        """
+        Queues a prompt for generation.
+
+        Args:
+            query (str): The user's input text or question.
+            persona (Optional[str]): Optional persona name to influence model behavior.
+            max_tokens (int): Maximum number of tokens to generate.
+            top_k (int): Limits token sampling to top-k most probable choices.
+            temperature (float): Sampling temperature.
+            repetition_penalty (float): Penalizes repetition of previously generated tokens.
+
+        Returns:
+            Future: Resolves to the generated text once the request is retired.
+        """
+        request = GenerationRequest(query=query,
+                                    persona=persona,
+                                    max_tokens=max_tokens,
+                                    top_k=top_k,
+                                    temperature=temperature,
+                                    repetition_penalty=repetition_penalty)
+        return self.enqueue(request)
+
+    def enqueue(self, request: GenerationRequest) -> Future:
+        """
+        Queues a request built by the caller, who can then read its `generated_ids` once it is retired.
+
+        Returns:
+            Future: The request's future.
+        """
+        self.pending.put(request)
+        return request.future
+
+    def start(self) -> "ContinuousBatchingServer":
+        """
+        Starts the scheduler thread.
+        """
+        if self._thread is None:
+            self._running.set()
+            self._thread = threading.Thread(target=self.serve_forever, name="generation-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the scheduler thread. Requests that have not been admitted are cancelled; requests being
+        decoded are released from their slots and their futures raise `CancelledError`.
+        """
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        for slot, request in enumerate(self.slots):
+            if request is not None:
+                self._retire(slot, error=CancelledError("Generation server stopped"))
+
+        while True:
+            try:
+                self.pending.get_nowait().future.cancel()
+            except queue.Empty:
+                break
+
+    def serve_forever(self) -> None:
+        """
+        Runs scheduler iterations until `stop` is called.
+        """
+        while self._running.is_set():
+            self.step(block=not any(self.slots))
+
+    def step(self, block: bool=False) -> None:
+        """
+        Runs one scheduler iteration: admit queued requests, decode one token per active slot, retire.
+
+        Args:
+            block (bool): Wait briefly for a request if the queue is empty (used when idle).
+        """
+        self._admit(block=block)
+        active = [slot for slot, request in enumerate(self.slots) if request is not None]
+        if not active:
+            return
+
+        try:
+            if self.batched:
+                logits = self._decode_batched()
+            else:
+                logits = np.concatenate([self._decode_slot(slot) for slot in active], axis=0)
+                active_rows = dict(zip(active, range(len(active))))
+        except Exception as e:
+            for slot in active:
+                self._retire(slot, error=e)
+            return
+
+        for slot in active:
+            request = self.slots[slot]
+            row = slot if self.batched else active_rows[slot]
+            try:
+                next_token_id = self.inference.next_token_prediction(logits=logits[row:row+1],
+                                                                     generated_ids=request.generated_ids,
+                                                                     temperature=request.temperature,
+                                                                     top_k=request.top_k,
+                                                                     repetition_penalty=request.repetition_penalty)
+            except Exception as e:
+                # Only this request fails; the other slots keep decoding
+                self._retire(slot, error=e)
+                continue
+            request.generated_ids.append(next_token_id)
+            request.position += 1
+            if self.slot_caches is None:
+                self.kv_arena.lengths[slot] = request.position
+
+            if self._finished(request):
+                self._retire(slot)
+
+    def _admit(self, block: bool=False) -> None:
+        for slot in range(self.max_batch_size):
+            if self.slots[slot] is not None:
+                continue
+            try:
+                request = self.pending.get(block=block, timeout=0.1 if block else None)
+            except queue.Empty:
+                return
+            block = False
+
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            self.slots[slot] = request
+            try:
+                self._prefill(request=request, slot=slot)
+            except Exception as e:
+                self._retire(slot, error=e)
+                continue
+
+            if self._finished(request):
+                self._retire(slot)
+
+    def _prefill(self, request: GenerationRequest, slot: int) -> None:
+        inference = self.inference
+        token_ids = inference.tokenize(inference.query(request.query, request.persona))
+        logits = inference.prefill(token_ids=token_ids)
+        prompt_length = token_ids.shape[-1]
+
+        if self.slot_caches is None:
+            self.kv_arena.reset(slot=slot)
+            self.kv_arena.write(kv_cache=inference.kv_cache, start=0, length=prompt_length, slot=slot)
+        else:
+            self.slot_caches[slot] = quantize_kv(truncate_kv(inference.kv_cache, prompt_length),
+                                                 self.kv_precision, per_position=True)
+            if self._resident_slot == slot:
+                self._resident_slot = None
+        request.position = prompt_length
+
+        if self.output_hidden_states_buffer is None:
+            self._io_binding_init(hidden_size=self.iBindingManager.outputs[0].shape[-1])
+
+        next_token_id = inference.next_token_prediction(logits=logits,
+                                                        generated_ids=[],
+                                                        temperature=request.temperature,
+                                                        top_k=request.top_k)
+        request.generated_ids = [next_token_id]
+
+    def _io_binding_init(self, hidden_size: int) -> None:
+        self.output_hidden_states_buffer = np.empty((self.max_batch_size, 1, hidden_size), dtype=np.float32)
+        self.iBindingManager.bind_input(name="total_seq_len", buffer=self.total_seq_len_buffer)
+
+        if self.batched:
+            self.iBindingManager.bind_kv_arena(kv_arena=self.kv_arena)
+            self.iBindingManager.bind_input(name="past_seq_len", buffer=self.past_seq_len_buffer)
+            self.iBindingManager.bind_output(name=self.iBindingManager.layer_names[0],
+                                             buffer=self.output_hidden_states_buffer)
+
+    def _decode_batched(self) -> np.array:
+        """
+        Decodes one token for every slot in a single batched pass. Free slots are fed a dummy
+        token at position 0; their outputs are ignored and the slot is overwritten on admission.
+        """
+        for slot, request in enumerate(self.slots):
+            self.token_buffer[slot, 0] = request.generated_ids[-1] if request else 0
+            self.past_seq_len_buffer[slot, 0] = request.position if request else 0
+        self.total_seq_len_buffer[...] = self.past_seq_len_buffer.max() + 1
+
+        embedding_output = self.inference.embedding_session(query=self.token_buffer)
+        self.iBindingManager.bind_input(name="input_hidden_states", buffer=embedding_output)
+        self.inference.session_mapper["CONTEXT_ITER"].run_with_iobinding(self.iBindingManager.io_binding)
+        return self.inference.head_session(ctx_hidden_states=self.output_hidden_states_buffer)
+
+    def _decode_slot(self, slot: int) -> np.array:
+        """
+        Decodes one token for a single slot by binding that slot's blocks of the shared arena.
+        """
+        request = self.slots[slot]
+        self.token_buffer[slot, 0] = request.generated_ids[-1]
+        self.past_seq_len_buffer[slot, 0] = request.position
+        self.total_seq_len_buffer[...] = request.position + 1
+
+        embedding_output = self.inference.embedding_session(query=self.token_buffer[slot:slot+1])
+        hidden_states = self.output_hidden_states_buffer[slot:slot+1]
+        arena_slot = slot if self.slot_caches is None else self._load_slot(slot)
+
+        self.iBindingManager.bind_kv_arena(kv_arena=self.kv_arena, slot=arena_slot)
+        self.iBindingManager.bind_input(name="past_seq_len", buffer=self.past_seq_len_buffer[slot:slot+1])
+        self.iBindingManager.bind_input(name="input_hidden_states", buffer=embedding_output)
+        self.iBindingManager.bind_output(name=self.iBindingManager.layer_names[0], buffer=hidden_states)
+        self.inference.session_mapper["CONTEXT_ITER"].run_with_iobinding(self.iBindingManager.io_binding)
+
+        if self.slot_caches is not None:
+            new_kv = self.kv_arena.read(length=request.position + 1, start=request.position)
+            self.slot_caches[slot] = {name: cache.append(new_kv[name], start=request.position)
+                                      for name, cache in self.slot_caches[slot].items()}
+        return self.inference.head_session(ctx_hidden_states=hidden_states)
+
+    def _load_slot(self, slot: int) -> int:
+        """
+        Expands a slot's compressed cache into the working arena unless it is already resident.
+
+        Returns:
+            int: The arena slot to bind (always 0).
+        """
+        if self._resident_slot != slot:
+            position = self.slots[slot].position
+            self.kv_arena.write(kv_cache=dequantize_kv(self.slot_caches[slot], length=position),
+                                start=0, length=position)
+            self._resident_slot = slot
+        return 0
+
+    def _finished(self, request: GenerationRequest) -> bool:
+        return (request.generated_ids[-1] == self.inference.eos_token_id
+                or len(request.generated_ids) > request.max_tokens
+                or request.position + 1 >= self.kv_arena.capacity)
+
+    def _retire(self, slot: int, error: Optional[Exception]=None) -> None:
+        request = self.slots[slot]
+        self.slots[slot] = None
+        if self.slot_caches is None:
+            self.kv_arena.reset(slot=slot)
+        else:
+            self.slot_caches[slot] = {}
+            if self._resident_slot == slot:
+                self._resident_slot = None
+
+        if error is not None:
+            if not isinstance(error, CancelledError):
+                logger.error(f".....Generation failed: {error}")
+            request.future.set_exception(error)
+        else:
+            response = self.inference.tokenizer.decode(request.generated_ids, skip_special_tokens=True)
+            request.future.set_result(response)
+
+
+if __name__=="__main__":
+    from model_loader import ModelLoader
+
+    iLoad = ModelLoader(model="deepseek_1.5b", processor="npu", model_type="default")
+    graphs = iLoad.graphs
+    model_sessions = iLoad.load_graphs(htp_performance_mode="sustained_high_performance")
+    iInfer = DeepSeekModelInference(model_sessions=model_sessions,
+                                    tokenizer=graphs["TOKENIZER"],
+                                    model_subdirectory=iLoad.model_subdirectory_path,
+                                    model_meta=graphs["META_DATA"])
+
+    server = ContinuousBatchingServer(inference=iInfer, max_batch_size=4).start()
+    queries = ["Give me a high protein breakfast idea.",
+               "How many calories are in an avocado?",
+               "What is a balanced lunch for a runner?"]
+    futures = [server.submit(query=query, max_tokens=100) for query in queries]
+    for query, future in zip(queries, futures):
+        print(f"\n{query}\n{future.result()}")
+    server.stop()
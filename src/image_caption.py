@@ -1,6 +1,9 @@
-import subprocess
 import os
 
+from contextlib import closing
+
+from llm_backend import LLMBackendError, default_backend
+
 def caption_image(image_path):
     while not os.path.exists(image_path):
         print(f"Error: The file {image_path} does not exist.")
@@ -14,26 +17,26 @@ def caption_image(image_path):
             For each ingredient, estimate the percentage by weight it contributes to the overall dish. \
             Also estimate the total weight of the dish in grams. \
             Present your answer as a list with approximate percentages summing to 100%. \
-            Here is also a description of the image: {user_description}. \
-            {image_path}"
+            Here is also a description of the image: {user_description}."
     
-    print("Generating caption with Ollama...")
+    print("Generating caption...")
     
-    # Call ollama command
     try:
-        result = subprocess.run(
-            ["ollama", "run", "gemma3:4b", prompt],
-            capture_output=True,
-            text=True,
-            encoding='utf-8'
-        )
-        
-        if result.returncode != 0:
-            print("Error running Ollama:", result.stderr)
-            return None
-        
-        return result.stdout.strip()
-    
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+
+        caption = ""
+        with closing(default_backend().stream(prompt, images=[image_bytes], timeout=300)) as chunks:
+            for text in chunks:
+                print(text, end="", flush=True)
+                caption += text
+        print()
+        return caption.strip()
+
+    except LLMBackendError as e:
+        print("Error running LLM:", e)
+        return None
+
     except Exception as e:
         print("Exception occurred:", e)
         return None
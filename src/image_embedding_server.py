@@ -0,0 +1,224 @@
+import numpy as np
+import logging
+import queue
+import threading
+import time
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from PIL import Image
+
+from clip_image_encoder import CLIPImageEncoder
+from clip_preprocessing import ImageInput, preprocess_batch
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class EmbeddingRequest:
+    pixels: np.ndarray
+    future: Future=field(default_factory=Future)
+
+class ImageEmbeddingServer():
+    """
+    Coalesces concurrent image embedding requests into batched encoder runs.
+
+    `submit` decodes, resizes and normalizes the images on a process pool, so the submitting thread
+    and the model are never blocked on PIL. Once its pixels are ready a request joins the queue of a
+    dispatcher thread, which waits up to `max_wait_ms` for other requests, concatenates their pixels
+    into one contiguous batch of at most `max_batch_size` images and runs the encoder once. A single
+    request larger than `max_batch_size` (e.g. a backfill) runs on its own.
+
+    Args:
+        encoder (CLIPImageEncoder): Loaded image encoder.
+        max_batch_size (int): Images per coalesced encoder run.
+        max_wait_ms (float): How long the first queued request waits for others to join its batch.
+        preprocess_workers (Optional[int]): Preprocessing processes; defaults to the CPU count, 0
+            preprocesses on the submitting thread.
+
+    Attributes:
+        batches (int): Encoder runs so far.
+        embedded (int): Images embedded so far.
+    """
+
+    def __init__(self, encoder: CLIPImageEncoder,
+                 max_batch_size: int=16,
+                 max_wait_ms: float=5.0,
+                 preprocess_workers: Optional[int]=None):
+        self.encoder = encoder
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = ProcessPoolExecutor(max_workers=preprocess_workers) if preprocess_workers != 0 else None
+        self.pending = queue.Queue()
+        self._carry: Optional[EmbeddingRequest] = None
+        self.batches = 0
+        self.embedded = 0
+
+        self._running = threading.Event()
+        self._thread = None
+        # Guards `pending` against requests arriving while or after `stop` drains it
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, images: Sequence[ImageInput]) -> Future:
+        """
+        Queues images for embedding.
+
+        Already decoded PIL images are preprocessed on the calling thread rather than copied to a
+        worker process; encoded bytes and paths are decoded on the pool.
+
+        Args:
+            images (Sequence[ImageInput]): Encoded bytes, file paths or decoded PIL images.
+
+        Returns:
+            Future: Resolves to float32 embeddings of shape (n_images, dimension).
+        """
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        result = Future()
+        if not images:
+            result.set_result(np.empty((0, self.encoder.dimension), dtype=np.float32))
+            return result
+
+        if self.executor is None or any(isinstance(image, Image.Image) for image in images):
+            try:
+                pixels = preprocess_batch(images, image_size=self.encoder.image_size)
+            except Exception as e:
+                result.set_exception(e)
+                return result
+            self._enqueue(result, pixels)
+            return result
+
+        # Preprocess the whole request in one worker task, so it never waits behind other requests' images
+        pixels = self.executor.submit(preprocess_batch, list(images), self.encoder.image_size)
+        pixels.add_done_callback(lambda pixels: self._preprocessed(result, pixels))
+        return result
+
+    def _preprocessed(self, result: Future, pixels: Future) -> None:
+        # The caller may cancel `result` at any time; cancelled requests are dropped by the dispatcher
+        if pixels.cancelled():
+            result.cancel()
+        elif pixels.exception() is not None:
+            # Claims the future first, so a concurrent cancel cannot make set_exception raise
+            if result.set_running_or_notify_cancel():
+                result.set_exception(pixels.exception())
+        else:
+            self._enqueue(result, pixels.result())
+
+    def _enqueue(self, result: Future, pixels: np.ndarray) -> None:
+        with self._lock:
+            if not self._closed:
+                self.pending.put(EmbeddingRequest(pixels=pixels, future=result))
+                return
+        # Nothing dispatches requests after `stop`
+        result.cancel()
+
+    def embed(self, images: Sequence[ImageInput], timeout: Optional[float]=None) -> np.ndarray:
+        """
+        Embeds images and waits for the result. Starts the dispatcher if needed.
+        """
+        self.start()
+        return self.submit(images).result(timeout=timeout)
+
+    def start(self) -> "ImageEmbeddingServer":
+        """
+        Starts the dispatcher thread.
+        """
+        if self._thread is None:
+            self._running.set()
+            self._thread = threading.Thread(target=self.serve_forever, name="image-embedding-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the dispatcher thread and the preprocessing pool, cancelling queued requests and
+        requests whose preprocessing finishes afterwards.
+        """
+        with self._lock:
+            self._closed = True
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+        if self._carry is not None:
+            self._carry.future.cancel()
+            self._carry = None
+        while True:
+            try:
+                self.pending.get_nowait().future.cancel()
+            except queue.Empty:
+                break
+
+    def close(self) -> None:
+        self.stop()
+
+    def serve_forever(self) -> None:
+        """
+        Runs dispatcher iterations until `stop` is called.
+        """
+        while self._running.is_set():
+            self.step(timeout=0.1)
+
+    def step(self, timeout: Optional[float]=None) -> int:
+        """
+        Collects one batch of queued requests and embeds it.
+
+        Args:
+            timeout (Optional[float]): Seconds to wait for a first request.
+
+        Returns:
+            int: Number of images embedded.
+        """
+        first, self._carry = self._carry, None
+        if first is None:
+            try:
+                first = self.pending.get(timeout=timeout)
+            except queue.Empty:
+                return 0
+
+        requests = [first]
+        count = len(first.pixels)
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while count < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if count + len(request.pixels) > self.max_batch_size:
+                # Keep batches bounded; the request leads the next batch
+                self._carry = request
+                break
+            requests.append(request)
+            count += len(request.pixels)
+
+        requests = [request for request in requests if request.future.set_running_or_notify_cancel()]
+        if not requests:
+            return 0
+        return self._run(requests)
+
+    def _run(self, requests: List[EmbeddingRequest]) -> int:
+        if len(requests) == 1:
+            pixels = requests[0].pixels
+        else:
+            pixels = np.concatenate([request.pixels for request in requests])
+        try:
+            embeddings = self.encoder.embed_pixels(pixels)
+        except Exception as e:
+            logger.error(f".....Image embedding failed: {e}")
+            for request in requests:
+                request.future.set_exception(e)
+            return 0
+
+        self.batches += 1
+        self.embedded += len(pixels)
+        start = 0
+        for request in requests:
+            request.future.set_result(embeddings[start:start + len(request.pixels)])
+            start += len(request.pixels)
+        return len(pixels)
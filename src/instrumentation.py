@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    start_ns: int
+    duration_ns: int
+    thread_id: int
+    depth: int
+    args: dict=field(default_factory=dict)
+    children_ns: int=0
+
+
+class Tracer():
+    """
+    Records timed spans for every stage of a generation.
+
+    The inference classes wrap each ONNX session run ("session" category), token sampling ("sampler"),
+    detokenization ("detokenize") and each prefill/decode step ("step") in a span. Spans nest per
+    thread; for every step span the time not covered by a nested span is attributed to Python overhead,
+    which separates time spent on the NPU from time spent in the glue code around it.
+
+    Recorded spans can be exported as a Chrome trace (chrome://tracing or ui.perfetto.dev) or aggregated
+    into per-stage latency histograms.
+
+    Attributes:
+        spans (List[Span]): Completed spans in completion order.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name: str, category: str="session", **args):
+        """
+        Times the enclosed block.
+
+        Args:
+            name (str): Span name, e.g. the graph name "CONTEXT_ITER".
+            category (str): One of "session", "sampler", "detokenize", "step".
+            **args: Extra values shown with the span in the trace viewer.
+        """
+        stack = self._local.__dict__.setdefault("stack", [])
+        span = Span(name=name, category=category, start_ns=0, duration_ns=0,
+                    thread_id=threading.get_ident(), depth=len(stack), args=args)
+        stack.append(span)
+        span.start_ns = time.perf_counter_ns()
+        try:
+            yield span
+        finally:
+            span.duration_ns = time.perf_counter_ns() - span.start_ns
+            stack.pop()
+            if stack:
+                stack[-1].children_ns += span.duration_ns
+            with self._lock:
+                self.spans.append(span)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans.clear()
+
+    def export_chrome_trace(self, path: Path) -> None:
+        """
+        Writes the spans as Chrome trace event JSON (complete "X" events, microsecond timestamps).
+        Python overhead of each step is added as an argument of the step's event.
+        """
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+
+        events = []
+        for span in spans:
+            args = dict(span.args)
+            if span.category == "step":
+                args["python_overhead_us"] = (span.duration_ns - span.children_ns) / 1000
+            events.append({"name": span.name,
+                           "cat": span.category,
+                           "ph": "X",
+                           "ts": span.start_ns / 1000,
+                           "dur": span.duration_ns / 1000,
+                           "pid": pid,
+                           "tid": span.thread_id,
+                           "args": args})
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def histograms(self, bins: int=20) -> Dict[str, dict]:
+        """
+        Aggregates span durations per name, plus a "python_overhead" entry derived from step spans.
+
+        Args:
+            bins (int): Number of histogram buckets per stage.
+
+        Returns:
+            Dict[str, dict]: For each stage: category, count, total/mean/p50/p90/p99/max in milliseconds,
+                and the histogram as bucket edges and counts.
+        """
+        with self._lock:
+            spans = list(self.spans)
+
+        durations: Dict[str, List[float]] = {}
+        categories: Dict[str, str] = {}
+        for span in spans:
+            durations.setdefault(span.name, []).append(span.duration_ns / 1e6)
+            categories[span.name] = span.category
+            if span.category == "step":
+                durations.setdefault("python_overhead", []).append((span.duration_ns - span.children_ns) / 1e6)
+                categories["python_overhead"] = "overhead"
+
+        report = {}
+        for name, values in durations.items():
+            values = np.array(values)
+            counts, edges = np.histogram(values, bins=bins)
+            report[name] = {"category": categories[name],
+                            "count": int(values.size),
+                            "total_ms": float(values.sum()),
+                            "mean_ms": float(values.mean()),
+                            "p50_ms": float(np.percentile(values, 50)),
+                            "p90_ms": float(np.percentile(values, 90)),
+                            "p99_ms": float(np.percentile(values, 99)),
+                            "max_ms": float(values.max()),
+                            "histogram": {"edges_ms": edges.tolist(), "counts": counts.tolist()}}
+        return report
+
+    def summary(self) -> str:
+        """
+        Formats the histogram statistics as a table, slowest total first.
+        """
+        lines = [f"{'stage':<20}{'count':>8}{'total ms':>12}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}"]
+        for name, stats in sorted(self.histograms().items(), key=lambda item: -item[1]["total_ms"]):
+            lines.append(f"{name:<20}{stats['count']:>8}{stats['total_ms']:>12.2f}{stats['mean_ms']:>10.3f}"
+                         f"{stats['p50_ms']:>10.3f}{stats['p99_ms']:>10.3f}")
+        return "\n".join(lines)
+
+
+class NullTracer():
+    """
+    Tracer that records nothing; the default, so instrumentation costs nothing when not requested.
+    """
+
+    enabled = False
+    _null_span = nullcontext()
+
+    def span(self, name: str, category: str="session", **args):
+        return self._null_span
+
+
+NULL_TRACER = NullTracer()
@@ -0,0 +1,380 @@
+import numpy as np
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+KV_PRECISIONS = ("fp32", "fp16", "int8")
+
+# ONNX tensor element types of KV inputs and the numpy storage type they map to
+ONNX_KV_DTYPES = {"tensor(float)": np.float32, "tensor(float16)": np.float16}
+
+
+class KVCacheArena():
+    """
+    A single preallocated key/value cache spanning every transformer layer.
+
+    Keys and values each live in one contiguous array of shape
+    (num_layers, batch_size, num_key_value_heads, capacity, head_size). Every layer's
+    slice is itself contiguous, so it can be handed to ONNX Runtime by pointer offset
+    and used as both the `past_*` input and the `present_*` output of a graph that
+    shares its past/present buffers (`past_present_share_buffer` in genai_config.json).
+    The decode loop therefore writes new positions in place and never allocates.
+
+    Each batch index is a slot holding an independent sequence; a single slot's block
+    within a layer is contiguous as well, so slots can be bound one at a time.
+
+    Args:
+        num_layers (int): Number of transformer layers.
+        batch_size (int): Number of sequences held by the arena.
+        num_key_value_heads (int): Number of key/value attention heads.
+        capacity (int): Maximum number of positions, typically genai_config's `context_length`.
+        head_size (int): Dimension of each attention head.
+        dtype (np.dtype, optional): Storage type of the cache. Defaults to np.float32.
+
+    Attributes:
+        keys (np.ndarray): Key storage for all layers.
+        values (np.ndarray): Value storage for all layers.
+        lengths (np.ndarray): Number of valid positions held by each slot.
+        length (int): Number of valid positions held by slot 0.
+        layer_shape (Tuple[int, ...]): Shape of a single layer's key (or value) block.
+        slot_shape (Tuple[int, ...]): Shape of a single slot's block within a layer.
+        layer_stride (int): Byte distance between two consecutive layers' blocks.
+        slot_stride (int): Byte distance between two consecutive slots within a layer.
+    """
+
+    def __init__(self, num_layers: int,
+                 batch_size: int,
+                 num_key_value_heads: int,
+                 capacity: int,
+                 head_size: int,
+                 dtype: np.dtype=np.float32):
+        self.num_layers = num_layers
+        self.batch_size = batch_size
+        self.capacity = capacity
+        self.lengths = np.zeros(batch_size, dtype=np.int64)
+
+        arena_shape = (num_layers, batch_size, num_key_value_heads, capacity, head_size)
+        self.keys = np.zeros(arena_shape, dtype=dtype)
+        self.values = np.zeros(arena_shape, dtype=dtype)
+
+        self.layer_shape = arena_shape[1:]
+        self.slot_shape = (1,) + arena_shape[2:]
+        self.layer_stride = self.keys.strides[0]
+        self.slot_stride = self.keys.strides[1]
+
+        # Views are created once; they alias the arena and never move
+        self._views = {}
+        for layer in range(num_layers):
+            self._views[f"past_keys_{layer}"] = self.keys[layer]
+            self._views[f"past_values_{layer}"] = self.values[layer]
+
+    @property
+    def length(self) -> int:
+        return int(self.lengths[0])
+
+    @length.setter
+    def length(self, value: int) -> None:
+        self.lengths[0] = value
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Total number of bytes held by the key and value storage.
+        """
+        return self.keys.nbytes + self.values.nbytes
+
+    def views(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the per-layer views of the arena keyed by graph input name.
+
+        Returns:
+            Dict[str, np.ndarray]: Mapping of "past_keys_X"/"past_values_X" to full-capacity layer views.
+        """
+        return self._views
+
+    def layer_pointers(self, layer: int, slot: Optional[int]=None) -> Tuple[int, int]:
+        """
+        Computes the memory addresses of a layer's key and value blocks.
+
+        Args:
+            layer (int): Transformer layer index.
+            slot (Optional[int]): If provided, address the block of this slot only.
+
+        Returns:
+            Tuple[int, int]: Key and value block addresses (base pointer plus layer and slot offset).
+        """
+        offset = layer * self.layer_stride
+        if slot is not None:
+            offset += slot * self.slot_stride
+        return self.keys.ctypes.data + offset, self.values.ctypes.data + offset
+
+    def write(self, kv_cache: Dict[str, np.ndarray], start: int, length: int, slot: int=0) -> None:
+        """
+        Copies the present keys/values of a context pass into the arena.
+
+        Args:
+            kv_cache (Dict[str, np.ndarray]): Per-layer keys/values as produced by `kv_cache_update`,
+                e.g. {"past_keys_0": ..., "past_values_0": ..., ...}.
+            start (int): First arena position to write.
+            length (int): Number of positions to copy from each tensor.
+            slot (int): Arena slot receiving the (batch size 1) tensors.
+
+        Raises:
+            ValueError: If the write would run past the arena capacity.
+        """
+        end = start + length
+        if end > self.capacity:
+            raise ValueError(f"KV cache capacity exceeded: {end} > {self.capacity}")
+
+        for layer in range(self.num_layers):
+            self.keys[layer, slot, :, start:end] = kv_cache[f"past_keys_{layer}"][0, :, :length]
+            self.values[layer, slot, :, start:end] = kv_cache[f"past_values_{layer}"][0, :, :length]
+
+        self.lengths[slot] = max(self.lengths[slot], end)
+
+    def read(self, length: int, slot: int=0, start: int=0) -> Dict[str, np.ndarray]:
+        """
+        Copies positions `start:length` of a slot out of the arena (the inverse of `write`).
+
+        Args:
+            length (int): End of the copied positions.
+            slot (int): Arena slot to read.
+            start (int): First position to copy.
+
+        Returns:
+            Dict[str, np.ndarray]: Per-layer keys/values of shape (1, num_key_value_heads, length - start, head_size),
+                keyed like `kv_cache_update` output.
+        """
+        kv_cache = {}
+        for layer in range(self.num_layers):
+            kv_cache[f"past_keys_{layer}"] = self.keys[layer, slot:slot+1, :, start:length].copy()
+            kv_cache[f"past_values_{layer}"] = self.values[layer, slot:slot+1, :, start:length].copy()
+        return kv_cache
+
+    def evict(self, start: int, count: int, slot: int=0, rope_theta: Optional[float]=None) -> int:
+        """
+        Removes `count` positions starting at `start` from a slot and shifts later positions left.
+
+        Positions before `start` (the attention sinks) stay where they are. When `rope_theta` is
+        given, the shifted keys are re-rotated to their new positions so relative distances seen by
+        later queries stay consistent.
+
+        Args:
+            start (int): First position to remove.
+            count (int): Number of positions to remove.
+            slot (int): Slot to compact.
+            rope_theta (Optional[float]): Rotary embedding base of the model; None leaves keys unrotated.
+
+        Returns:
+            int: The slot's new length.
+        """
+        length = int(self.lengths[slot])
+        kept = length - start - count
+        # Overlapping slices: numpy buffers the source before writing
+        self.keys[:, slot, :, start:start+kept] = self.keys[:, slot, :, start+count:length]
+        self.values[:, slot, :, start:start+kept] = self.values[:, slot, :, start+count:length]
+        if rope_theta is not None:
+            shifted = self.keys[:, slot, :, start:start+kept]
+            shifted[...] = rotate_keys(shifted, shift=-count, rope_theta=rope_theta)
+
+        self.lengths[slot] = length - count
+        return length - count
+
+    def reset(self, slot: Optional[int]=None) -> None:
+        """
+        Marks the arena (or a single slot) as empty without releasing or clearing its memory.
+
+        Args:
+            slot (Optional[int]): Slot to reset. Resets every slot if omitted.
+        """
+        if slot is None:
+            self.lengths[:] = 0
+        else:
+            self.lengths[slot] = 0
+
+
+def rotate_keys(keys: np.ndarray, shift: int, rope_theta: float) -> np.ndarray:
+    """
+    Moves rotary-embedded keys by `shift` positions (rotate-half layout, as used by Qwen and ORT GQA).
+
+    Rotary embeddings rotate each (x_i, x_{i + head_size/2}) pair by position * theta^(-2i/head_size),
+    so an extra rotation by `shift` times the same frequencies re-encodes a key at a new position.
+
+    Args:
+        keys (np.ndarray): Keys with head_size as the last dimension.
+        shift (int): Position delta (negative moves keys to earlier positions).
+        rope_theta (float): Rotary embedding base.
+
+    Returns:
+        np.ndarray: The re-rotated keys.
+    """
+    half = keys.shape[-1] // 2
+    angles = shift * rope_theta ** (-np.arange(half, dtype=np.float64) * 2 / keys.shape[-1])
+    cos, sin = np.cos(angles).astype(keys.dtype), np.sin(angles).astype(keys.dtype)
+    x1, x2 = keys[..., :half], keys[..., half:]
+    return np.concatenate([x1 * cos - x2 * sin, x2 * cos + x1 * sin], axis=-1)
+
+def evict_positions(kv_cache: Dict[str, np.ndarray], start: int, count: int,
+                    rope_theta: Optional[float]=None) -> Dict[str, np.ndarray]:
+    """
+    Dictionary counterpart of `KVCacheArena.evict` for per-layer (1, heads, length, head_size) tensors.
+
+    Args:
+        kv_cache (Dict[str, np.ndarray]): Per-layer keys/values keyed by "past_keys_X"/"past_values_X".
+        start (int): First position to remove.
+        count (int): Number of positions to remove.
+        rope_theta (Optional[float]): Rotary embedding base; None leaves keys unrotated.
+
+    Returns:
+        Dict[str, np.ndarray]: New tensors without the evicted positions.
+    """
+    compacted = {}
+    for name, cache in kv_cache.items():
+        tail = cache[:, :, start+count:]
+        if rope_theta is not None and name.startswith("past_keys"):
+            tail = rotate_keys(tail, shift=-count, rope_theta=rope_theta)
+        compacted[name] = np.concatenate([cache[:, :, :start], tail], axis=2)
+    return compacted
+
+
+@dataclass
+class QuantizedTensor:
+    """
+    A KV tensor stored at reduced precision.
+
+    int8 tensors use symmetric per-head scales: for a (batch, heads, positions, head_size) tensor, every
+    head gets one scale, max(|x|) / 127, over its positions and channels. Tensors quantized per position
+    (the live cache of a running sequence) get one scale per head and position instead, so positions can
+    be appended or dropped without requantizing the others. fp16 tensors are a plain cast and carry no
+    scale.
+
+    Attributes:
+        data (np.ndarray): Stored values (int8 or float16).
+        scale (Optional[np.ndarray]): Scales of shape (batch, heads, 1, 1), or (batch, heads, positions, 1)
+            per position, int8 only.
+        dtype (np.dtype): Type restored by `dequantize`.
+    """
+    data: np.ndarray
+    scale: Optional[np.ndarray]=None
+    dtype: np.dtype=np.float32
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.data.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    @property
+    def length(self) -> int:
+        return self.data.shape[2]
+
+    @property
+    def precision(self) -> str:
+        return "int8" if self.data.dtype == np.int8 else "fp16"
+
+    @classmethod
+    def quantize(cls, tensor: np.ndarray, precision: str, per_position: bool=False) -> "QuantizedTensor":
+        """
+        Compresses a (batch, heads, positions, head_size) tensor.
+
+        Args:
+            tensor (np.ndarray): Keys or values.
+            precision (str): "fp16" or "int8".
+            per_position (bool): Scale every position separately (int8 only).
+
+        Returns:
+            QuantizedTensor: The compressed tensor.
+        """
+        if precision == "fp16":
+            return cls(data=tensor.astype(np.float16), dtype=tensor.dtype)
+        if precision == "int8":
+            scale = np.abs(tensor).max(axis=3 if per_position else (2, 3), keepdims=True).astype(np.float32) / 127
+            scale[scale == 0] = 1.0
+            data = np.clip(np.rint(tensor / scale), -127, 127).astype(np.int8)
+            return cls(data=data, scale=scale, dtype=tensor.dtype)
+        raise ValueError(f"Unsupported KV precision: {precision}. Select {' | '.join(KV_PRECISIONS)}")
+
+    def dequantize(self, length: Optional[int]=None) -> np.ndarray:
+        """
+        Restores the tensor (or its first `length` positions) at full precision.
+        """
+        if length is not None:
+            return self.truncate(length).dequantize()
+        if self.scale is None:
+            return self.data.astype(self.dtype)
+        return (self.data * self.scale).astype(self.dtype)
+
+    def truncate(self, length: int) -> "QuantizedTensor":
+        """
+        Keeps the first `length` positions.
+        """
+        scale = self.scale
+        if scale is not None and scale.shape[2] > 1:
+            scale = scale[:, :, :length]
+        return QuantizedTensor(data=self.data[:, :, :length], scale=scale, dtype=self.dtype)
+
+    def append(self, tensor: np.ndarray, start: int) -> "QuantizedTensor":
+        """
+        Keeps the first `start` positions and appends `tensor`, quantized per position, after them.
+
+        Only the new positions are quantized, so a decode step costs one position rather than a
+        requantization of the whole cache.
+
+        Args:
+            tensor (np.ndarray): New keys or values of shape (batch, heads, new_positions, head_size).
+            start (int): Number of stored positions to keep.
+
+        Returns:
+            QuantizedTensor: The extended tensor.
+        """
+        appended = QuantizedTensor.quantize(tensor, self.precision, per_position=True)
+        data = np.concatenate([self.data[:, :, :start], appended.data], axis=2)
+        if self.scale is None:
+            return QuantizedTensor(data=data, dtype=self.dtype)
+        scale = np.broadcast_to(self.scale, self.data.shape[:3] + (1,))[:, :, :start]
+        return QuantizedTensor(data=data, scale=np.concatenate([scale, appended.scale], axis=2), dtype=self.dtype)
+
+
+def quantize_kv(kv_cache: Dict[str, np.ndarray], precision: str, per_position: bool=False) -> Dict[str, object]:
+    """
+    Compresses every tensor of a per-layer KV dictionary; "fp32" returns contiguous copies unchanged.
+
+    Args:
+        kv_cache (Dict[str, np.ndarray]): Per-layer keys/values.
+        precision (str): One of "fp32", "fp16", "int8".
+        per_position (bool): Scale every position separately, see `QuantizedTensor`.
+
+    Returns:
+        Dict[str, object]: np.ndarray (fp32) or QuantizedTensor values under the same names.
+    """
+    if precision == "fp32":
+        return {name: np.ascontiguousarray(cache) for name, cache in kv_cache.items()}
+    return {name: QuantizedTensor.quantize(cache, precision, per_position=per_position)
+            for name, cache in kv_cache.items()}
+
+def dequantize_kv(kv_cache: Dict[str, object], length: Optional[int]=None) -> Dict[str, np.ndarray]:
+    """
+    Inverse of `quantize_kv`, optionally restoring only the first `length` positions.
+    """
+    restored = {}
+    for name, cache in kv_cache.items():
+        if isinstance(cache, QuantizedTensor):
+            restored[name] = cache.dequantize(length)
+        else:
+            restored[name] = cache if length is None else cache[:, :, :length]
+    return restored
+
+def is_quantized(kv_cache: Dict[str, object]) -> bool:
+    """
+    Whether a per-layer KV dictionary holds `QuantizedTensor` values.
+    """
+    return any(isinstance(cache, QuantizedTensor) for cache in kv_cache.values())
+
+def truncate_kv(kv_cache: Dict[str, object], length: int) -> Dict[str, object]:
+    """
+    Keeps the first `length` positions of every tensor, quantized or not.
+    """
+    return {name: cache.truncate(length) if isinstance(cache, QuantizedTensor) else cache[:, :, :length]
+            for name, cache in kv_cache.items()}
@@ -3,6 +3,7 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import argparse
+import json
 import logging
 import time
 import numpy as np
@@ -10,6 +11,9 @@ import numpy as np
 from model_loader import ModelLoader
 from deepseek_model_inference import DeepSeekModelInference
 from gemma_model_inference import GemmaModelInference
+from speculative_decoding import SpeculativeDecoder
+from benchmark import summarize_generation
+from constrained_decoding import NUTRITION_SCHEMA, JSONConstraint
 
 # from deepseek_model_inference import ModelInference
 
@@ -72,6 +76,26 @@ def llm():
                         type=bool,
                         default=True,
                         help="Implementing IO Binding")
+    parser.add_argument("--kv_window",
+                        type=int,
+                        default=0,
+                        help="Bounded-memory decoding: max KV positions kept (0 keeps the whole context)")
+    parser.add_argument("--kv_precision",
+                        type=str,
+                        default="fp32",
+                        help="KV cache precision between decode steps without IO binding: fp32, fp16, int8")
+    parser.add_argument("--draft_model",
+                        type=str,
+                        default="",
+                        help="Smaller DeepSeek model drafting tokens for speculative decoding, e.g. deepseek_1.5b")
+    parser.add_argument("--num_speculative_tokens",
+                        type=int,
+                        default=4,
+                        help="Tokens drafted per speculative decoding round")
+    parser.add_argument("--json_schema",
+                        type=str,
+                        default="",
+                        help="Constrain the response to JSON: 'nutrition' or a JSON schema file")
 
     args = parser.parse_args()
 
@@ -82,7 +106,7 @@ def llm():
     model_subdirectory = iLoad.model_subdirectory_path
 
     graphs = iLoad.graphs
-    model_sessions = {graph_name: iLoad.load_model(graph,htp_performance_mode="sustained_high_performance") for graph_name,graph in graphs.items() if str(graph).endswith(".onnx")}
+    model_sessions = iLoad.load_graphs(htp_performance_mode="sustained_high_performance")
     tokenizer = next((file for file in graphs.values() if file.endswith("tokenizer.json")), None)
     meta_data = graphs["META_DATA"]
 
@@ -92,7 +116,9 @@ def llm():
                                         tokenizer= tokenizer,
                                         model_subdirectory=model_subdirectory,
                                         model_meta=meta_data,
-                                        verbose=args.verbose
+                                        verbose=args.verbose,
+                                        kv_window=args.kv_window or None,
+                                        kv_precision=args.kv_precision
                                         )
     elif "gemma" in args.model.lower():
         iInfer = GemmaModelInference(
@@ -103,18 +129,79 @@ def llm():
                                     )
     else:
         raise ValueError(f"Unsupported model type: {args.model}")
-    start = time.time()
-    iInfer.run_inference(query=args.query,
-                         top_k=args.top_k,
-                         temperature=args.temperature,
-                         persona=args.persona,
-                         max_tokens=args.max_tokens,
-                         repetition_penalty=args.repetition_penalty,
-                         io_binding=args.io_binding)
-    end = time.time()
-    elapsed = end - start
-    tps = np.round((args.max_tokens / elapsed),2)
-    print(f"\nTokens Per Second: {tps}")
+
+    if args.draft_model:
+        if not isinstance(iInfer, DeepSeekModelInference):
+            raise ValueError("Speculative decoding requires a DeepSeek target model")
+        iDraftLoad = ModelLoader(model=args.draft_model, processor=args.processor, model_type=args.model_type)
+        draft_graphs = iDraftLoad.graphs
+        draft_sessions = iDraftLoad.load_graphs(htp_performance_mode="sustained_high_performance")
+        iDraft = DeepSeekModelInference(
+                                        model_sessions=draft_sessions,
+                                        tokenizer=next((file for file in draft_graphs.values() if file.endswith("tokenizer.json")), None),
+                                        model_subdirectory=iDraftLoad.model_subdirectory_path,
+                                        model_meta=draft_graphs["META_DATA"],
+                                        verbose=args.verbose
+                                        )
+        iSpeculative = SpeculativeDecoder(draft=iDraft, target=iInfer,
+                                          num_speculative_tokens=args.num_speculative_tokens)
+
+    constraint = None
+    if args.json_schema:
+        if args.draft_model:
+            raise ValueError("Constrained decoding is not supported with speculative decoding")
+        if args.json_schema.lower() == "nutrition":
+            schema = NUTRITION_SCHEMA
+        else:
+            with open(args.json_schema, "r") as f:
+                schema = json.load(f)
+        # Gemma ends its turn with <end_of_turn> rather than <eos>
+        eos_token_id = (iInfer.eos_token_id if isinstance(iInfer, DeepSeekModelInference)
+                        else iInfer.tokenizer.token_to_id("<end_of_turn>"))
+        constraint = JSONConstraint(schema=schema, tokenizer=iInfer.tokenizer, eos_token_id=eos_token_id)
+
+    if args.draft_model:
+        response = iSpeculative.run_inference(query=args.query,
+                                              top_k=args.top_k,
+                                              temperature=args.temperature,
+                                              persona=args.persona,
+                                              max_tokens=args.max_tokens)
+        print(response)
+        stats = iSpeculative.stats
+        print(f"\n\nGenerated Tokens: {stats['generated_tokens']}")
+        print(f"Time To First Token: {np.round(stats['ttft_s'], 3)} s ({np.round(stats['prefill_tokens_per_s'], 2)} prompt tokens/s)")
+        print(f"Tokens Per Second: {np.round(stats['decode_tokens_per_s'], 2)}")
+        print(f"Acceptance Rate: {np.round(iSpeculative.acceptance_rate, 2)}")
+        return
+
+    if isinstance(iInfer, DeepSeekModelInference):
+        prompt_length = iInfer.tokenize(iInfer.query(args.query, args.persona)).shape[-1]
+        stream = iInfer.generate(query=args.query,
+                                 top_k=args.top_k,
+                                 temperature=args.temperature,
+                                 persona=args.persona,
+                                 max_tokens=args.max_tokens,
+                                 repetition_penalty=args.repetition_penalty,
+                                 io_binding=args.io_binding,
+                                 constraint=constraint)
+    else:
+        prompt_length = iInfer.query(query=args.query).shape[-1]
+        stream = iInfer.generate(query=args.query,
+                                 top_k=args.top_k,
+                                 temperature=args.temperature,
+                                 max_tokens=args.max_tokens,
+                                 constraint=constraint)
+
+    events = []
+    for event in stream:
+        print(event.text, end="", flush=True)
+        events.append(event)
+
+    # Prefill produces the first token; throughput counts only the decode steps that actually ran
+    stats = summarize_generation(events, prompt_length=prompt_length)
+    print(f"\n\nGenerated Tokens: {stats['generated_tokens']}")
+    print(f"Time To First Token: {np.round(stats['ttft_s'], 3)} s ({np.round(stats['prefill_tokens_per_s'], 2)} prompt tokens/s)")
+    print(f"Tokens Per Second: {np.round(stats['decode_tokens_per_s'], 2)}")
 
 if __name__=="__main__":
     llm()
\ No newline at end of file
@@ -0,0 +1,402 @@
+import base64
+import http.client
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+from contextlib import closing
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_HOST = "http://localhost:11434"
+DEFAULT_OLLAMA_MODEL = "gemma3:4b"
+
+# Sampling settings of the in-process engine when a request leaves them unset
+LOCAL_MAX_TOKENS = 512
+LOCAL_TEMPERATURE = 0.6
+LOCAL_TOP_K = 40
+
+class LLMBackendError(RuntimeError):
+    """
+    Raised when a backend fails to produce a response.
+    """
+
+
+class LLMTimeoutError(LLMBackendError, TimeoutError):
+    """
+    Raised when a response is not complete within its timeout.
+    """
+
+
+class LLMBackend():
+    """
+    Common interface of the text generation backends.
+
+    `stream` yields the response as text deltas while it is generated; `generate` returns the whole
+    response. Both accept a `timeout` in seconds covering the complete response. A caller that stops
+    iterating a stream early must `close()` it (e.g. with `contextlib.closing`), so the request is
+    cancelled and its resources are released without waiting for garbage collection.
+    """
+
+    def stream(self, prompt: str,
+               max_tokens: Optional[int]=None,
+               temperature: Optional[float]=None,
+               top_k: Optional[int]=None,
+               system_prompt: Optional[str]=None,
+               images: Optional[List[bytes]]=None,
+               json_schema: Optional[dict]=None,
+               timeout: Optional[float]=None) -> Iterator[str]:
+        """
+        Streams the response to `prompt`.
+
+        Args:
+            prompt (str): User prompt.
+            max_tokens (Optional[int]): Maximum number of generated tokens. None leaves it to the backend
+                (no cap for Ollama).
+            temperature (Optional[float]): Sampling temperature. None uses the model's default.
+            top_k (Optional[int]): Limits sampling to the top-k most probable tokens. None uses the
+                model's default.
+            system_prompt (Optional[str]): Optional system instruction.
+            images (Optional[List[bytes]]): Encoded images (JPEG/PNG) for multimodal models.
+            json_schema (Optional[dict]): Restrict the response to JSON matching this schema.
+            timeout (Optional[float]): Seconds allowed for the whole response.
+
+        Yields:
+            str: Text deltas.
+
+        Raises:
+            LLMTimeoutError: If the response is not complete within `timeout`.
+            LLMBackendError: If the backend fails.
+        """
+        raise NotImplementedError
+
+    def generate(self, prompt: str, **kwargs) -> str:
+        """
+        Returns the whole response to `prompt`. Accepts the keyword arguments of `stream`.
+        """
+        with closing(self.stream(prompt, **kwargs)) as chunks:
+            return "".join(chunks).strip()
+
+    def close(self) -> None:
+        pass
+
+
+class InProcessBackend(LLMBackend):
+    """
+    Runs generation in this process with an already loaded inference object (`GemmaModelInference`
+    or `DeepSeekModelInference`), so sessions stay attached between requests.
+
+    The inference objects are not thread-safe, so requests are serialized: a stream holds the model
+    until it is exhausted or closed, and a waiting request gives up with `LLMTimeoutError` once its
+    timeout expires. The ONNX graphs are text-only: images are ignored with a warning.
+
+    The timeout is checked when a token arrives, which cancels generation before the next decode step.
+    A running session call is not interrupted, so a prefill or decode step that stalls can overrun
+    the timeout until it returns.
+
+    One `JSONConstraint` is kept per schema and all of them share one `TokenTrie`, so the vocabulary is
+    indexed once and the per-state mask caches stay warm across requests.
+
+    Args:
+        inference: Loaded inference object.
+    """
+
+    def __init__(self, inference):
+        self.inference = inference
+        self._lock = threading.Lock()
+        self._constraints: Dict[str, "JSONConstraint"] = {}
+        self._trie: Optional["TokenTrie"] = None
+
+    @classmethod
+    def from_model(cls, model: str="gemma-3_1b", processor: str="npu") -> "InProcessBackend":
+        """
+        Loads `model` with `ModelLoader` and wraps it.
+        """
+        from benchmark import load_inference
+        inference, load_time = load_inference(model=model, processor=processor, seed=None)
+        logger.info(f"Loaded {model} in {load_time:.1f} s")
+        return cls(inference)
+
+    def stream(self, prompt: str,
+               max_tokens: Optional[int]=None,
+               temperature: Optional[float]=None,
+               top_k: Optional[int]=None,
+               system_prompt: Optional[str]=None,
+               images: Optional[List[bytes]]=None,
+               json_schema: Optional[dict]=None,
+               timeout: Optional[float]=None) -> Iterator[str]:
+        from deepseek_model_inference import DeepSeekModelInference
+
+        if images:
+            logger.warning("The in-process model is text-only; ignoring attached images")
+        max_tokens = LOCAL_MAX_TOKENS if max_tokens is None else max_tokens
+        temperature = LOCAL_TEMPERATURE if temperature is None else temperature
+        top_k = LOCAL_TOP_K if top_k is None else top_k
+        deadline = None if timeout is None else time.monotonic() + timeout
+        cancel = threading.Event()
+        inference = self.inference
+        is_deepseek = isinstance(inference, DeepSeekModelInference)
+
+        if not self._lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise LLMTimeoutError(f"The model stayed busy for {timeout} s")
+        try:
+            constraint = None
+            if json_schema is not None:
+                constraint = self._constraint(json_schema, is_deepseek)
+            if is_deepseek:
+                query = f"{system_prompt}\n{prompt}" if system_prompt else prompt
+                events = inference.generate(query=query, top_k=top_k, temperature=temperature,
+                                            max_tokens=max_tokens, cancel=cancel, constraint=constraint)
+            else:
+                events = inference.generate(query=prompt, top_k=top_k, temperature=temperature,
+                                            max_tokens=max_tokens, system_prompt=system_prompt,
+                                            cancel=cancel, constraint=constraint)
+            try:
+                for event in events:
+                    if deadline is not None and time.monotonic() > deadline:
+                        cancel.set()
+                        raise LLMTimeoutError(f"No complete response within {timeout} s")
+                    yield event.text
+            finally:
+                events.close()
+        finally:
+            # Runs when the stream is exhausted, fails or is closed by the caller
+            self._lock.release()
+
+    def _constraint(self, json_schema: dict, is_deepseek: bool) -> "JSONConstraint":
+        """
+        Returns the cached constraint for `json_schema`, creating it on first use. Called under the lock.
+        """
+        from constrained_decoding import JSONConstraint, TokenTrie
+
+        key = json.dumps(json_schema, sort_keys=True)
+        constraint = self._constraints.get(key)
+        if constraint is None:
+            inference = self.inference
+            if self._trie is None:
+                self._trie = TokenTrie(inference.tokenizer)
+            eos_token_id = inference.eos_token_id if is_deepseek else inference.tokenizer.token_to_id("<end_of_turn>")
+            constraint = JSONConstraint(schema=json_schema, tokenizer=inference.tokenizer,
+                                        eos_token_id=eos_token_id, trie=self._trie)
+            self._constraints[key] = constraint
+        return constraint
+
+
+class _ConnectionPool():
+    """
+    Keeps idle keep-alive HTTP connections to one server for reuse.
+    """
+
+    def __init__(self, url: str, size: int, timeout: float):
+        parsed = urlparse(url)
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self) -> http.client.HTTPConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def release(self, connection: http.client.HTTPConnection, reusable: bool) -> None:
+        if reusable:
+            try:
+                self._idle.put_nowait(connection)
+                return
+            except queue.Full:
+                pass
+        connection.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class OllamaBackend(LLMBackend):
+    """
+    Client for a local Ollama-compatible server (`/api/generate`), replacing one `ollama run`
+    process per request.
+
+    Connections are kept alive in a small pool, so a request costs one HTTP round trip on an open
+    socket, and the server is asked to keep the model loaded between requests (`keep_alive`).
+    Responses are streamed as newline-delimited JSON and yielded as they arrive.
+
+    Args:
+        host (str): Server URL, e.g. "http://localhost:11434".
+        model (str): Model name, e.g. "gemma3:4b".
+        pool_size (int): Idle connections kept open.
+        connect_timeout (float): Socket timeout for opening a connection. Waiting for the response
+            (model load, prompt processing, every token) is bounded by the request's `timeout` instead.
+        timeout (Optional[float]): Default limit in seconds for a whole response.
+        keep_alive (str): How long the server keeps the model loaded after a request.
+    """
+
+    def __init__(self, host: str=DEFAULT_OLLAMA_HOST,
+                 model: str=DEFAULT_OLLAMA_MODEL,
+                 pool_size: int=4,
+                 connect_timeout: float=10.0,
+                 timeout: Optional[float]=300.0,
+                 keep_alive: str="30m"):
+        # OLLAMA_HOST is commonly given without a scheme, e.g. "127.0.0.1:11434"
+        self.host = host if "://" in host else f"http://{host}"
+        self.model = model
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._pool = _ConnectionPool(self.host, size=pool_size, timeout=connect_timeout)
+
+    def _payload(self, prompt: str, max_tokens: Optional[int], temperature: Optional[float],
+                 top_k: Optional[int], system_prompt: Optional[str], images: Optional[List[bytes]],
+                 json_schema: Optional[dict]) -> bytes:
+        # Unset options are left out, so the model's Modelfile settings apply as with `ollama run`
+        options = {name: value for name, value in (("num_predict", max_tokens),
+                                                   ("temperature", temperature),
+                                                   ("top_k", top_k)) if value is not None}
+        payload = {"model": self.model,
+                   "prompt": prompt,
+                   "stream": True,
+                   "keep_alive": self.keep_alive}
+        if options:
+            payload["options"] = options
+        if system_prompt:
+            payload["system"] = system_prompt
+        if images:
+            payload["images"] = [base64.b64encode(image).decode("ascii") for image in images]
+        if json_schema is not None:
+            payload["format"] = json_schema
+        return json.dumps(payload).encode("utf-8")
+
+    @staticmethod
+    def _remaining(deadline: Optional[float]) -> Optional[float]:
+        """
+        Seconds left before `deadline` (None for no limit), used as the socket timeout.
+        """
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("deadline reached")
+        return remaining
+
+    def _open(self, body: bytes, deadline: Optional[float]):
+        """
+        Sends the request, retrying once on a fresh connection if a pooled one was closed by the server.
+
+        Only connecting uses the pool's connect timeout. Ollama sends no headers until the model is
+        loaded and the first token is generated, so waiting for the response is bounded by the time
+        left before `deadline`.
+        """
+        for attempt in range(2):
+            connection = self._pool.acquire()
+            try:
+                if connection.sock is None:
+                    connection.connect()
+                connection.sock.settimeout(self._remaining(deadline))
+                connection.request("POST", "/api/generate", body=body, headers={"Content-Type": "application/json"})
+                return connection, connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if attempt:
+                    raise
+            except BaseException:
+                connection.close()
+                raise
+
+    def stream(self, prompt: str,
+               max_tokens: Optional[int]=None,
+               temperature: Optional[float]=None,
+               top_k: Optional[int]=None,
+               system_prompt: Optional[str]=None,
+               images: Optional[List[bytes]]=None,
+               json_schema: Optional[dict]=None,
+               timeout: Optional[float]=None) -> Iterator[str]:
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        body = self._payload(prompt, max_tokens, temperature, top_k, system_prompt, images, json_schema)
+
+        try:
+            connection, response = self._open(body, deadline)
+        except socket.timeout as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LLMTimeoutError(f"No complete response within {timeout} s") from e
+            raise LLMTimeoutError(f"Cannot connect to Ollama at {self.host}") from e
+        except OSError as e:
+            raise LLMBackendError(f"Cannot reach Ollama at {self.host}: {e}") from e
+
+        reusable = False
+        try:
+            if response.status != 200:
+                detail = response.read().decode("utf-8", errors="replace")
+                reusable = True
+                raise LLMBackendError(f"Ollama returned {response.status}: {detail}")
+
+            while True:
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMTimeoutError(f"No complete response within {timeout} s")
+                    # Bound each read by the time left, so a stalled server cannot outlast the deadline
+                    if connection.sock is not None:
+                        connection.sock.settimeout(remaining)
+                line = response.readline()
+                if not line:
+                    raise LLMBackendError("Ollama closed the stream before the response was complete")
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise LLMBackendError(f"Ollama error: {chunk['error']}")
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    # Drain the terminating chunk so the connection can carry the next request
+                    response.read()
+                    reusable = not response.will_close
+                    return
+        except LLMBackendError:
+            raise
+        except socket.timeout as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LLMTimeoutError(f"No complete response within {timeout} s") from e
+            raise LLMTimeoutError(f"Ollama at {self.host} stopped responding") from e
+        finally:
+            if reusable and connection.sock is not None:
+                connection.sock.settimeout(self._pool.timeout)
+            self._pool.release(connection, reusable)
+
+    def close(self) -> None:
+        self._pool.close()
+
+
+_default_backend: Optional[LLMBackend] = None
+_default_backend_lock = threading.Lock()
+
+def default_backend() -> LLMBackend:
+    """
+    Returns the process-wide backend, created on first use.
+
+    Selected with environment variables: `LLM_BACKEND` ("ollama", the default, or "local"),
+    `OLLAMA_HOST` and `OLLAMA_MODEL` for the Ollama client, `LLM_MODEL` and `LLM_PROCESSOR` for the
+    in-process engine.
+    """
+    global _default_backend
+    with _default_backend_lock:
+        if _default_backend is None:
+            if os.environ.get("LLM_BACKEND", "ollama").lower() == "local":
+                _default_backend = InProcessBackend.from_model(model=os.environ.get("LLM_MODEL", "gemma-3_1b"),
+                                                               processor=os.environ.get("LLM_PROCESSOR", "npu"))
+            else:
+                _default_backend = OllamaBackend(host=os.environ.get("OLLAMA_HOST", DEFAULT_OLLAMA_HOST),
+                                                 model=os.environ.get("OLLAMA_MODEL", DEFAULT_OLLAMA_MODEL))
+        return _default_backend
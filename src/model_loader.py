@@ -1,14 +1,81 @@
 import onnxruntime as ort
 import os
 import json
+import logging
 import platform
+import threading
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import sys
 # print(ort.get_all_providers())
 
+logger = logging.getLogger(__name__)
+
+# Process-wide registry of loaded sessions, shared by every ModelLoader instance
+_SESSION_POOL: Dict[tuple, ort.InferenceSession] = {}
+_SESSION_POOL_LOCK = threading.Lock()
+_SESSION_KEY_LOCKS: Dict[tuple, threading.Lock] = {}
+
+class LazySession:
+    """
+    Handle to an InferenceSession that is still being loaded on a background thread.
+
+    Attribute access (`run`, `get_inputs`, `io_binding`, ...) is forwarded to the underlying
+    session and blocks until it has finished loading, so a LazySession can be used anywhere an
+    InferenceSession is expected. Load errors are raised on first use.
+
+    Args:
+        name (str): Graph name, e.g. "CONTEXT_ITER".
+        future (Future): Future resolving to the loaded InferenceSession.
+    """
+
+    def __init__(self, name: str, future: Future):
+        self.name = name
+        self._future = future
+
+    @property
+    def ready(self) -> bool:
+        """
+        True once loading has finished (successfully or not), without blocking.
+        """
+        return self._future.done()
+
+    @property
+    def failed(self) -> bool:
+        """
+        True if loading finished with an error, without blocking.
+        """
+        return self._future.done() and (self._future.cancelled() or self._future.exception() is not None)
+
+    def exception(self, timeout: Optional[float]=None) -> Optional[BaseException]:
+        """
+        Blocks until loading finishes and returns its error, or None if the session loaded.
+
+        Raises:
+            TimeoutError: If loading does not finish within `timeout` seconds.
+        """
+        return self._future.exception(timeout=timeout)
+
+    def wait(self, timeout: Optional[float]=None) -> ort.InferenceSession:
+        """
+        Blocks until the session is loaded and returns it.
+
+        Raises:
+            TimeoutError: If the session is not loaded within `timeout` seconds.
+        """
+        return self._future.result(timeout=timeout)
+
+    def __getattr__(self, attribute: str):
+        if attribute.startswith("_"):
+            raise AttributeError(attribute)
+        return getattr(self.wait(), attribute)
+
+    def __repr__(self) -> str:
+        return f"LazySession({self.name}, ready={self.ready})"
+
 class ModelLoader:
     def __init__(self, model: str, processor: str, model_type: str) -> None:
         """
@@ -140,7 +207,10 @@ class ModelLoader:
     def load_model(self, onnx_graph: ort, htp_performance_mode: str="burst", 
                    soc_model: str="60", profiling_level: str="off",
                    profiling_file_path: str=None, 
-                   htp_graph_finalization_optimization_mode: str="3") -> ort.InferenceSession:
+                   htp_graph_finalization_optimization_mode: str="3",
+                   use_session_pool: bool=True,
+                   ep_context_cache: bool=True,
+                   enable_profiling: bool=False) -> ort.InferenceSession:
         """
         Loads an ONNX model and configures an InferenceSession with QNN execution provider options.
 
@@ -149,6 +219,14 @@ class ModelLoader:
         QNN-specific provider options such as performance mode, SoC model, profiling, and graph 
         finalization behavior, then returns a ready-to-use InferenceSession.
 
+        Sessions are kept in a process-wide pool keyed by model path, execution provider and provider
+        options, so loading the same graph again (from any ModelLoader) returns the existing session.
+        On the QNN execution provider, the compiled graph is also saved next to the model as an EP context
+        model (`ep.context_enable`) the first time it is built, and that context model is loaded on later
+        starts instead of finalizing the graph again. The context model is rebuilt if the source model is newer
+        or fails to load (e.g. truncated, or compiled by another QNN SDK), and it is written under a temporary
+        name and moved into place once complete, so an interrupted compile never leaves a partial file behind.
+
         Args:
             onnx_graph (ort): The filename of the ONNX model (e.g., "model.onnx").
             htp_performance_mode (str): HTP performance mode (e.g., "burst", "balanced","sustained_high_performance").
@@ -156,6 +234,10 @@ class ModelLoader:
             profiling_level (str): Profiling verbosity level (e.g., "off", "basic", "detailed").
             profiling_file_path (str, optional): Path to write profiling results. Defaults to model directory.
             htp_graph_finalization_optimization_mode (str): Graph optimization level (e.g., "1", "2", "3").
+            use_session_pool (bool): Reuse a session already loaded with identical settings.
+            ep_context_cache (bool): Save and reuse compiled QNN context models.
+            enable_profiling (bool): Record ONNX Runtime per-node profiling into `profiling_file_path`;
+                call `session.end_profiling()` (or `profiling_report.collect_profiles`) to write and summarize it.
 
         Returns:
             ort.InferenceSession: An ONNX Runtime InferenceSession configured with the specified QNN provider.
@@ -163,8 +245,6 @@ class ModelLoader:
         Raises:
             ValueError: If processor configuration is missing or invalid.
         """
-        session_options = ort.SessionOptions()
-        
         model_path = self.model_subdirectory_path/onnx_graph
         executioner = self._get_executioner()
         dll_path = self._get_dll_path()
@@ -181,13 +261,133 @@ class ModelLoader:
             "offload_graph_io_quantization": 1
         }
 
-        session = ort.InferenceSession(model_path, 
-                                       providers=[(executioner.get("EP"),qnn_provider_options)],
-                                       sess_options=session_options
-                                       )
+        if not use_session_pool:
+            return self._create_session(model_path, executioner.get("EP"), qnn_provider_options,
+                                        ep_context_cache, enable_profiling)
+
+        key = (str(model_path), executioner.get("EP"), ep_context_cache, enable_profiling,
+               tuple(sorted((name, str(value)) for name, value in qnn_provider_options.items())))
+        with _SESSION_POOL_LOCK:
+            key_lock = _SESSION_KEY_LOCKS.setdefault(key, threading.Lock())
+
+        # Per-key lock: concurrent loads of one graph compile it once, different graphs load in parallel
+        with key_lock:
+            session = _SESSION_POOL.get(key)
+            if session is None:
+                session = self._create_session(model_path, executioner.get("EP"), qnn_provider_options,
+                                               ep_context_cache, enable_profiling)
+                _SESSION_POOL[key] = session
+            else:
+                logger.info(f"Reusing loaded session for {model_path.name}")
+        return session
 
+    def _create_session(self, model_path: Path, execution_provider: str,
+                        provider_options: dict, ep_context_cache: bool,
+                        enable_profiling: bool=False) -> ort.InferenceSession:
+        """
+        Builds an InferenceSession, loading or generating a QNN EP context model when enabled.
+        """
+        session_options = ort.SessionOptions()
+        if enable_profiling:
+            session_options.enable_profiling = True
+            profile_dir = Path(provider_options["profiling_file_path"])
+            # profiling_file_path may name the QNN CSV; the ORT profile goes next to it
+            if profile_dir.suffix:
+                profile_dir = profile_dir.parent
+            session_options.profile_file_prefix = str(profile_dir/f"ort_profile_{model_path.stem}")
+        context_path = self._context_model_path(model_path, provider_options)
+        if not ep_context_cache or execution_provider != "QNNExecutionProvider" or context_path is None:
+            return ort.InferenceSession(model_path,
+                                        providers=[(execution_provider, provider_options)],
+                                        sess_options=session_options
+                                        )
+
+        if context_path.exists() and context_path.stat().st_mtime >= model_path.stat().st_mtime:
+            logger.info(f"Loading compiled context model {context_path.name}")
+            try:
+                return ort.InferenceSession(context_path,
+                                            providers=[(execution_provider, provider_options)],
+                                            sess_options=session_options
+                                            )
+            except Exception as e:
+                logger.warning(f"Could not load context model {context_path.name} ({e}); recompiling it")
+                context_path.unlink(missing_ok=True)
+
+        # Written under a temporary name; only a complete context model is moved into place
+        temp_path = context_path.with_name(f"{context_path.stem}.{os.getpid()}.tmp.onnx")
+        logger.info(f"Compiling {model_path.name}; saving context model to {context_path.name}")
+        session_options.add_session_config_entry("ep.context_enable", "1")
+        session_options.add_session_config_entry("ep.context_file_path", str(temp_path))
+        session_options.add_session_config_entry("ep.context_embed_mode", "1")
+        try:
+            session = ort.InferenceSession(model_path,
+                                           providers=[(execution_provider, provider_options)],
+                                           sess_options=session_options
+                                           )
+            if temp_path.exists():
+                os.replace(temp_path, context_path)
+        finally:
+            temp_path.unlink(missing_ok=True)
         return session
+
+    @staticmethod
+    def _context_model_path(model_path: Path, provider_options: dict) -> Optional[Path]:
+        """
+        Returns where the compiled context model for `model_path` is stored, or None if `model_path`
+        is already a context model. The SoC and finalization mode are part of the name because the
+        compiled binary depends on them.
+        """
+        if model_path.name.endswith("_ctx.onnx"):
+            return None
+        return model_path.with_name(f"{model_path.stem}"
+                                    f"_soc{provider_options['soc_model']}"
+                                    f"_o{provider_options['htp_graph_finalization_optimization_mode']}_ctx.onnx")
+
+    @staticmethod
+    def clear_session_pool() -> None:
+        """
+        Drops every pooled session, e.g. before switching models in a long-running process.
+        """
+        with _SESSION_POOL_LOCK:
+            _SESSION_POOL.clear()
+            _SESSION_KEY_LOCKS.clear()
     
+    def load_graphs(self, max_workers: Optional[int]=None, **load_options) -> Dict[str, LazySession]:
+        """
+        Starts loading every ONNX graph of the model concurrently and returns lazy handles to them.
+
+        Graph loading (and QNN graph finalization) runs on a thread pool, so startup takes about as long
+        as the slowest graph instead of the sum of all of them. The returned handles can be passed to the
+        inference classes right away; each one blocks only when its session is first used.
+
+        Args:
+            max_workers (Optional[int]): Number of loader threads. Defaults to one per graph.
+            **load_options: Keyword arguments forwarded to `load_model` (e.g. `htp_performance_mode`).
+
+        Returns:
+            Dict[str, LazySession]: Lazy sessions keyed by graph name (e.g. "EMBEDDING", "HEAD").
+        """
+        graphs = self.graphs
+        if isinstance(graphs, str):
+            graphs = {"MODEL": graphs}
+        onnx_graphs = {name: graph for name, graph in graphs.items() if str(graph).endswith(".onnx")}
+
+        executor = ThreadPoolExecutor(max_workers=max_workers or max(len(onnx_graphs), 1),
+                                      thread_name_prefix=f"load-{self.model}")
+        sessions = {name: LazySession(name=name, future=executor.submit(self.load_model, graph, **load_options))
+                    for name, graph in onnx_graphs.items()}
+        # Workers exit once the submitted loads finish
+        executor.shutdown(wait=False)
+        return sessions
+
+    @staticmethod
+    def sessions_ready(sessions: Dict[str, LazySession]) -> bool:
+        """
+        Readiness probe: True once every lazy session has loaded successfully. Never blocks.
+        """
+        return all(not isinstance(session, LazySession) or (session.ready and not session.failed)
+                   for session in sessions.values())
+
     @property
     def graphs(self) -> str:
         """
@@ -1,26 +1,15 @@
 import onnxruntime as ort
-from PIL import Image
 import numpy as np
-import torch
 from transformers import CLIPTokenizerFast
-from torchvision import transforms
+
+from clip_preprocessing import preprocess_batch
 
 # ---- Load ONNX CLIP model ----
 session = ort.InferenceSession("./models/openai_clip.onnx", providers=["CPUExecutionProvider"])
 
 # ---- Preprocessing for image ----
-image_preprocess = transforms.Compose([
-    transforms.Resize(224, interpolation=Image.BICUBIC),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.48145466, 0.4578275, 0.40821073],
-                         std=[0.26862954, 0.26130258, 0.27577711])
-])
-
 def preprocess_image(image_path):
-    image = Image.open(image_path).convert("RGB")
-    image_tensor = image_preprocess(image).unsqueeze(0).numpy()
-    return image_tensor.astype(np.float32)
+    return preprocess_batch([image_path], image_size=224)  # [1, 3, 224, 224] float32
 
 # ---- Tokenizer for text ----
 tokenizer = CLIPTokenizerFast.from_pretrained("openai/clip-vit-base-patch32") #so we actually cache this locally as well 
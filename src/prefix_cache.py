@@ -0,0 +1,151 @@
+import numpy as np
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from kv_cache import KV_PRECISIONS, dequantize_kv, quantize_kv
+
+
+@dataclass
+class PrefixCacheEntry:
+    token_ids: np.ndarray
+    kv_cache: Dict[str, object]
+    logits: np.ndarray
+    nbytes: int
+
+    @property
+    def length(self) -> int:
+        return self.token_ids.shape[0]
+
+    def kv_slice(self, length: int) -> Dict[str, np.ndarray]:
+        """
+        Returns the cached keys/values for the first `length` positions, restored to full precision
+        if they are stored quantized.
+
+        Args:
+            length (int): Number of leading positions to keep.
+
+        Returns:
+            Dict[str, np.ndarray]: Per-layer tensors of shape (1, num_key_value_heads, length, head_size).
+        """
+        return dequantize_kv(self.kv_cache, length=length)
+
+
+class PrefixKVCache():
+    """
+    An LRU cache of post-prefill KV tensors keyed by prompt token IDs.
+
+    Because attention is causal, the keys/values computed for a prompt are valid for any other
+    prompt sharing the same leading tokens. A lookup therefore returns the entry with the longest
+    common token prefix, and the caller only prefills the remaining suffix. Entries are evicted
+    least-recently-used first once the stored tensors exceed `max_bytes`.
+
+    Keys/values can be stored at reduced precision ("fp16", or "int8" with per-head scales) to fit
+    2-4x more prefixes into the same budget; they are restored to full precision on lookup.
+
+    Args:
+        max_bytes (int): Memory cap for all stored keys, values and logits.
+        min_prefix_length (int): Shortest shared prefix worth reusing.
+        kv_precision (str): Storage precision of cached keys/values: "fp32", "fp16" or "int8".
+
+    Raises:
+        ValueError: If `kv_precision` is not supported.
+
+    Attributes:
+        entries (OrderedDict): Cached entries keyed by token ID tuple, oldest first.
+        nbytes (int): Memory currently held by the cache.
+        hits (int): Number of lookups that reused a prefix.
+        misses (int): Number of lookups that found nothing to reuse.
+    """
+
+    def __init__(self, max_bytes: int=256 * 1024**2, min_prefix_length: int=8, kv_precision: str="fp32"):
+        if kv_precision not in KV_PRECISIONS:
+            raise ValueError(f"Unsupported KV precision: {kv_precision}. Select {' | '.join(KV_PRECISIONS)}")
+        self.max_bytes = max_bytes
+        self.min_prefix_length = min_prefix_length
+        self.kv_precision = kv_precision
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def match(self, token_ids: np.ndarray) -> Tuple[int, Optional[PrefixCacheEntry]]:
+        """
+        Finds the cached entry sharing the longest token prefix with `token_ids`.
+
+        The returned length equals `len(token_ids)` only for an exact match, in which case the entry's
+        logits belong to the last prompt token and prefill can be skipped entirely. Otherwise at least
+        one token is left for the caller to process so that fresh logits are produced.
+
+        Args:
+            token_ids (np.ndarray): 1D array of prompt token IDs.
+
+        Returns:
+            Tuple[int, Optional[PrefixCacheEntry]]: Number of reusable positions and the entry holding them,
+                or (0, None) on a miss.
+        """
+        best_length, best_entry = 0, None
+        with self._lock:
+            for entry in self.entries.values():
+                common = _common_prefix_length(entry.token_ids, token_ids)
+                if common == token_ids.shape[0] and entry.length != common:
+                    common -= 1
+                if common > best_length:
+                    best_length, best_entry = common, entry
+
+            if best_entry is None or best_length < self.min_prefix_length:
+                self.misses += 1
+                return 0, None
+
+            self.entries.move_to_end(tuple(best_entry.token_ids.tolist()))
+            self.hits += 1
+            return best_length, best_entry
+
+    def insert(self, token_ids: np.ndarray, kv_cache: Dict[str, np.ndarray], logits: np.ndarray) -> None:
+        """
+        Stores the keys/values and last-position logits of a prefilled prompt.
+
+        Args:
+            token_ids (np.ndarray): 1D array of prompt token IDs.
+            kv_cache (Dict[str, np.ndarray]): Per-layer keys/values covering at least the prompt positions.
+            logits (np.ndarray): Logits of the last prompt token.
+        """
+        length = token_ids.shape[0]
+        if length < self.min_prefix_length:
+            return
+
+        stored_kv = quantize_kv({name: cache[:, :, :length] for name, cache in kv_cache.items()},
+                                precision=self.kv_precision)
+        stored_logits = np.array(logits, copy=True)
+        nbytes = sum(cache.nbytes for cache in stored_kv.values()) + stored_logits.nbytes
+        if nbytes > self.max_bytes:
+            return
+
+        key = tuple(token_ids.tolist())
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+
+            self.entries[key] = PrefixCacheEntry(token_ids=np.array(token_ids, copy=True),
+                                                 kv_cache=stored_kv,
+                                                 logits=stored_logits,
+                                                 nbytes=nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+def _common_prefix_length(a: np.ndarray, b: np.ndarray) -> int:
+    n = min(a.shape[0], b.shape[0])
+    mismatches = np.flatnonzero(a[:n] != b[:n])
+    return int(mismatches[0]) if mismatches.size else n
@@ -0,0 +1,238 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import argparse
+import csv
+import json
+import logging
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MEMCPY_OPS = ("MemcpyToHost", "MemcpyFromHost")
+ACCELERATOR_PROVIDERS = ("QNNExecutionProvider",)
+# Report holding the QNN backend events, which the profiling CSV records for the whole process
+QNN_REPORT = "QNN"
+
+@dataclass
+class OpStat:
+    name: str
+    op_type: str
+    provider: str
+    calls: int=0
+    total_ms: float=0.0
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.calls if self.calls else 0.0
+
+
+@dataclass
+class ProfileReport:
+    """
+    Summary of one ONNX Runtime profiling file.
+
+    Attributes:
+        graph (str): Graph the profile belongs to (e.g. "CONTEXT_ITER").
+        runs (int): Number of `model_run` events (session runs) in the profile.
+        run_ms (float): Total wall time of those runs.
+        ops (List[OpStat]): Per-node statistics, slowest total first.
+        providers (Dict[str, dict]): Node count and total time per execution provider.
+        memcpy_ms (float): Time spent in MemcpyToHost/MemcpyFromHost nodes.
+        qnn_events (Dict[str, float]): Aggregated QNN backend timings (from the QNN profiling CSV), if available.
+            The CSV does not name the graph of each event, so they are kept in a separate `QNN_REPORT`.
+    """
+    graph: str
+    runs: int=0
+    run_ms: float=0.0
+    ops: List[OpStat]=field(default_factory=list)
+    providers: Dict[str, dict]=field(default_factory=dict)
+    memcpy_ms: float=0.0
+    qnn_events: Dict[str, float]=field(default_factory=dict)
+
+    @property
+    def fallback_ops(self) -> List[OpStat]:
+        """
+        Nodes that ran outside the accelerator (e.g. on the CPU execution provider).
+        """
+        return [op for op in self.ops if op.provider not in ACCELERATOR_PROVIDERS]
+
+    def to_dict(self) -> dict:
+        return {"graph": self.graph,
+                "runs": self.runs,
+                "run_ms": self.run_ms,
+                "memcpy_ms": self.memcpy_ms,
+                "providers": self.providers,
+                "hottest_ops": [dict(vars(op), mean_ms=op.mean_ms) for op in self.ops[:20]],
+                "fallback_ops": [dict(vars(op), mean_ms=op.mean_ms) for op in self.fallback_ops],
+                "qnn_events": self.qnn_events}
+
+    def format(self, top_n: int=10) -> str:
+        """
+        Formats the report as text: run time, provider split, hottest nodes and fallback nodes.
+        """
+        if not self.runs and not self.ops:
+            lines = [f"=== {self.graph}: backend events of every graph ==="]
+            for event, total_ms in sorted(self.qnn_events.items(), key=lambda item: -item[1])[:top_n]:
+                lines.append(f"  QNN {event:<50}{total_ms:>10.2f} ms")
+            return "\n".join(lines)
+
+        lines = [f"=== {self.graph}: {self.runs} runs, {self.run_ms:.2f} ms total, memcpy {self.memcpy_ms:.2f} ms ==="]
+        for provider, stats in sorted(self.providers.items(), key=lambda item: -item[1]["total_ms"]):
+            lines.append(f"  {provider:<28}{stats['nodes']:>6} nodes {stats['total_ms']:>10.2f} ms")
+
+        lines.append("  Hottest nodes:")
+        for op in self.ops[:top_n]:
+            lines.append(f"    {op.name:<40}{op.op_type:<22}{op.provider:<28}{op.total_ms:>10.2f} ms ({op.calls} calls)")
+
+        fallback = self.fallback_ops
+        lines.append(f"  Nodes off the accelerator: {len(fallback)}")
+        for op in fallback[:top_n]:
+            lines.append(f"    {op.name:<40}{op.op_type:<22}{op.provider:<28}{op.total_ms:>10.2f} ms")
+
+        for event, total_ms in sorted(self.qnn_events.items(), key=lambda item: -item[1])[:top_n]:
+            lines.append(f"  QNN {event:<50}{total_ms:>10.2f} ms")
+        return "\n".join(lines)
+
+
+def parse_ort_profile(profile_path: Path, graph: Optional[str]=None) -> ProfileReport:
+    """
+    Parses an ONNX Runtime profiling file (Chrome trace JSON written by `end_profiling`).
+
+    Node events ("cat": "Node", name ending in "_kernel_time") carry the operator type and the execution
+    provider that ran it. Nodes fused into a QNN context show up as a single QNNExecutionProvider node, so
+    every other provider in the report marks a fallback.
+
+    Args:
+        profile_path (Path): Profiling JSON file.
+        graph (Optional[str]): Name used in the report. Defaults to the file name.
+
+    Returns:
+        ProfileReport: The aggregated report.
+    """
+    with open(profile_path, "r") as f:
+        events = json.load(f)
+    if isinstance(events, dict):
+        events = events.get("traceEvents", [])
+
+    report = ProfileReport(graph=graph or Path(profile_path).stem)
+    ops: Dict[str, OpStat] = {}
+
+    for event in events:
+        duration_ms = event.get("dur", 0) / 1000
+        if event.get("cat") == "Session" and event.get("name") == "model_run":
+            report.runs += 1
+            report.run_ms += duration_ms
+            continue
+        if event.get("cat") != "Node" or not event.get("name", "").endswith("_kernel_time"):
+            continue
+
+        args = event.get("args", {})
+        name = event["name"][:-len("_kernel_time")]
+        op = ops.get(name)
+        if op is None:
+            op = ops[name] = OpStat(name=name, op_type=args.get("op_name", "?"), provider=args.get("provider", "?"))
+        op.calls += 1
+        op.total_ms += duration_ms
+        if op.op_type in MEMCPY_OPS:
+            report.memcpy_ms += duration_ms
+
+    report.ops = sorted(ops.values(), key=lambda op: -op.total_ms)
+    providers = defaultdict(lambda: {"nodes": 0, "total_ms": 0.0})
+    for op in report.ops:
+        providers[op.provider]["nodes"] += 1
+        providers[op.provider]["total_ms"] += op.total_ms
+    report.providers = dict(providers)
+    return report
+
+def parse_qnn_profile(csv_path: Path) -> Dict[str, float]:
+    """
+    Aggregates the QNN HTP profiling CSV (written when `profiling_level` is "basic" or "detailed").
+
+    Rows are summed per event identifier. Only rows measured in microseconds are kept, since the CSV also
+    contains cycle counts and counters.
+
+    Args:
+        csv_path (Path): Path of the CSV given as `profiling_file_path`.
+
+    Returns:
+        Dict[str, float]: Total milliseconds per QNN event.
+    """
+    totals = defaultdict(float)
+    with open(csv_path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            unit = (row.get("Unit of Measurement") or "").strip().upper()
+            if unit not in ("US", "MICROSEC", "MICROSECONDS"):
+                continue
+            event = (row.get("Event Identifier") or row.get("Message") or "").strip()
+            try:
+                totals[event] += float(row.get("Time", 0)) / 1000
+            except ValueError:
+                continue
+    return dict(totals)
+
+def collect_profiles(sessions: Dict[str, object], qnn_profile: Optional[Path]=None) -> Dict[str, ProfileReport]:
+    """
+    Stops profiling on every session and parses the files they wrote.
+
+    Sessions must have been loaded with `ModelLoader.load_model(..., enable_profiling=True)`. Calling
+    `end_profiling` finalizes the file, so profiling ends for those sessions.
+
+    Args:
+        sessions (Dict[str, object]): Sessions keyed by graph name, as passed to the inference classes.
+        qnn_profile (Optional[Path]): QNN profiling CSV, if one was written. Its events cover every graph
+            of the process, so they are reported once under `QNN_REPORT`.
+
+    Returns:
+        Dict[str, ProfileReport]: One report per graph, plus the `QNN_REPORT` entry if `qnn_profile` exists.
+    """
+    reports = {}
+    for graph_name, session in sessions.items():
+        profile_path = session.end_profiling()
+        if not profile_path:
+            logger.warning(f"{graph_name} was not loaded with profiling enabled")
+            continue
+        reports[graph_name] = parse_ort_profile(profile_path, graph=graph_name)
+    if qnn_profile is not None and Path(qnn_profile).exists():
+        reports[QNN_REPORT] = ProfileReport(graph=QNN_REPORT, qnn_events=parse_qnn_profile(qnn_profile))
+    return reports
+
+def profiling_report():
+
+    parser = argparse.ArgumentParser(description="Summarize ONNX Runtime / QNN profiling files")
+
+    parser.add_argument("profiles",
+                        type=str,
+                        nargs="+",
+                        help="ONNX Runtime profiling JSON files")
+    parser.add_argument("--qnn_csv",
+                        type=str,
+                        default="",
+                        help="Optional QNN profiling CSV")
+    parser.add_argument("--top",
+                        type=int,
+                        default=10,
+                        help="Number of nodes listed per section")
+    parser.add_argument("--output",
+                        type=str,
+                        default="",
+                        help="Optional JSON file receiving the reports")
+
+    args = parser.parse_args()
+
+    reports = [parse_ort_profile(Path(profile)) for profile in args.profiles]
+    if args.qnn_csv:
+        reports.append(ProfileReport(graph=QNN_REPORT, qnn_events=parse_qnn_profile(Path(args.qnn_csv))))
+    for report in reports:
+        print(report.format(top_n=args.top))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump([report.to_dict() for report in reports], f, indent=2)
+
+if __name__=="__main__":
+    profiling_report()
@@ -0,0 +1,209 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Process-wide registry: Streamlit re-executes the app script on every interaction and runs each
+# browser session on its own thread, but imported modules (and this registry) live for the process.
+_RESOURCES: Dict[str, object] = {}
+_RESOURCES_LOCK = threading.Lock()
+_RESOURCE_KEY_LOCKS: Dict[str, threading.Lock] = {}
+
+def get_resource(key: str, loader: Callable[[], object]) -> object:
+    """
+    Returns the resource registered under `key`, calling `loader` to create it on first use.
+
+    Concurrent first requests for the same key load it once; different keys load in parallel.
+
+    Args:
+        key (str): Registry key, e.g. "clip:clip_vit_l14:npu:fp32".
+        loader (Callable[[], object]): Builds the resource.
+
+    Returns:
+        object: The shared resource.
+    """
+    resource = _RESOURCES.get(key)
+    if resource is not None:
+        return resource
+
+    with _RESOURCES_LOCK:
+        key_lock = _RESOURCE_KEY_LOCKS.setdefault(key, threading.Lock())
+    with key_lock:
+        resource = _RESOURCES.get(key)
+        if resource is None:
+            start = time.perf_counter()
+            resource = loader()
+            _RESOURCES[key] = resource
+            logger.info(f"Loaded shared resource {key} in {time.perf_counter() - start:.1f} s")
+    return resource
+
+def clear_resources() -> None:
+    """
+    Drops every registered resource, closing those that support it (e.g. database pools).
+    """
+    with _RESOURCES_LOCK:
+        resources = list(_RESOURCES.values())
+        _RESOURCES.clear()
+    for resource in resources:
+        close = getattr(resource, "close", None)
+        if callable(close):
+            close()
+
+
+class FaissIndexHandle():
+    """
+    Shared FAISS index that reloads itself when the index file changes on disk.
+
+    The file's modification time is checked at most every `check_interval` seconds. A changed index
+    is read outside the lock and swapped in atomically, so searches running on other threads keep
+    using the previous index until the new one is ready and never see a partially loaded index.
+
+    Args:
+        path (Path): FAISS index file.
+        check_interval (float): Minimum seconds between modification time checks.
+    """
+
+    def __init__(self, path: Path, check_interval: float=5.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._index, self._mtime = self._read()
+        self._checked = time.monotonic()
+
+    def _read(self) -> Tuple[object, float]:
+        import faiss
+        mtime = os.path.getmtime(self.path)
+        return faiss.read_index(str(self.path)), mtime
+
+    @property
+    def index(self):
+        """
+        The current index, reloaded first if the file changed.
+        """
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            self._checked = now
+            self._reload_if_changed()
+        return self._index
+
+    def _reload_if_changed(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime or not self._lock.acquire(blocking=False):
+            return
+        try:
+            index, mtime = self._read()
+            self._index, self._mtime = index, mtime
+            logger.info(f"Reloaded FAISS index {self.path} ({index.ntotal} vectors)")
+        except Exception as e:
+            # Likely caught mid-write; the next check retries
+            logger.warning(f"Could not reload FAISS index {self.path}: {e}")
+        finally:
+            self._lock.release()
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the current index.
+
+        Args:
+            queries (np.ndarray): float32 query vectors of shape (n, dimension).
+            k (int): Number of neighbors per query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Distances and ids, each of shape (n, k).
+        """
+        return self.index.search(queries, k)
+
+
+class SQLitePool():
+    """
+    Small pool of SQLite connections shared by all sessions of the app.
+
+    Connections are opened with `check_same_thread=False` and handed to one thread at a time, so
+    Streamlit sessions running on different threads reuse connections instead of opening a new one
+    per query.
+
+    Args:
+        path (Path): Database file.
+        size (int): Maximum number of idle connections kept open.
+    """
+
+    def __init__(self, path: Path, size: int=4):
+        self.path = str(path)
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrows a connection; the block's transaction is committed on success and rolled back on error.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            with conn:
+                yield conn
+        except BaseException:
+            conn.close()
+            raise
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def clip_encoder(model: str="clip_vit_l14", processor: str="npu", variant: str="fp32"):
+    """
+    Returns the shared ONNX CLIP image encoder (`CLIPImageEncoder`), loaded once per process.
+    """
+    def load():
+        from clip_image_encoder import CLIPImageEncoder
+        return CLIPImageEncoder.from_model(model=model, processor=processor, variant=variant)
+
+    return get_resource(f"clip:{model}:{processor}:{variant}", load)
+
+def image_embedding_server(model: str="clip_vit_l14", processor: str="npu", variant: str="fp32",
+                           max_batch_size: int=16, max_wait_ms: float=5.0):
+    """
+    Returns the shared, started `ImageEmbeddingServer` batching the requests of every session.
+    """
+    def load():
+        from image_embedding_server import ImageEmbeddingServer
+        return ImageEmbeddingServer(encoder=clip_encoder(model=model, processor=processor, variant=variant),
+                                    max_batch_size=max_batch_size, max_wait_ms=max_wait_ms).start()
+
+    return get_resource(f"image_embedding_server:{model}:{processor}:{variant}", load)
+
+def faiss_index(path: Path, check_interval: float=5.0) -> FaissIndexHandle:
+    """
+    Returns the shared, hot-reloading handle of the FAISS index at `path`.
+    """
+    path = Path(path).resolve()
+    return get_resource(f"faiss:{path}", lambda: FaissIndexHandle(path, check_interval=check_interval))
+
+def db_pool(path: Path, size: int=4) -> SQLitePool:
+    """
+    Returns the shared connection pool of the SQLite database at `path`.
+    """
+    path = Path(path).resolve()
+    return get_resource(f"sqlite:{path}", lambda: SQLitePool(path, size=size))
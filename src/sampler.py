@@ -0,0 +1,188 @@
+import numpy as np
+
+from typing import Optional, Sequence, Tuple
+
+
+class Sampler():
+    """
+    Vectorized next-token sampler over a (batch, vocab) logits matrix.
+
+    Applies an optional token mask (constrained decoding), repetition penalty, temperature, top-k, top-p
+    and min-p filtering and draws one token per row. Top-k uses `np.argpartition`, so only the k surviving candidates are softmaxed and sorted;
+    without top-k the softmax is computed in place in a scratch buffer that is reused across calls.
+    The constructor arguments are defaults which individual `sample` calls may override.
+
+    Args:
+        temperature (float): Softmax temperature. 0 selects the most likely token (greedy).
+        top_k (Optional[int]): Keep only the k most likely tokens.
+        top_p (Optional[float]): Keep the smallest set of tokens whose probability mass reaches p.
+        min_p (Optional[float]): Drop tokens less likely than `min_p` times the most likely token.
+        repetition_penalty (Optional[float]): Penalty (>= 1.0) for tokens that were already generated.
+        seed (Optional[int]): Seed of the random generator, for reproducible sampling.
+
+    Attributes:
+        rng (np.random.Generator): Random generator used for every draw.
+    """
+
+    def __init__(self, temperature: float=1.0,
+                 top_k: Optional[int]=None,
+                 top_p: Optional[float]=None,
+                 min_p: Optional[float]=None,
+                 repetition_penalty: Optional[float]=None,
+                 seed: Optional[int]=None):
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.min_p = min_p
+        self.repetition_penalty = repetition_penalty
+        self.rng = np.random.default_rng(seed)
+        self._scratch = np.empty((0, 0), dtype=np.float32)
+
+    def sample(self, logits: np.ndarray,
+               generated_ids: Optional[Sequence[Sequence[int]]]=None,
+               temperature: Optional[float]=None,
+               top_k: Optional[int]=None,
+               top_p: Optional[float]=None,
+               min_p: Optional[float]=None,
+               repetition_penalty: Optional[float]=None,
+               allowed: Optional[np.ndarray]=None) -> np.ndarray:
+        """
+        Draws the next token for every row of `logits`.
+
+        Args:
+            logits (np.ndarray): Logits of shape (batch, vocab_size).
+            generated_ids (Optional[Sequence[Sequence[int]]]): Previously generated token IDs per row,
+                used by the repetition penalty.
+            temperature, top_k, top_p, min_p, repetition_penalty: Per-call overrides of the defaults.
+            allowed (Optional[np.ndarray]): Boolean mask of shape (vocab_size,) or (batch, vocab_size); only
+                tokens marked True can be drawn. Logits beyond the mask's width (padded vocabularies) are
+                disallowed too.
+
+        Returns:
+            np.ndarray: Sampled token IDs of shape (batch,).
+        """
+        temperature = self.temperature if temperature is None else temperature
+        scores = self._penalized(logits, generated_ids, repetition_penalty)
+        if allowed is not None:
+            self._mask(scores, allowed)
+
+        if temperature <= 0:
+            return np.argmax(scores, axis=-1)
+
+        probabilities, indices = self._filter(scores,
+                                              temperature=temperature,
+                                              top_k=self.top_k if top_k is None else top_k,
+                                              top_p=self.top_p if top_p is None else top_p,
+                                              min_p=self.min_p if min_p is None else min_p)
+
+        cumulative = np.cumsum(probabilities, axis=-1)
+        draws = self.rng.random(cumulative.shape[0]) * cumulative[:, -1]
+        choices = np.array([np.searchsorted(row, draw, side="right") for row, draw in zip(cumulative, draws)])
+        choices = np.minimum(choices, cumulative.shape[-1] - 1)
+
+        if indices is None:
+            return choices
+        return indices[np.arange(indices.shape[0]), choices]
+
+    def distribution(self, logits: np.ndarray,
+                     generated_ids: Optional[Sequence[Sequence[int]]]=None,
+                     temperature: Optional[float]=None) -> np.ndarray:
+        """
+        Computes the dense, filtered probability distribution that `sample` draws from.
+
+        Args:
+            logits (np.ndarray): Logits of shape (batch, vocab_size).
+            generated_ids (Optional[Sequence[Sequence[int]]]): Previously generated token IDs per row.
+            temperature (Optional[float]): Override of the default temperature.
+
+        Returns:
+            np.ndarray: Probabilities of shape (batch, vocab_size); filtered tokens have probability 0.
+        """
+        temperature = self.temperature if temperature is None else temperature
+        scores = self._penalized(logits, generated_ids, None)
+
+        dense = np.zeros(scores.shape, dtype=np.float32)
+        if temperature <= 0:
+            dense[np.arange(scores.shape[0]), np.argmax(scores, axis=-1)] = 1.0
+            return dense
+
+        probabilities, indices = self._filter(scores, temperature=temperature,
+                                              top_k=self.top_k, top_p=self.top_p, min_p=self.min_p)
+        if indices is None:
+            dense[...] = probabilities
+        else:
+            np.put_along_axis(dense, indices, probabilities, axis=-1)
+        return dense
+
+    def _penalized(self, logits: np.ndarray,
+                   generated_ids: Optional[Sequence[Sequence[int]]],
+                   repetition_penalty: Optional[float]) -> np.ndarray:
+        """
+        Copies the logits into the scratch buffer and applies the repetition penalty there.
+        """
+        if self._scratch.shape[0] < logits.shape[0] or self._scratch.shape[1] != logits.shape[1]:
+            self._scratch = np.empty(logits.shape, dtype=np.float32)
+        scores = self._scratch[:logits.shape[0]]
+        np.copyto(scores, logits)
+
+        penalty = self.repetition_penalty if repetition_penalty is None else repetition_penalty
+        if penalty and generated_ids is not None:
+            for row, row_ids in enumerate(generated_ids):
+                if len(row_ids) == 0:
+                    continue
+                token_ids = np.unique(np.asarray(row_ids, dtype=np.int64))
+                penalized = scores[row, token_ids]
+                scores[row, token_ids] = np.where(penalized > 0, penalized / penalty, penalized * penalty)
+        return scores
+
+    @staticmethod
+    def _mask(scores: np.ndarray, allowed: np.ndarray) -> None:
+        """
+        Sets the scores of disallowed tokens to -inf, in place.
+        """
+        width = allowed.shape[-1]
+        scores[:, width:] = -np.inf
+        np.copyto(scores[:, :width], -np.inf, where=~allowed)
+
+    def _filter(self, scores: np.ndarray,
+                temperature: float,
+                top_k: Optional[int],
+                top_p: Optional[float],
+                min_p: Optional[float]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Converts penalized scores into filtered, normalized probabilities.
+
+        Returns:
+            Tuple[np.ndarray, Optional[np.ndarray]]: Probabilities of the surviving candidates and their
+                vocabulary indices (None when every vocabulary entry is a candidate, in which case the
+                probabilities are computed in place in `scores`).
+        """
+        indices = None
+        if top_k and top_k < scores.shape[-1]:
+            indices = np.argpartition(scores, -top_k, axis=-1)[:, -top_k:]
+            candidates = np.take_along_axis(scores, indices, axis=-1)
+        else:
+            candidates = scores
+
+        candidates -= candidates.max(axis=-1, keepdims=True)
+        candidates /= temperature
+        np.exp(candidates, out=candidates)
+        candidates /= candidates.sum(axis=-1, keepdims=True)
+
+        if min_p:
+            candidates[candidates < min_p * candidates.max(axis=-1, keepdims=True)] = 0.0
+
+        if top_p and top_p < 1.0:
+            if indices is None:
+                indices = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape)
+            order = np.argsort(-candidates, axis=-1)
+            candidates = np.take_along_axis(candidates, order, axis=-1)
+            indices = np.take_along_axis(indices, order, axis=-1)
+            # Keep every token whose preceding mass is below top_p (always keeps the first)
+            preceding = np.cumsum(candidates, axis=-1) - candidates
+            candidates[preceding >= top_p] = 0.0
+
+        if min_p or top_p:
+            candidates /= candidates.sum(axis=-1, keepdims=True)
+        return candidates, indices
+
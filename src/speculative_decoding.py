@@ -0,0 +1,212 @@
+import numpy as np
+import logging
+import time
+
+from typing import Dict, List, Optional
+
+from deepseek_model_inference import DeepSeekModelInference
+from sampler import Sampler
+
+logger = logging.getLogger(__name__)
+
+class SpeculativeDecoder():
+    """
+    Speculative decoding with a small DeepSeek draft model and a large DeepSeek target model.
+
+    Each round the draft model proposes `num_speculative_tokens` tokens autoregressively. The target
+    model then scores the last accepted token plus every proposal in a single multi-token pass. Proposals
+    are accepted with probability min(1, p(x)/q(x)); the first rejection is replaced by a sample from
+    the normalized residual max(0, p - q), and if every proposal is accepted a bonus token is drawn from
+    the target. The output therefore follows the target model's (filtered) distribution exactly, while
+    the target runs once per round instead of once per token.
+
+    Both models must share a tokenizer (e.g. DEEPSEEK_1.5B drafting for DEEPSEEK_7B). Their HEAD graphs may
+    pad the vocabulary to different widths (151936 and 152064 logits for those two); draft distributions are
+    zero-padded or cut to the target's width before they are compared. KV caches are kept in each model's
+    `kv_cache` dictionary and truncated to the accepted length after every round.
+
+    Args:
+        draft (DeepSeekModelInference): Small, fast model proposing tokens.
+        target (DeepSeekModelInference): Large model whose distribution is preserved.
+        num_speculative_tokens (int): Number of tokens proposed per round.
+        seed (Optional[int]): Seed for acceptance tests and sampling.
+
+    Attributes:
+        draft_width (Optional[int]): Logits emitted by the draft HEAD, None if the dimension is symbolic.
+        target_width (Optional[int]): Logits emitted by the target HEAD, None if the dimension is symbolic.
+        proposed (int): Total number of draft tokens proposed.
+        accepted (int): Total number of draft tokens accepted by the target.
+        stats (Dict[str, float]): Figures of the last `run_inference` call, with the keys of
+            `benchmark.summarize_generation` except the per-token latencies: ttft_s,
+            prefill_tokens_per_s, decode_tokens_per_s and generated_tokens.
+
+    Raises:
+        ValueError: If the draft and target tokenizers have different vocabularies, or a HEAD emits fewer
+            logits than the tokenizer has tokens.
+    """
+
+    def __init__(self, draft: DeepSeekModelInference,
+                 target: DeepSeekModelInference,
+                 num_speculative_tokens: int=4,
+                 seed: Optional[int]=None):
+        vocab_size = target.tokenizer.get_vocab_size()
+        if draft.tokenizer.get_vocab_size() != vocab_size:
+            raise ValueError("Draft and target models must share the same tokenizer vocabulary")
+        self.draft_width = self._logits_width(draft)
+        self.target_width = self._logits_width(target)
+        for name, width in (("Draft", self.draft_width), ("Target", self.target_width)):
+            if width is not None and width < vocab_size:
+                raise ValueError(f"{name} HEAD emits {width} logits for a vocabulary of {vocab_size} tokens")
+        if self.draft_width != self.target_width:
+            logger.info(f"Draft and target HEADs emit {self.draft_width} and {self.target_width} logits; "
+                        f"draft distributions are aligned to the target")
+
+        self.draft = draft
+        self.target = target
+        self.num_speculative_tokens = num_speculative_tokens
+        self.rng = np.random.default_rng(seed)
+        self.proposed = 0
+        self.accepted = 0
+        self.stats: Dict[str, float] = {}
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.proposed if self.proposed else 0.0
+
+    def run_inference(self, query: str,
+                      top_k: Optional[int]=None,
+                      temperature: float=0.6,
+                      persona: Optional[str]=None,
+                      max_tokens: int=100) -> str:
+        """
+        Generates a response with draft/verify rounds.
+
+        Args:
+            query (str): Initial prompt from the user.
+            top_k (Optional[int]): Limits both distributions to the top-k most probable tokens.
+            temperature (float): Sampling temperature; 0 makes decoding greedy.
+            persona (Optional[str]): Optional persona name to influence model behavior.
+            max_tokens (int): Maximum number of tokens to generate.
+
+        Returns:
+            str: The decoded response.
+        """
+        sampler = Sampler(temperature=temperature, top_k=top_k)
+        target, draft = self.target, self.draft
+
+        token_ids = target.tokenize(target.query(query, persona))
+        prompt_length = token_ids.shape[-1]
+        start = time.perf_counter()
+        target_logits = target.prefill(token_ids=token_ids)
+        draft.prefill(token_ids=token_ids)
+
+        tokens = token_ids[0].tolist()
+        tokens.append(self._sample(sampler.distribution(target_logits[:, -1])[0]))
+        first_token = time.perf_counter()
+        # Like the plain decode loop, the first sampled token is followed by up to max_tokens more
+        end_length = prompt_length + max_tokens + 1
+        # Positions with valid keys/values; the newest token is never in either cache yet
+        draft_length = prompt_length
+
+        while len(tokens) < end_length and tokens[-1] != target.eos_token_id:
+            target_length = len(tokens) - 1
+            budget = min(self.num_speculative_tokens, end_length - len(tokens))
+            budget = min(budget, target.model_params.context_length - len(tokens) - 1)
+            if budget <= 0:
+                break
+
+            # Draft: catch up on tokens the draft has not seen, then propose
+            proposals, draft_distributions = [], []
+            pending = tokens[draft_length:]
+            for position, token_id in enumerate(pending, start=draft_length):
+                draft_logits = self._draft_step(token_id=token_id, position=position)
+            draft_length = len(tokens)
+            for i in range(budget):
+                distribution = sampler.distribution(draft_logits[:, -1])[0]
+                proposal = self._sample(distribution)
+                proposals.append(proposal)
+                draft_distributions.append(distribution)
+                if i < budget - 1:
+                    draft_logits = self._draft_step(token_id=proposal, position=draft_length)
+                    draft_length += 1
+
+            # Verify: one target pass over the last accepted token and every proposal
+            candidate_ids = np.array([tokens + proposals], dtype=np.int64)
+            target_logits = target.score_tokens(token_ids=candidate_ids, start=target_length)
+            target_distributions = sampler.distribution(target_logits[0])
+
+            accepted = self._accept(proposals, draft_distributions, target_distributions)
+            self.proposed += len(proposals)
+            self.accepted += len(accepted) - 1
+
+            tokens.extend(accepted)
+            target.truncate_kv_cache(length=len(tokens) - 1)
+            draft_length = min(draft_length, len(tokens) - 1)
+            draft.truncate_kv_cache(length=draft_length)
+
+        generated_ids = tokens[prompt_length:end_length]
+        if target.eos_token_id in generated_ids:
+            generated_ids = generated_ids[:generated_ids.index(target.eos_token_id) + 1]
+
+        # Prefill (both models) produces the first token; decode throughput counts the tokens after it
+        ttft = first_token - start
+        decode_time = time.perf_counter() - first_token
+        self.stats = {"ttft_s": ttft,
+                      "prefill_tokens_per_s": prompt_length / ttft if ttft > 0 else float("nan"),
+                      "decode_tokens_per_s": (len(generated_ids) - 1) / decode_time if decode_time > 0 else float("nan"),
+                      "generated_tokens": len(generated_ids)}
+        logger.info(f".....Speculative acceptance rate: {self.acceptance_rate:.2f}")
+        return target.tokenizer.decode(generated_ids, skip_special_tokens=True)
+
+    @staticmethod
+    def _logits_width(model: DeepSeekModelInference) -> Optional[int]:
+        width = model.session_mapper["HEAD"].get_outputs()[0].shape[-1]
+        return width if isinstance(width, int) else None
+
+    def _draft_step(self, token_id: int, position: int) -> np.array:
+        embedding_output = self.draft.embedding_session(query=np.array([[token_id]], dtype=np.int64))
+        hidden_states = self.draft.context_itr_session(embedding_session_output=embedding_output,
+                                                       previous_sequence_length=position,
+                                                       io_binding=False)
+        return self.draft.head_session(ctx_hidden_states=hidden_states)
+
+    def _accept(self, proposals: List[int],
+                draft_distributions: List[np.array],
+                target_distributions: np.array) -> List[int]:
+        """
+        Runs the rejection-sampling test over the proposals.
+
+        Returns:
+            List[int]: The accepted proposals followed by one token drawn from the target
+                (the residual distribution at the first rejection, or a bonus token if none was rejected).
+        """
+        accepted = []
+        width = target_distributions.shape[-1]
+        for i, proposal in enumerate(proposals):
+            p = target_distributions[i]
+            q = self._aligned(draft_distributions[i], width)
+            # Draft tokens beyond the target's logits have target probability 0 and are always rejected
+            if proposal < width and self.rng.random() * q[proposal] < p[proposal]:
+                accepted.append(proposal)
+                continue
+
+            residual = np.maximum(p - q, 0.0)
+            accepted.append(self._sample(residual if residual.sum() > 0 else p))
+            return accepted
+
+        accepted.append(self._sample(target_distributions[len(proposals)]))
+        return accepted
+
+    @staticmethod
+    def _aligned(distribution: np.array, width: int) -> np.array:
+        """
+        Zero-pads or cuts a draft distribution to the target's vocabulary width.
+        """
+        if len(distribution) >= width:
+            return distribution[:width]
+        return np.pad(distribution, (0, width - len(distribution)))
+
+    def _sample(self, distribution: np.array) -> int:
+        cumulative = np.cumsum(distribution, dtype=np.float64)
+        return int(min(np.searchsorted(cumulative, self.rng.random() * cumulative[-1], side="right"),
+                       len(cumulative) - 1))
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, Optional
+
+_DONE = object()
+
+@dataclass
+class TokenEvent:
+    """
+    A single generated token as produced by a streaming generator.
+
+    Attributes:
+        token_id (int): Generated token ID.
+        text (str): Text added to the response by this token (may be empty, e.g. for special tokens).
+        index (int): Position of the token within the generated sequence, starting at 0.
+        timestamp (float): `time.perf_counter()` value when the token was sampled.
+        elapsed (float): Seconds since generation started; for index 0 this is the time to first token.
+    """
+    token_id: int
+    text: str
+    index: int
+    timestamp: float
+    elapsed: float
+
+
+class StreamClock():
+    """
+    Stamps token events relative to the start of a generation.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    def event(self, token_id: int, text: str, index: int) -> TokenEvent:
+        now = time.perf_counter()
+        return TokenEvent(token_id=token_id, text=text, index=index, timestamp=now, elapsed=now - self.start)
+
+
+async def astream(events: Iterator[TokenEvent], cancel: Optional[threading.Event]=None) -> AsyncIterator[TokenEvent]:
+    """
+    Adapts a synchronous token generator into an async generator.
+
+    Every model step runs on a dedicated worker thread, so the event loop keeps serving other
+    requests while the sessions execute. If the consumer stops early (breaks out of the loop, is
+    cancelled, or calls `aclose`), `cancel` is set so the generator stops before its next model step,
+    and the generator is closed on the worker thread to release its buffers and bindings.
+
+    Args:
+        events (Iterator[TokenEvent]): Synchronous generator, e.g. from `DeepSeekModelInference.generate`.
+        cancel (Optional[threading.Event]): Cancellation flag polled by `events` between model steps.
+
+    Yields:
+        TokenEvent: Tokens as soon as they are sampled.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-stream")
+    try:
+        while True:
+            event = await loop.run_in_executor(executor, next, events, _DONE)
+            if event is _DONE:
+                return
+            yield event
+    finally:
+        if cancel is not None:
+            cancel.set()
+        # Queued behind any step still in flight; the executor runs one task at a time
+        executor.submit(events.close)
+        executor.shutdown(wait=False)
@@ -0,0 +1,164 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent/"src"))
+
+import json
+import unittest
+import numpy as np
+
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+
+from constrained_decoding import NUTRITION_SCHEMA, JSONConstraint, JSONSchemaAutomaton
+
+def compact(document) -> str:
+    return json.dumps(document, separators=(",", ":"))
+
+def train_tokenizer() -> Tokenizer:
+    # Small byte-level BPE, so the tests need no model files
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    corpus = [compact({"dish": "chicken salad", "ingredients": [{"name": "lettuce", "grams": 120.5, "percentage": 30}],
+                       "calories": 250})] * 20
+    trainer = trainers.BpeTrainer(vocab_size=400, special_tokens=["<eos>"],
+                                  initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+    tokenizer.train_from_iterator(corpus, trainer)
+    return tokenizer
+
+NUTRITION = {"dish": "rice bowl",
+             "ingredients": [{"name": "rice", "grams": 150, "percentage": 60.5},
+                             {"name": "egg", "grams": 50.25, "percentage": 100}],
+             "calories": 420}
+
+class JSONSchemaAutomatonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.automaton = JSONSchemaAutomaton(NUTRITION_SCHEMA)
+
+    def accepts(self, text: str, automaton: JSONSchemaAutomaton=None) -> bool:
+        automaton = automaton or self.automaton
+        state = automaton.advance(automaton.initial, text)
+        return state is not None and automaton.accepts(state)
+
+    def with_ingredient(self, **fields) -> str:
+        ingredient = dict(NUTRITION["ingredients"][0], **fields)
+        return compact(dict(NUTRITION, ingredients=[ingredient]))
+
+    def test_accepts_valid_documents(self):
+        self.assertTrue(self.accepts(compact(NUTRITION)))
+        self.assertTrue(self.accepts(compact(dict(NUTRITION, dish="", calories=0))))
+        self.assertTrue(self.accepts(self.with_ingredient(percentage=0)))
+        self.assertTrue(self.accepts(self.with_ingredient(percentage=100.0)))
+        self.assertTrue(self.accepts(self.with_ingredient(percentage=99.999)))
+        self.assertTrue(self.accepts(self.with_ingredient(grams=9999)))
+
+    def test_rejects_invalid_documents(self):
+        invalid = [
+            compact(NUTRITION)[:-1],
+            compact(dict(NUTRITION, ingredients=[])),
+            compact({"ingredients": NUTRITION["ingredients"], "dish": "rice", "calories": 1}),
+            json.dumps(NUTRITION),
+            self.with_ingredient(name=""),
+            self.with_ingredient(name="x" * 41),
+            self.with_ingredient(grams=-1),
+            self.with_ingredient(grams="150"),
+            compact(dict(NUTRITION, ingredients=NUTRITION["ingredients"] * 11)),
+        ]
+        for text in invalid:
+            with self.subTest(text=text):
+                self.assertFalse(self.accepts(text))
+
+    def test_enforces_maximum(self):
+        for percentage in ("101", "100.5", "100.001", "999", "1000"):
+            with self.subTest(percentage=percentage):
+                text = self.with_ingredient(percentage=0).replace('"percentage":0', f'"percentage":{percentage}')
+                self.assertFalse(self.accepts(text))
+        self.assertTrue(self.accepts(compact(dict(NUTRITION, calories=99999))))
+        self.assertFalse(self.accepts(compact(dict(NUTRITION, calories=100000))))
+
+    def test_literals_and_integers(self):
+        automaton = JSONSchemaAutomaton({"type": "object", "properties": {
+            "flag": {"type": "boolean"},
+            "size": {"enum": [1, 10, "x"]},
+            "none": {"type": "null"},
+            "version": {"const": 2},
+            "count": {"type": "integer", "minimum": 0, "maximum": 12},
+            "offsets": {"type": "array", "items": {"type": "integer"}},
+        }})
+        valid = ['{"flag":true,"size":10,"none":null,"version":2,"count":0,"offsets":[]}',
+                 '{"flag":false,"size":1,"none":null,"version":2,"count":12,"offsets":[-1,2]}',
+                 '{"flag":true,"size":"x","none":null,"version":2,"count":9,"offsets":[0]}']
+        invalid = ['{"flag":true,"size":10,"none":null,"version":2,"count":-1,"offsets":[]}',
+                   '{"flag":true,"size":10,"none":null,"version":2,"count":13,"offsets":[]}',
+                   '{"flag":true,"size":10,"none":null,"version":2,"count":01,"offsets":[]}',
+                   '{"flag":true,"size":10,"none":null,"version":2,"count":1.5,"offsets":[]}',
+                   '{"flag":true,"size":2,"none":null,"version":2,"count":1,"offsets":[]}',
+                   '{"flag":tru,"size":1}']
+        for text in valid:
+            with self.subTest(text=text):
+                self.assertTrue(self.accepts(text, automaton))
+        for text in invalid:
+            with self.subTest(text=text):
+                self.assertFalse(self.accepts(text, automaton))
+
+
+class JSONConstraintTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenizer = train_tokenizer()
+        cls.eos_token_id = cls.tokenizer.token_to_id("<eos>")
+
+    def setUp(self):
+        self.constraint = JSONConstraint(NUTRITION_SCHEMA, self.tokenizer, self.eos_token_id)
+
+    def test_masks_allow_valid_document(self):
+        for token_id in self.tokenizer.encode(compact(NUTRITION)).ids:
+            self.assertFalse(self.constraint.complete)
+            self.assertTrue(self.constraint.mask()[token_id])
+            self.assertFalse(self.constraint.mask()[self.eos_token_id])
+            self.constraint.advance(token_id)
+        self.assertTrue(self.constraint.complete)
+
+        mask = self.constraint.mask()
+        self.assertEqual(mask.shape, (self.constraint.trie.vocab_size,))
+        self.assertEqual(np.flatnonzero(mask).tolist(), [self.eos_token_id])
+        self.constraint.advance(self.eos_token_id)
+        self.assertTrue(self.constraint.complete)
+
+    def test_advance_rejects_disallowed_token(self):
+        token_id = self.tokenizer.token_to_id("a")
+        self.assertFalse(self.constraint.mask()[token_id])
+        with self.assertRaises(ValueError):
+            self.constraint.advance(token_id)
+
+    def test_sampled_documents_match_schema(self):
+        # Bounded cache: evicted masks are recomputed identically
+        constraint = JSONConstraint(NUTRITION_SCHEMA, self.tokenizer, self.eos_token_id,
+                                    trie=self.constraint.trie, max_cached_masks=8)
+        rng = np.random.default_rng(0)
+        for _ in range(10):
+            constraint.reset()
+            token_ids = []
+            while True:
+                mask = constraint.mask()
+                self.assertTrue(np.array_equal(mask, constraint.trie.allowed(constraint.automaton, constraint.state))
+                                or constraint.complete)
+                token_id = int(rng.choice(np.flatnonzero(mask)))
+                constraint.advance(token_id)
+                if token_id == self.eos_token_id:
+                    break
+                token_ids.append(token_id)
+            self.assertLessEqual(len(constraint._masks), 8)
+
+            document = json.loads(self.tokenizer.decode(token_ids))
+            self.assertEqual(list(document), ["dish", "ingredients", "calories"])
+            self.assertTrue(1 <= len(document["ingredients"]) <= 20)
+            for ingredient in document["ingredients"]:
+                self.assertTrue(1 <= len(ingredient["name"]) <= 40)
+                self.assertTrue(0 <= ingredient["grams"] <= 9999)
+                self.assertTrue(0 <= ingredient["percentage"] <= 100)
+            self.assertTrue(0 <= document["calories"] <= 99999)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent/"src"))
+
+import unittest
+import numpy as np
+
+from types import SimpleNamespace
+
+from speculative_decoding import SpeculativeDecoder
+
+VOCAB_SIZE = 6
+
+def model(width: int) -> SimpleNamespace:
+    # Only what the decoder reads outside of run_inference: the tokenizer and the HEAD output shape
+    head = SimpleNamespace(get_outputs=lambda: [SimpleNamespace(shape=[1, 1, width])])
+    return SimpleNamespace(tokenizer=SimpleNamespace(get_vocab_size=lambda: VOCAB_SIZE),
+                           session_mapper={"HEAD": head})
+
+class SpeculativeDecoderTest(unittest.TestCase):
+
+    def test_rejects_head_narrower_than_vocabulary(self):
+        with self.assertRaises(ValueError):
+            SpeculativeDecoder(draft=model(VOCAB_SIZE - 1), target=model(8))
+
+    def test_accept_with_different_widths(self):
+        # Padded logits of the HEADs are never sampled, as with the real tokenizers
+        target = np.array([0.1, 0.4, 0.2, 0.1, 0.15, 0.05, 0.0, 0.0, 0.0])
+        bonus = np.full(9, 1 / 9)
+        for draft_width in (7, 8, 9, 10):
+            with self.subTest(draft_width=draft_width):
+                decoder = SpeculativeDecoder(draft=model(draft_width), target=model(9), seed=0)
+                self.assertEqual((decoder.draft_width, decoder.target_width), (draft_width, 9))
+
+                draft = np.zeros(draft_width)
+                draft[:VOCAB_SIZE] = [0.5, 0.1, 0.1, 0.1, 0.1, 0.1]
+                counts = np.zeros(9)
+                for _ in range(20000):
+                    proposal = decoder._sample(draft)
+                    accepted = decoder._accept([proposal], [draft], np.stack([target, bonus]))
+                    counts[accepted[0]] += 1
+                # Rejection sampling keeps the target distribution, whatever the draft's width
+                np.testing.assert_allclose(counts / counts.sum(), target, atol=0.015)
+
+    def test_draft_token_beyond_target_is_rejected(self):
+        decoder = SpeculativeDecoder(draft=model(10), target=model(8), seed=0)
+        draft = np.zeros(10)
+        draft[9] = 1.0
+        target = np.zeros((2, 8))
+        target[:, 2] = 1.0
+        self.assertEqual(decoder._accept([9], [draft], target), [2])
+
+if __name__ == "__main__":
+    unittest.main()